@@ -0,0 +1,490 @@
+"""A benchmark of the route planner on synthetic networks.
+
+Each benchmark 'case' generates one of the networks in
+:py:data:`railmap.synthetic.NETWORKS` and runs fixed batches of queries
+against it:
+
+* 'one_to_one': Routes between randomly chosen pairs of stations.
+* 'one_to_all': Journey times from a randomly chosen station to all others.
+* 'multi_departure': Journey times from a randomly chosen station to all
+  others for a series of departure times throughout the day (as used when
+  producing maps of average journey times).
+
+All random choices are made from a pinned seed so that repeated runs (e.g.
+before and after a change) perform identical work. Each case is run in a
+freshly forked process so that the peak memory reported covers only that
+case.
+
+Separate benchmarks measure the map label placement (collision testing)
+(:py:func:`.run_label_benchmark`) and the travel-time heatmap rendering
+(:py:func:`.run_heatmap_benchmark`) used by ``railmap_draw``.
+"""
+
+import sys
+import random
+import logging
+import datetime
+import platform
+import resource
+import multiprocessing
+
+import numpy as np
+
+from time import perf_counter
+from collections import OrderedDict
+
+from railmap.synthetic import NETWORKS
+from railmap.server import route_query, one_to_all_query, LatencyRecorder
+from railmap.spatial import ObstructionTester
+from railmap.heatmap import iter_travel_time_tiles
+
+logger = logging.getLogger(__name__)
+
+
+QUERY_DATE = datetime.date(2016, 6, 1)
+"""The date on which all benchmark queries are made."""
+
+QUERY_TYPES = ("one_to_one", "one_to_all", "multi_departure")
+
+
+def make_queries(station_codes, seed, one_to_one=50, one_to_all=5,
+                 multi_departure=2, departures=6):
+    """Generate the (deterministic) batches of queries for a case.
+    
+    Parameters
+    ----------
+    station_codes : [str, ...]
+        The stations to choose origins and destinations from.
+    seed : int
+    one_to_one, one_to_all : int
+        The number of queries of each type.
+    multi_departure : int
+        The number of origins to perform multi-departure queries from.
+    departures : int
+        The number of departure times (spread between 06:00 and 20:00) for
+        each multi-departure origin.
+    
+    Returns
+    -------
+    {query_type: [query, ...], ...}
+        Each one-to-one query is a tuple (origin, destination, start_time),
+        each one-to-all query is a tuple (origin, start_time) and each
+        multi-departure query is a tuple (origin, [start_time, ...]).
+    """
+    rng = random.Random(seed)
+    station_codes = sorted(station_codes)
+    
+    def random_time():
+        return datetime.datetime.combine(QUERY_DATE, datetime.time(
+            rng.randint(6, 19), rng.randrange(60)))
+    
+    queries = OrderedDict()
+    queries["one_to_one"] = [
+        tuple(rng.sample(station_codes, 2)) + (random_time(), )
+        for _ in range(one_to_one)]
+    queries["one_to_all"] = [
+        (rng.choice(station_codes), random_time())
+        for _ in range(one_to_all)]
+    queries["multi_departure"] = [
+        (rng.choice(station_codes),
+         [datetime.datetime.combine(QUERY_DATE, datetime.time(6, 0)) +
+          datetime.timedelta(minutes=(14 * 60 * i) // departures)
+          for i in range(departures)])
+        for _ in range(multi_departure)]
+    return queries
+
+
+def _run_query(schedule, query_type, query):
+    """Internal use. Run a single benchmark query, returning a checksum of
+    its result."""
+    if query_type == "one_to_one":
+        origin, destination, start_time = query
+        return route_query(schedule, origin, destination,
+                           start_time)["duration"] or 0
+    elif query_type == "one_to_all":
+        origin, start_time = query
+        return sum(one_to_all_query(schedule, origin,
+                                    start_time)["durations"].values())
+    elif query_type == "multi_departure":
+        origin, start_times = query
+        return sum(sum(one_to_all_query(schedule, origin,
+                                        start_time)["durations"].values())
+                   for start_time in start_times)
+    else:
+        raise ValueError(query_type)
+
+
+def run_case(network, scale, seed=0, **query_counts):
+    """Generate a synthetic network and benchmark queries against it (in the
+    current process).
+    
+    Parameters
+    ----------
+    network, scale : str
+        Keys into :py:data:`railmap.synthetic.NETWORKS`.
+    seed : int
+        Seed used for both the network and the query choices.
+    **query_counts
+        Passed to :py:func:`.make_queries`.
+    
+    Returns
+    -------
+    dict
+        A JSON-serialisable summary of the case.
+    """
+    before = perf_counter()
+    schedule = NETWORKS[network][scale](seed)
+    build_seconds = perf_counter() - before
+    
+    station_codes = [tiploc.three_alpha_code
+                     for tiploc in schedule.tiplocs.values()
+                     if tiploc.three_alpha_code]
+    queries = make_queries(station_codes, seed, **query_counts)
+    
+    latencies = LatencyRecorder(window=None)
+    results = OrderedDict()
+    for query_type, batch in queries.items():
+        checksum = 0
+        before = perf_counter()
+        for query in batch:
+            query_before = perf_counter()
+            checksum += _run_query(schedule, query_type, query)
+            latencies.record(query_type, perf_counter() - query_before)
+        total_seconds = perf_counter() - before
+        
+        if batch:
+            result = latencies.summary()[query_type]
+            result["qps"] = round(len(batch) / total_seconds, 3)
+            result["checksum"] = checksum
+            results[query_type] = result
+    
+    return OrderedDict([
+        ("network", network),
+        ("scale", scale),
+        ("seed", seed),
+        ("tiplocs", len(schedule.tiplocs)),
+        ("trips", schedule.timetable.num_trips),
+        ("stops", schedule.timetable.num_stops),
+        ("timetable_bytes", schedule.timetable.nbytes),
+        ("build_seconds", round(build_seconds, 3)),
+        ("queries", results),
+        # NB: ru_maxrss is in KiB on Linux
+        ("peak_rss_bytes",
+         resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024),
+    ])
+
+
+def _run_case_child(conn, args, kwargs):
+    """Internal use. Run a case in a child process, sending the result (or
+    exception) down a pipe."""
+    try:
+        conn.send((True, run_case(*args, **kwargs)))
+    except Exception as e:
+        conn.send((False, "{}: {}".format(e.__class__.__name__, e)))
+    finally:
+        conn.close()
+
+
+def run_case_isolated(network, scale, seed=0, **query_counts):
+    """Like :py:func:`.run_case` but runs the case in a freshly forked
+    process so that its peak memory usage is not polluted by previous
+    cases."""
+    context = multiprocessing.get_context("fork")
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=_run_case_child,
+                              args=(child_conn,
+                                    (network, scale, seed),
+                                    query_counts))
+    process.start()
+    child_conn.close()
+    try:
+        ok, result = parent_conn.recv()
+    except EOFError:
+        ok, result = False, "Benchmark process exited with code {}".format(
+            process.exitcode)
+    process.join()
+    
+    if not ok:
+        raise RuntimeError("{} ({}): {}".format(network, scale, result))
+    return result
+
+
+def run_benchmark(networks=None, scales=("small", "medium"), seed=0,
+                  isolated=True, **query_counts):
+    """Run the benchmark for a set of networks and scales.
+    
+    Parameters
+    ----------
+    networks : [str, ...] or None
+        The network shapes to benchmark. All shapes in
+        :py:data:`railmap.synthetic.NETWORKS` if None.
+    scales : [str, ...]
+    seed : int
+    isolated : bool
+        If True, each case runs in its own process.
+    **query_counts
+        Passed to :py:func:`.make_queries`.
+    
+    Returns
+    -------
+    dict
+        A JSON-serialisable report.
+    """
+    if networks is None:
+        networks = sorted(NETWORKS)
+    
+    cases = []
+    for network in networks:
+        for scale in scales:
+            logger.info("Benchmarking %s (%s)...", network, scale)
+            if isolated:
+                case = run_case_isolated(network, scale, seed, **query_counts)
+            else:
+                case = run_case(network, scale, seed, **query_counts)
+            cases.append(case)
+    
+    return OrderedDict([
+        ("created", datetime.datetime.now().isoformat()),
+        ("python", sys.version.split()[0]),
+        ("platform", platform.platform()),
+        ("seed", seed),
+        ("cases", cases),
+    ])
+
+
+LABEL_EXTENT = (0.0, 0.0, 700000.0, 1250000.0)
+"""The area (eastings and northings, in metres, roughly covering Great
+Britain) over which benchmark labels are placed."""
+
+HEATMAP_MAX_WALKS = (3600, None)
+"""The walking time limits (seconds, or None for no limit) with which
+:py:func:`.run_heatmap_benchmark` renders each raster. 3600 is
+``railmap_draw``'s default."""
+
+LINEAR_LABEL_LIMIT = 20000
+"""The largest label count for which the (quadratic) linear-scan baseline is
+also timed by :py:func:`.run_label_benchmark`."""
+
+
+def make_labels(count, seed, size=5000.0):
+    """Generate random label rectangles (x1, y1, x2, y2) with the shape of
+    a three-character station name label of the given height, spread over
+    :py:data:`.LABEL_EXTENT`."""
+    rng = random.Random(seed)
+    min_x, min_y, max_x, max_y = LABEL_EXTENT
+    labels = []
+    for _ in range(count):
+        x = rng.uniform(min_x, max_x)
+        y = rng.uniform(min_y, max_y)
+        width = size * rng.uniform(1.5, 3.0)
+        labels.append((x, y + size / 2.0, x + width, y - size / 2.0))
+    return labels
+
+
+def _place_labels(labels, obstructions):
+    """Internal use. Place labels greedily (as ``railmap_draw`` does),
+    returning the number placed."""
+    placed = 0
+    for label in labels:
+        if label not in obstructions:
+            obstructions.add(*label)
+            placed += 1
+    return placed
+
+
+class _LinearObstructions(object):
+    """Internal use. The linear-scan obstruction test formerly used by
+    ``railmap_draw`` which serves as the label benchmark's baseline."""
+    
+    def __init__(self):
+        self.obstructions = []
+    
+    def add(self, x1,y1, x2,y2):
+        self.obstructions.append((x1,y1, x2,y2))
+    
+    def __contains__(self, rect):
+        ax1,ay1, ax2,ay2 = rect
+        for bx1,by1, bx2,by2 in self.obstructions:
+            if ax1 < bx2 and ax2 > bx1 and ay1 > by2 and ay2 < by1:
+                return True
+        return False
+
+
+def run_label_benchmark(counts=(10000, 100000), seed=0):
+    """Benchmark label placement for various numbers of labels.
+    
+    Returns
+    -------
+    [OrderedDict, ...]
+        For each label count, the number of labels placed and time taken
+        using :py:class:`railmap.spatial.ObstructionTester` and (for counts up
+        to :py:data:`.LINEAR_LABEL_LIMIT`) a linear scan of placed labels.
+        The number placed must be the same for both.
+    """
+    results = []
+    for count in counts:
+        logger.info("Benchmarking placement of %d labels...", count)
+        labels = make_labels(count, seed)
+        result = OrderedDict([("labels", count)])
+        
+        implementations = [("grid", ObstructionTester)]
+        if count <= LINEAR_LABEL_LIMIT:
+            implementations.append(("linear", _LinearObstructions))
+        for name, cls in implementations:
+            before = perf_counter()
+            placed = _place_labels(labels, cls())
+            result[name] = OrderedDict([
+                ("placed", placed),
+                ("seconds", round(perf_counter() - before, 4)),
+            ])
+        results.append(result)
+    
+    return results
+
+
+def make_heatmap_stations(count, seed):
+    """Generate random station positions spread over
+    :py:data:`.LABEL_EXTENT` and journey times to them.
+    
+    Journey times grow with the distance from a randomly chosen origin (at
+    an average speed of 100 km/h) plus up to an hour of waiting and changing
+    trains.
+    
+    Returns
+    -------
+    (station_xy, station_times)
+        A (count, 2) array of station positions (metres) and an array of
+        journey times (seconds).
+    """
+    rng = random.Random(seed)
+    min_x, min_y, max_x, max_y = LABEL_EXTENT
+    station_xy = np.array([(rng.uniform(min_x, max_x),
+                            rng.uniform(min_y, max_y))
+                           for _ in range(count)])
+    distances = np.hypot(*(station_xy - station_xy[0]).T)
+    station_times = (distances / (100.0 * 1000.0 / 3600.0) +
+                     np.array([rng.uniform(0.0, 3600.0)
+                               for _ in range(count)]))
+    station_times[0] = 0.0
+    return (station_xy, station_times)
+
+
+def run_heatmap_benchmark(sizes=(1000, 3000), stations=2500, seed=0):
+    """Benchmark travel-time heatmap rendering for various raster sizes.
+    
+    Parameters
+    ----------
+    sizes : [int, ...]
+        The width and height (pixels) of the square rasters to render,
+        covering :py:data:`.LABEL_EXTENT`.
+    stations : int
+        The number of stations (see :py:func:`.make_heatmap_stations`).
+    
+    Returns
+    -------
+    [OrderedDict, ...]
+        For each raster size and each of :py:data:`.HEATMAP_MAX_WALKS`, the
+        time taken. (Tiles are discarded as they are computed so that large
+        rasters need not fit in memory.)
+    """
+    station_xy, station_times = make_heatmap_stations(stations, seed)
+    
+    results = []
+    for size in sizes:
+        for max_walk in HEATMAP_MAX_WALKS:
+            logger.info("Benchmarking %dx%d heatmap (max_walk=%s)...",
+                        size, size, max_walk)
+            before = perf_counter()
+            for _ in iter_travel_time_tiles(station_xy, station_times,
+                                            LABEL_EXTENT, size, size,
+                                            max_walk=max_walk):
+                pass
+            seconds = perf_counter() - before
+            results.append(OrderedDict([
+                ("size", size),
+                ("stations", stations),
+                ("max_walk", max_walk),
+                ("seconds", round(seconds, 4)),
+                ("megapixels_per_second",
+                 round(size * size / seconds / 1e6, 3)),
+            ]))
+    
+    return results
+
+
+def compare(old, new):
+    """Compare two benchmark reports.
+    
+    Parameters
+    ----------
+    old, new : dict
+        Reports produced by :py:func:`.run_benchmark`.
+    
+    Returns
+    -------
+    [OrderedDict, ...]
+        One row for each query type of each case present in both reports
+        giving the old and new QPS, p50 and p99 latency (ms) and peak memory
+        (bytes) and the relative change in each. The 'results_match' field is
+        False if the query results differ (which indicates a behaviour change
+        rather than a purely performance one).
+    """
+    old_cases = {(c["network"], c["scale"]): c for c in old["cases"]}
+    
+    rows = []
+    for new_case in new["cases"]:
+        key = (new_case["network"], new_case["scale"])
+        old_case = old_cases.get(key)
+        if old_case is None:
+            continue
+        
+        for query_type in QUERY_TYPES:
+            old_result = old_case["queries"].get(query_type)
+            new_result = new_case["queries"].get(query_type)
+            if old_result is None or new_result is None:
+                continue
+            
+            row = OrderedDict([
+                ("network", key[0]),
+                ("scale", key[1]),
+                ("query", query_type),
+            ])
+            for name, old_value, new_value in [
+                    ("qps", old_result["qps"], new_result["qps"]),
+                    ("p50_ms", old_result["p50_ms"], new_result["p50_ms"]),
+                    ("p99_ms", old_result["p99_ms"], new_result["p99_ms"]),
+                    ("peak_rss_bytes",
+                     old_case["peak_rss_bytes"], new_case["peak_rss_bytes"])]:
+                row[name] = (old_value, new_value,
+                             (float(new_value) / old_value) - 1.0
+                             if old_value else None)
+            row["results_match"] = \
+                old_result["checksum"] == new_result["checksum"]
+            rows.append(row)
+    
+    return rows
+
+
+def format_comparison(rows):
+    """Format the output of :py:func:`.compare` as a plain-text table."""
+    header = ("network", "scale", "query",
+              "qps", "p50_ms", "p99_ms", "peak_rss_mb", "results")
+    lines = [header]
+    for row in rows:
+        cells = [row["network"], row["scale"], row["query"]]
+        for name in ("qps", "p50_ms", "p99_ms", "peak_rss_bytes"):
+            old_value, new_value, change = row[name]
+            if name == "peak_rss_bytes":
+                old_value /= 1024.0 * 1024.0
+                new_value /= 1024.0 * 1024.0
+            cells.append("{:.1f} -> {:.1f} ({})".format(
+                old_value, new_value,
+                "{:+.1%}".format(change) if change is not None else "n/a"))
+        cells.append("same" if row["results_match"] else "DIFFER")
+        lines.append(cells)
+    
+    widths = [max(len(line[i]) for line in lines)
+              for i in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(width)
+                               for cell, width in zip(line, widths)).rstrip()
+                     for line in lines)
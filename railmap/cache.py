@@ -0,0 +1,217 @@
+"""An on-disk cache of loaded schedules (and other derived data).
+
+Parsing a full CIF timetable takes far longer than loading an already-built
+:py:class:`railmap.route_planner.Schedule` from a pickle. Cached schedules are
+keyed by a hash of the contents of the source files along with the options
+they were loaded with so that a stale schedule is never used.
+:py:func:`.load_cached` provides the same mechanism for other expensive to
+compute data and :py:func:`.load_cached_arrays` for data held in NumPy arrays,
+which are memory-mapped rather than read in full.
+"""
+
+import os
+import json
+import pickle
+import shutil
+import hashlib
+import logging
+import tempfile
+
+import numpy as np
+
+from railmap.version import __version__
+from railmap.route_planner import load_schedule
+
+logger = logging.getLogger(__name__)
+
+
+CACHE_FORMAT = 2
+"""Bumped whenever the structure of cached schedules changes."""
+
+
+def hash_files(filenames):
+    """Compute a hash of the contents of a series of files.
+    
+    Parameters
+    ----------
+    filenames : [str or None, ...]
+        The files to hash. None (or a missing file) is hashed as a distinct
+        empty value.
+    
+    Returns
+    -------
+    str
+        A hexadecimal SHA-1 digest.
+    """
+    digest = hashlib.sha1()
+    for filename in filenames:
+        if filename is None or not os.path.exists(filename):
+            digest.update(b"\0missing\0")
+            continue
+        
+        digest.update(b"\0file\0")
+        with open(filename, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def schedule_key(mca_filename, msn_filename=None, flf_filename=None,
+                 **options):
+    """Compute the cache key for a schedule.
+    
+    Parameters
+    ----------
+    mca_filename, msn_filename, flf_filename : str or None
+    **options
+        The options passed to :py:func:`railmap.route_planner.load_schedule`.
+    
+    Returns
+    -------
+    str
+        A hexadecimal SHA-1 digest.
+    """
+    # NB: Sets of enums are sorted to give a stable representation
+    canonical_options = {
+        name: (sorted(str(v) for v in value)
+               if isinstance(value, (set, frozenset)) else str(value))
+        for name, value in options.items()}
+    
+    digest = hashlib.sha1()
+    digest.update(json.dumps([
+        CACHE_FORMAT,
+        __version__,
+        hash_files([mca_filename, msn_filename, flf_filename]),
+        canonical_options,
+    ], sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def load_cached(cache_dir, filename, load, description="data"):
+    """Load a pickled object from a cache directory, creating it if absent.
+    
+    Parameters
+    ----------
+    cache_dir : str
+        The directory holding cached files (created if necessary).
+    filename : str
+        The name of the cache file within cache_dir. This should incorporate
+        a key (e.g. from :py:func:`.hash_files`) which changes whenever the
+        cached object would.
+    load : callable
+        Called with no arguments to produce the object when it is not cached
+        (or the cached copy is unreadable).
+    description : str
+        A description of the object used in log messages.
+    """
+    filename = os.path.join(cache_dir, filename)
+    
+    if os.path.exists(filename):
+        logger.info("Loading cached %s %s", description, filename)
+        try:
+            with open(filename, "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            logger.exception("Failed to load cached %s %s, reloading",
+                             description, filename)
+    
+    value = load()
+    
+    # Write atomically so that concurrent or interrupted runs never see a
+    # partial file.
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, temp_filename = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+    logger.info("Cached %s in %s", description, filename)
+    
+    return value
+
+
+def load_cached_arrays(cache_dir, dirname, load, description="data"):
+    """Load a set of NumPy arrays from a cache directory, creating them if
+    absent.
+    
+    The arrays are stored as individual ``.npy`` files in a directory within
+    cache_dir and are memory-mapped (read-only) when loaded, so loading is
+    nearly instantaneous and only the parts of arrays actually used are read
+    from disk.
+    
+    Parameters
+    ----------
+    cache_dir : str
+        The directory holding cached files (created if necessary).
+    dirname : str
+        The name of the directory within cache_dir to store the arrays in.
+        As for :py:func:`.load_cached` this should incorporate a key.
+    load : callable
+        Called with no arguments to produce a {name: array, ...} dict when
+        the arrays are not cached (or the cached copy is unreadable).
+    description : str
+        A description of the arrays used in log messages.
+    
+    Returns
+    -------
+    {name: array, ...}
+    """
+    path = os.path.join(cache_dir, dirname)
+    
+    if os.path.isdir(path):
+        logger.info("Loading cached %s %s", description, path)
+        try:
+            return {
+                name[:-len(".npy")]: np.load(os.path.join(path, name),
+                                             mmap_mode="r")
+                for name in os.listdir(path)
+                if name.endswith(".npy")
+            }
+        except Exception:
+            logger.exception("Failed to load cached %s %s, reloading",
+                             description, path)
+            shutil.rmtree(path, ignore_errors=True)
+    
+    arrays = load()
+    
+    # As in load_cached, the arrays are written to a temporary directory
+    # which is then atomically renamed into place.
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = tempfile.mkdtemp(dir=cache_dir, suffix=".tmp")
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(temp_path, "{}.npy".format(name)),
+                    np.asarray(array))
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+            # Another process cached the same arrays first
+            if not os.path.isdir(path):
+                raise
+            shutil.rmtree(temp_path)
+    except BaseException:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+    logger.info("Cached %s in %s", description, path)
+    
+    return arrays
+
+
+def load_schedule_cached(cache_dir, mca_filename, msn_filename=None,
+                         flf_filename=None, **options):
+    """Load a schedule, using a cached copy if available.
+    
+    Takes the same arguments as
+    :py:func:`railmap.route_planner.load_schedule` along with the directory
+    to keep cached schedules in (which is created if necessary). Newly loaded
+    schedules are added to the cache.
+    """
+    key = schedule_key(mca_filename, msn_filename, flf_filename, **options)
+    return load_cached(
+        cache_dir, "schedule-{}.pickle".format(key),
+        lambda: load_schedule(mca_filename, msn_filename, flf_filename,
+                              **options),
+        "schedule")
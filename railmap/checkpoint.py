@@ -0,0 +1,116 @@
+"""An append-only store of completed journey time results.
+
+Long batch runs (e.g. journey times from every station at many times of day)
+record each result in a checkpoint file as soon as it is computed. If the run
+is interrupted, re-running it with the same checkpoint file skips the work
+already done.
+
+The checkpoint file is newline-delimited JSON. The first line records a key
+identifying the schedule and options the results were computed with (see
+:py:func:`railmap.cache.hash_files`) and each subsequent line holds one
+result. A partially written final line (e.g. if the process was killed mid
+write) is discarded when the checkpoint is reopened.
+"""
+
+import os
+import json
+import logging
+
+from array import array
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointMismatchError(Exception):
+    """Raised when a checkpoint file was created with a different key (i.e.
+    for a different schedule or options)."""
+
+
+class Checkpoint(object):
+    """An append-only store of journey durations keyed by origin and start
+    time."""
+    
+    def __init__(self, filename, key):
+        """Open (or create) a checkpoint file.
+        
+        Parameters
+        ----------
+        filename : str
+        key : str
+            Identifies the schedule and options results were computed with.
+        
+        Raises
+        ------
+        CheckpointMismatchError
+            If the file exists but was created with a different key.
+        """
+        self.filename = filename
+        self.key = key
+        
+        # {(origin, start_time_string): array, ...} loaded from the file
+        self._results = {}
+        
+        if os.path.exists(filename):
+            self._load()
+            self.f = open(filename, "a")
+        else:
+            self.f = open(filename, "w")
+            self.f.write(json.dumps({"key": key}) + "\n")
+            self.f.flush()
+    
+    def _load(self):
+        """Internal use. Read the results in an existing checkpoint file,
+        discarding any incomplete final line."""
+        with open(self.filename, "rb") as f:
+            header = f.readline()
+            if (not header.endswith(b"\n") or
+                    json.loads(header.decode("utf-8")).get("key") != self.key):
+                raise CheckpointMismatchError(
+                    "Checkpoint {} was created for a different schedule or "
+                    "options.".format(self.filename))
+            
+            good_length = f.tell()
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                record = json.loads(line.decode("utf-8"))
+                self._results[(record["origin"], record["start_time"])] = \
+                    array("l", record["durations"])
+                good_length += len(line)
+        
+        if good_length != os.path.getsize(self.filename):
+            logger.warning("Discarding incomplete record at end of %s",
+                           self.filename)
+            with open(self.filename, "r+b") as f:
+                f.truncate(good_length)
+        
+        logger.info("Loaded %d result(s) from checkpoint %s",
+                    len(self._results), self.filename)
+    
+    def __len__(self):
+        return len(self._results)
+    
+    def __contains__(self, origin_start_time):
+        origin, start_time = origin_start_time
+        return (origin, str(start_time)) in self._results
+    
+    def get(self, origin, start_time):
+        """Get the durations stored for an origin and start time (or None if
+        not present)."""
+        return self._results.get((origin, str(start_time)))
+    
+    def add(self, origin, start_time, durations):
+        """Append a result to the checkpoint.
+        
+        Results are written (and flushed) immediately but are not retained in
+        memory.
+        """
+        self.f.write(json.dumps({
+            "origin": origin,
+            "start_time": str(start_time),
+            "durations": list(durations),
+        }) + "\n")
+        self.f.flush()
+    
+    def close(self):
+        self.f.close()
@@ -304,7 +304,7 @@ def from_minutes_and_halves(s):
     s = s.strip("H ")
     
     return (int(s) * 60 if s else 0) + (30 if half else 0)
-        
+
 
 def from_day_set(s):
     """Read a binary-encoded days-of-week bitfield to an integer."""
@@ -461,9 +461,44 @@ RECORD_TYPES = {
 }
 
 
-def parse_mca(f):
+SCHEDULE_DETAIL_RECORDS = frozenset([
+    RecordIdentity.basic_schedule_extra_details,
+    RecordIdentity.origin_location,
+    RecordIdentity.intermediate_location,
+    RecordIdentity.terminating_location,
+    RecordIdentity.changes_en_route,
+])
+"""The record types which follow (and belong to) a basic schedule record."""
+
+
+def parse_mca(f, skip_schedule=None):
     """Parse a Timetable Information Service (TTIS) MCA (full timetable) file,
     generating each record in turn.
+    
+    Parameters
+    ----------
+    f : file
+    skip_schedule : fn(record) -> bool or None
+        If given, called with every basic schedule record. If it returns True,
+        neither that record nor any of the schedule's detail records (see
+        :py:data:`.SCHEDULE_DETAIL_RECORDS`) are generated; the detail records
+        are not even parsed.
     """
+    skipping = False
     for line in f:
-        yield RECORD_TYPES[RecordIdentity(line[:2])].from_string(line)
+        record_identity = RecordIdentity(line[:2])
+        if record_identity in SCHEDULE_DETAIL_RECORDS:
+            if skipping:
+                continue
+        else:
+            skipping = False
+        
+        record = RECORD_TYPES[record_identity].from_string(line)
+        
+        if (skip_schedule is not None and
+                record_identity == RecordIdentity.basic_schedule and
+                skip_schedule(record)):
+            skipping = True
+            continue
+        
+        yield record
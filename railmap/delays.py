@@ -0,0 +1,206 @@
+"""Real-time delays and cancellations overlaid on a static schedule.
+
+Reloading a :py:class:`railmap.route_planner.Schedule` from CIF data is far
+too slow to do whenever a train runs late. Instead, a
+:py:class:`.DelayOverlay` records the delay and cancellation status of every
+stop in the schedule's timetable for a single service date in a pair of flat
+arrays (so that the route planner can look up any stop in constant time).
+Overlays are built from a simple feed of delay reports and installed with
+:py:meth:`railmap.route_planner.Schedule.set_overlay`, replacing any previous
+overlay in one step.
+
+Delay feeds may be given as CSV files with a header row naming the following
+columns or as JSON files containing a list of objects with the same fields:
+
+* ``train_uid``: The train UID of the service.
+* ``tiploc``: The TIPLOC code the report applies to. If blank (or null), the
+  report applies to every stop of the train.
+* ``delay``: The delay in minutes (may be negative when running early).
+* ``cancelled``: If true (or '1', 'true', 'yes' in CSV files), the train does
+  not call at the TIPLOC (or at all when no TIPLOC is given).
+
+A JSON feed may alternatively be an object with a ``"delays"`` list and a
+``"date"`` (YYYY-MM-DD) giving the service date the reports apply to.
+
+A delay reported at a stop also applies to all following stops of the train
+until another delay is reported. Delays apply to stops scheduled on the
+overlay's date, services running on other dates are unaffected.
+"""
+
+import csv
+import json
+import logging
+import datetime
+import os.path
+
+from array import array
+from collections import namedtuple, defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+DelayRecord = namedtuple("DelayRecord", "train_uid,tiploc,delay,cancelled")
+"""A single report from a delay feed. The 'tiploc' may be None to refer to
+the whole train and the 'delay' is in minutes."""
+
+
+def _parse_bool(value):
+    """Internal use. Parse a boolean from a (CSV or JSON) feed value."""
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    else:
+        return bool(value)
+
+
+def _parse_record(fields):
+    """Internal use. Convert a dictionary of feed fields into a
+    :py:class:`.DelayRecord`."""
+    return DelayRecord(fields["train_uid"].strip(),
+                       (fields.get("tiploc") or "").strip() or None,
+                       int(fields.get("delay") or 0),
+                       _parse_bool(fields.get("cancelled") or False))
+
+
+def parse_delays(f, format="csv"):
+    """Parse a delay feed.
+    
+    Parameters
+    ----------
+    f : file
+    format : "csv" or "json"
+    
+    Returns
+    -------
+    (date, [:py:class:`.DelayRecord`, ...])
+        The service date given in the feed (or None if not given) and the
+        reports it contains.
+    """
+    if format == "csv":
+        return (None, [_parse_record(row) for row in csv.DictReader(f)])
+    elif format == "json":
+        data = json.load(f)
+        date = None
+        if isinstance(data, dict):
+            if data.get("date"):
+                date = datetime.datetime.strptime(data["date"],
+                                                  "%Y-%m-%d").date()
+            data = data.get("delays", [])
+        return (date, [_parse_record(fields) for fields in data])
+    else:
+        raise ValueError("Unknown delay feed format {!r}".format(format))
+
+
+class DelayOverlay(object):
+    """The delays and cancellations of a schedule's services on one date.
+    
+    Attributes
+    ----------
+    date : :py:class:`datetime.date`
+        The date the overlay applies to.
+    stop_delay : array
+        The delay (seconds) of each stop in the timetable.
+    stop_cancelled : array
+        Non-zero for each stop in the timetable which will not be called at.
+    unmatched : int
+        The number of reports which did not match a train (running on the
+        overlay's date) or TIPLOC in the schedule.
+    """
+    
+    def __init__(self, schedule, date, records=()):
+        """Build an overlay for a schedule.
+        
+        Parameters
+        ----------
+        schedule : :py:class:`railmap.route_planner.Schedule`
+            The overlay is only valid for use with this schedule (and must be
+            rebuilt if further services are loaded into it).
+        date : :py:class:`datetime.date`
+        records : [:py:class:`.DelayRecord`, ...]
+        """
+        self.date = date
+        
+        timetable = schedule.timetable
+        self.stop_delay = array("i", [0]) * timetable.num_stops
+        self.stop_cancelled = array("B", [0]) * timetable.num_stops
+        self.unmatched = 0
+        
+        # The trips running on the overlay date for each train UID
+        trips_running = defaultdict(list)
+        valid = [validity.valid_at(date) for validity in timetable.validities]
+        for trip, train_uid in enumerate(timetable.train_uids):
+            if valid[timetable.trip_validity[trip]]:
+                trips_running[train_uid].append(trip)
+        
+        # Group reports by trip {trip: {stop or None: record, ...}, ...}
+        trip_reports = defaultdict(dict)
+        for record in records:
+            tiploc = None
+            if record.tiploc is not None:
+                tiploc = schedule.tiplocs.get(record.tiploc)
+                if tiploc is None:
+                    self.unmatched += 1
+                    continue
+            
+            matched = False
+            for trip in trips_running.get(record.train_uid, ()):
+                if tiploc is None:
+                    trip_reports[trip][None] = record
+                    matched = True
+                else:
+                    for stop in timetable.trip_stops(trip):
+                        if timetable.stop_tiploc[stop] == tiploc.index:
+                            trip_reports[trip][stop] = record
+                            matched = True
+                            break
+            if not matched:
+                self.unmatched += 1
+        
+        # Apply the reports, carrying delays forward along each trip
+        for trip, reports in trip_reports.items():
+            whole_train = reports.get(None)
+            delay = whole_train.delay * 60 if whole_train else 0
+            cancelled = bool(whole_train and whole_train.cancelled)
+            for stop in timetable.trip_stops(trip):
+                record = reports.get(stop)
+                if record is not None:
+                    delay = record.delay * 60
+                self.stop_delay[stop] = delay
+                self.stop_cancelled[stop] = cancelled or bool(
+                    record is not None and record.cancelled)
+        
+        if self.unmatched:
+            logger.info("%d delay report(s) did not match a service running "
+                        "on %s", self.unmatched, date)
+    
+    def __repr__(self):
+        return "<{} for {}>".format(self.__class__.__name__, self.date)
+    
+    @property
+    def nbytes(self):
+        """The approximate memory used by the per-stop arrays."""
+        return sum(a.itemsize * len(a)
+                   for a in (self.stop_delay, self.stop_cancelled))
+
+
+def load_delays(schedule, filename, date=None):
+    """Load a delay feed file into a :py:class:`.DelayOverlay`.
+    
+    Parameters
+    ----------
+    schedule : :py:class:`railmap.route_planner.Schedule`
+    filename : str
+        A '.json' or '.csv' feed (see module documentation).
+    date : :py:class:`datetime.date` or None
+        The service date the reports apply to. If None, the date given in the
+        feed is used or, failing that, today's date.
+    """
+    _, ext = os.path.splitext(filename)
+    format = "json" if ext.lower() == ".json" else "csv"
+    with open(filename, "r", newline="") as f:
+        feed_date, records = parse_delays(f, format)
+    
+    if date is None:
+        date = feed_date or datetime.date.today()
+    
+    logger.debug("Loaded %d delay report(s) from %s", len(records), filename)
+    return DelayOverlay(schedule, date, records)
@@ -0,0 +1,180 @@
+"""Continuous travel-time surfaces.
+
+Given the journey time to every station (e.g. from
+:py:func:`railmap.scripts.draw_railmap.load_station_times`), the travel time
+to any point is the shortest time taken to reach some station and then walk
+(in a straight line) from that station to the point.
+
+Surfaces are computed on a raster one tile at a time. For each tile, the
+stations which could possibly be the best choice for some pixel in the tile
+are found by bounding the walking distance from each station to the nearest
+and furthest points of the tile: any station whose best case is worse than
+another station's worst case is discarded. Only the remaining (typically a
+handful of) stations are evaluated for every pixel, using vectorised NumPy
+operations.
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_WALKING_SPEED = 5.0 * 1000.0 / 3600.0
+"""The default walking speed (metres per second), 5 km/h."""
+
+
+def _tile_candidates(xs, ys, times, x1, y1, x2, y2, max_walk):
+    """Internal use. Find the stations which may give the shortest travel
+    time to some point within the rectangle (x1, y1, x2, y2).
+    
+    Parameters
+    ----------
+    xs, ys : array
+        Station coordinates, in units of seconds of walking.
+    times : array
+        Journey times to each station (seconds).
+    max_walk : float
+        The longest walk allowed (seconds, may be infinite).
+    
+    Returns
+    -------
+    array
+        The indices of the candidate stations.
+    """
+    # Distances to the nearest and furthest points of the rectangle
+    near_x = np.maximum(np.maximum(x1 - xs, xs - x2), 0.0)
+    near_y = np.maximum(np.maximum(y1 - ys, ys - y2), 0.0)
+    far_x = np.maximum(np.abs(xs - x1), np.abs(xs - x2))
+    far_y = np.maximum(np.abs(ys - y1), np.abs(ys - y2))
+    near = np.hypot(near_x, near_y)
+    far = np.hypot(far_x, far_y)
+    
+    # The worst travel time to anywhere in the rectangle (achieved via a
+    # station within walking distance of all of it)
+    reaches_all = far <= max_walk
+    if reaches_all.any():
+        worst = (times[reaches_all] + far[reaches_all]).min()
+    else:
+        worst = np.inf
+    
+    return np.flatnonzero((near <= max_walk) & (times + near <= worst))
+
+
+def iter_travel_time_tiles(station_xy, station_times, area, width, height,
+                           walking_speed=DEFAULT_WALKING_SPEED,
+                           max_walk=None, tile_size=256):
+    """Compute a travel-time raster one tile at a time.
+    
+    Parameters
+    ----------
+    station_xy : array
+        A (num_stations, 2) array of station (eastings, northings).
+    station_times : array
+        The journey time (seconds) to each station.
+    area : (min_x, min_y, max_x, max_y)
+        The area covered by the raster. The first row of the raster is the
+        northern edge.
+    width, height : int
+        The raster size (pixels).
+    walking_speed : float
+        Metres per second.
+    max_walk : float or None
+        If given, the longest walk (seconds) allowed from a station. Points
+        further from every station are unreachable.
+    tile_size : int
+        The width and height of each tile (pixels).
+    
+    Generates
+    ---------
+    (row, column, tile)
+        The (row, column) of the top-left pixel of each tile and a (rows,
+        columns) float32 array of travel times (seconds) with unreachable
+        points set to infinity.
+    """
+    min_x, min_y, max_x, max_y = area
+    pixel_width = (max_x - min_x) / width
+    pixel_height = (max_y - min_y) / height
+    max_walk = np.inf if max_walk is None else float(max_walk)
+    
+    # Work in units of seconds of walking to save a division per pixel
+    station_xy = np.asarray(station_xy, dtype=np.float64).reshape(-1, 2)
+    xs = station_xy[:, 0] / walking_speed
+    ys = station_xy[:, 1] / walking_speed
+    times = np.asarray(station_times, dtype=np.float64)
+    
+    # Pixel centres
+    pixel_xs = (min_x + (np.arange(width) + 0.5) * pixel_width) / walking_speed
+    pixel_ys = (max_y - (np.arange(height) + 0.5) * pixel_height) / \
+        walking_speed
+    
+    for row in range(0, height, tile_size):
+        tile_ys = pixel_ys[row:row + tile_size]
+        for column in range(0, width, tile_size):
+            tile_xs = pixel_xs[column:column + tile_size]
+            tile = np.full((len(tile_ys), len(tile_xs)), np.inf,
+                           dtype=np.float32)
+            
+            candidates = _tile_candidates(xs, ys, times,
+                                          tile_xs[0], tile_ys[-1],
+                                          tile_xs[-1], tile_ys[0], max_walk)
+            walk = np.empty_like(tile)
+            for station in candidates.tolist():
+                dx = tile_xs - xs[station]
+                dy = tile_ys - ys[station]
+                np.add((dy * dy).astype(np.float32)[:, None],
+                       (dx * dx).astype(np.float32)[None, :], out=walk)
+                np.sqrt(walk, out=walk)
+                if max_walk != np.inf:
+                    walk[walk > max_walk] = np.inf
+                walk += times[station]
+                np.minimum(tile, walk, out=tile)
+            
+            yield (row, column, tile)
+
+
+def travel_time_grid(station_xy, station_times, area, width, height,
+                     walking_speed=DEFAULT_WALKING_SPEED, max_walk=None,
+                     tile_size=256):
+    """Compute a travel-time raster. Takes the same arguments as
+    :py:func:`.iter_travel_time_tiles` and returns a (height, width) float32
+    array.
+    """
+    grid = np.empty((height, width), dtype=np.float32)
+    for row, column, tile in iter_travel_time_tiles(
+            station_xy, station_times, area, width, height, walking_speed,
+            max_walk, tile_size):
+        grid[row:row + tile.shape[0], column:column + tile.shape[1]] = tile
+    return grid
+
+
+def colour_times(times, colours):
+    """Colour an array of travel times.
+    
+    Parameters
+    ----------
+    times : array
+        Travel times (seconds), with unreachable points set to infinity.
+    colours : [(threshold, (r, g, b, a)), ...]
+        Sorted thresholds (seconds) and colours (components between 0 and 1),
+        as for station labels: each time takes the colour of the first
+        threshold it does not exceed (or the last colour if it exceeds all
+        of them).
+    
+    Returns
+    -------
+    array
+        A (..., 4) uint8 array of (r, g, b, a) colours. Unreachable points are
+        transparent.
+    """
+    palette = np.zeros((len(colours) + 1, 4), dtype=np.uint8)
+    palette[:-1] = np.round(np.array([colour for _, colour in colours]) * 255)
+    
+    # NB: Counting the thresholds exceeded is much faster than a binary
+    # search for the handful of colours typically used.
+    indices = np.zeros(np.shape(times), dtype=np.uint8)
+    for threshold, _ in colours[:-1]:
+        indices += times > threshold
+    indices[np.isinf(times)] = len(colours)
+    return palette[indices]
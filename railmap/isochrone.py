@@ -0,0 +1,337 @@
+"""Isochrone polygons: the areas reachable within given journey durations.
+
+The travel time to every point is first rasterised (see
+:py:mod:`railmap.heatmap`): the journey time to a station followed by a walk
+from it. The boundary of the area within each duration is then traced using
+the marching squares algorithm (interpolating between pixel centres),
+simplified using the Douglas-Peucker algorithm (see
+:py:func:`railmap.simplify.simplify_line`) and assembled into polygons with
+holes.
+
+Polygons are given in the coordinate system of the station locations, i.e.
+British National Grid (EPSG:27700) eastings and northings for the Network
+Rail Railway Network Inspire data, and may be written as GeoJSON (see
+:py:func:`.isochrone_geojson`).
+"""
+
+import logging
+
+import numpy as np
+
+from railmap.heatmap import travel_time_grid, DEFAULT_WALKING_SPEED
+from railmap.simplify import simplify_line
+
+logger = logging.getLogger(__name__)
+
+
+GEOJSON_CRS = {
+    "type": "name",
+    "properties": {"name": "urn:ogc:def:crs:EPSG::27700"},
+}
+"""The GeoJSON 'crs' member identifying British National Grid
+coordinates."""
+
+
+# The segments traced through a marching squares cell for each combination
+# of inside corners (bit 0: bottom-left, 1: bottom-right, 2: top-right, 3:
+# top-left) as (from_edge, to_edge) pairs of cell edges ('B'ottom, 'R'ight,
+# 'T'op, 'L'eft). Segments keep the inside on their left so that outer
+# boundaries run anticlockwise and holes clockwise. The two ambiguous
+# 'saddle' cases (5 and 10) have one entry for when the centre of the cell
+# is outside and another for when it is inside.
+_SEGMENTS = {
+    1: [("B", "L")],
+    2: [("R", "B")],
+    3: [("R", "L")],
+    4: [("T", "R")],
+    6: [("T", "B")],
+    7: [("T", "L")],
+    8: [("L", "T")],
+    9: [("B", "T")],
+    11: [("R", "T")],
+    12: [("L", "R")],
+    13: [("B", "R")],
+    14: [("L", "B")],
+}
+_SADDLE_SEGMENTS = {
+    # (case, centre_inside): segments
+    (5, False): [("B", "L"), ("T", "R")],
+    (5, True): [("B", "R"), ("T", "L")],
+    (10, False): [("R", "B"), ("L", "T")],
+    (10, True): [("L", "B"), ("R", "T")],
+}
+
+
+def contour_rings(grid, threshold, area):
+    """Trace the boundaries of the area of a raster whose values do not
+    exceed a threshold.
+    
+    Parameters
+    ----------
+    grid : array
+        A (height, width) array of values whose first row is the northern
+        edge (e.g. from :py:func:`railmap.heatmap.travel_time_grid`).
+        Non-finite values are treated as exceeding every threshold.
+    threshold : float
+    area : (min_x, min_y, max_x, max_y)
+        The area covered by the raster.
+    
+    Returns
+    -------
+    [[(x, y), ...], ...]
+        Closed rings (whose first and last points are equal). Outer
+        boundaries run anticlockwise and the boundaries of holes clockwise.
+    """
+    height, width = grid.shape
+    min_x, min_y, max_x, max_y = area
+    pixel_width = (max_x - min_x) / width
+    pixel_height = (max_y - min_y) / height
+    
+    # Flip the grid such that rows run south to north and pad it with values
+    # outside the area so that every boundary is closed.
+    outside = 2.0 * abs(threshold) + 1.0
+    values = np.full((height + 2, width + 2), threshold + outside)
+    values[1:-1, 1:-1] = np.where(np.isfinite(grid[::-1]),
+                                  np.minimum(grid[::-1], threshold + outside),
+                                  threshold + outside)
+    inside = values <= threshold
+    num_rows, num_columns = values.shape
+    
+    # The marching squares case of each cell, indexed [row, column]
+    cases = (inside[:-1, :-1] * 1 + inside[:-1, 1:] * 2 +
+             inside[1:, 1:] * 4 + inside[1:, :-1] * 8)
+    
+    # Only cells which the boundary passes through need be considered
+    cells = np.flatnonzero((cases != 0) & (cases != 15))
+    cases = cases.ravel()[cells]
+    cell_rows, cell_columns = np.divmod(cells, num_columns - 1)
+    centre_inside = (values[cell_rows, cell_columns] +
+                     values[cell_rows, cell_columns + 1] +
+                     values[cell_rows + 1, cell_columns + 1] +
+                     values[cell_rows + 1, cell_columns]) / 4.0 <= threshold
+    
+    # Edges are numbered by the grid point at their bottom/left end with
+    # horizontal edges followed by vertical ones.
+    vertical = num_rows * num_columns
+    
+    def edge_ids(edge, selected):
+        point = (cell_rows[selected] * num_columns +
+                 cell_columns[selected])
+        return {
+            "B": point,
+            "T": point + num_columns,
+            "L": vertical + point,
+            "R": vertical + point + 1,
+        }[edge]
+    
+    starts = []
+    ends = []
+    for key, segments in list(_SEGMENTS.items()) + \
+            list(_SADDLE_SEGMENTS.items()):
+        if isinstance(key, tuple):
+            case, centre = key
+            selected = (cases == case) & (centre_inside == centre)
+        else:
+            selected = cases == key
+        for from_edge, to_edge in segments:
+            starts.append(edge_ids(from_edge, selected))
+            ends.append(edge_ids(to_edge, selected))
+    starts = np.concatenate(starts)
+    ends = np.concatenate(ends)
+    
+    # Interpolate the position of the boundary along each edge crossed (in
+    # grid units, where grid point (column, row) = (x, y)).
+    is_vertical = starts >= vertical
+    points = starts - np.where(is_vertical, vertical, 0)
+    rows, columns = np.divmod(points, num_columns)
+    other = points + np.where(is_vertical, num_columns, 1)
+    a = values.ravel()[points]
+    b = values.ravel()[other]
+    t = np.clip((threshold - a) / (b - a), 0.0, 1.0)
+    xs = columns + np.where(is_vertical, 0.0, t)
+    ys = rows + np.where(is_vertical, t, 0.0)
+    
+    # Convert into map coordinates (grid point (1, 1) is the centre of the
+    # south-west pixel)
+    xs = min_x + (xs - 0.5) * pixel_width
+    ys = min_y + (ys - 0.5) * pixel_height
+    
+    # Link the segments into rings (every edge crossed starts exactly one
+    # segment and ends exactly one segment)
+    positions = dict(zip(starts.tolist(), zip(xs.tolist(), ys.tolist())))
+    successors = dict(zip(starts.tolist(), ends.tolist()))
+    rings = []
+    while successors:
+        first, edge = successors.popitem()
+        ring = [positions[first]]
+        while edge != first:
+            ring.append(positions[edge])
+            edge = successors.pop(edge)
+        ring.append(ring[0])
+        rings.append(ring)
+    return rings
+
+
+def ring_area(ring):
+    """The signed area of a closed ring: positive for anticlockwise rings and
+    negative for clockwise rings."""
+    coords = np.asarray(ring, dtype=np.float64)
+    x = coords[:, 0]
+    y = coords[:, 1]
+    return float(np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])) / 2.0
+
+
+def point_in_ring(point, ring):
+    """Test whether a point lies within a closed ring (using the even-odd
+    rule)."""
+    x, y = point
+    coords = np.asarray(ring, dtype=np.float64)
+    x1 = coords[:-1, 0]
+    y1 = coords[:-1, 1]
+    x2 = coords[1:, 0]
+    y2 = coords[1:, 1]
+    crosses = (y1 > y) != (y2 > y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        crossing_x = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    return bool(np.count_nonzero(crosses & (x < crossing_x)) % 2)
+
+
+def rings_to_polygons(rings):
+    """Assemble rings (as produced by :py:func:`.contour_rings`) into
+    polygons.
+    
+    Returns
+    -------
+    [[exterior, hole, ...], ...]
+        Each hole is assigned to the smallest outer boundary containing it.
+    """
+    exteriors = []
+    holes = []
+    for ring in rings:
+        area = ring_area(ring)
+        if area > 0:
+            exteriors.append((area, ring))
+        elif area < 0:
+            holes.append(ring)
+    
+    # Smallest first such that holes are assigned to the innermost exterior
+    exteriors.sort(key=lambda area_ring: area_ring[0])
+    polygons = [[ring] for _area, ring in exteriors]
+    for hole in holes:
+        for polygon in polygons:
+            if point_in_ring(hole[0], polygon[0]):
+                polygon.append(hole)
+                break
+    
+    # Largest first
+    return polygons[::-1]
+
+
+def isochrone_polygons(station_xy, station_times, minutes, resolution=250.0,
+                       walking_speed=DEFAULT_WALKING_SPEED, max_walk=None,
+                       tolerance=None):
+    """Compute isochrone polygons: the areas reachable by a journey to a
+    station followed by a walk within each of a set of durations.
+    
+    Parameters
+    ----------
+    station_xy : array
+        A (num_stations, 2) array of station (eastings, northings).
+    station_times : array
+        The journey time (seconds) to each station.
+    minutes : [number, ...]
+        The durations (minutes) to produce isochrones for.
+    resolution : float
+        The raster pixel size (metres).
+    walking_speed : float
+        Metres per second.
+    max_walk : float or None
+        If given, the longest walk (seconds) allowed from a station.
+    tolerance : float or None
+        The Douglas-Peucker simplification tolerance (metres). Defaults to
+        half of the resolution.
+    
+    Returns
+    -------
+    [(minutes, polygons), ...]
+        In order of increasing duration. Polygons are given as for
+        :py:func:`.rings_to_polygons`.
+    """
+    minutes = sorted(minutes)
+    if tolerance is None:
+        tolerance = resolution / 2.0
+    
+    station_xy = np.asarray(station_xy, dtype=np.float64).reshape(-1, 2)
+    station_times = np.asarray(station_times, dtype=np.float64)
+    
+    # Only stations reached within the longest duration matter
+    longest = max(minutes) * 60.0 if minutes else 0.0
+    reached = station_times <= longest
+    station_xy = station_xy[reached]
+    station_times = station_times[reached]
+    if not len(station_times):
+        return [(limit, []) for limit in minutes]
+    
+    # Cover everywhere within walking distance of those stations
+    walk = longest - station_times.min()
+    if max_walk is not None:
+        walk = min(walk, max_walk)
+    margin = walk * walking_speed + resolution
+    min_x, min_y = station_xy.min(axis=0) - margin
+    max_x, max_y = station_xy.max(axis=0) + margin
+    width = int(np.ceil((max_x - min_x) / resolution))
+    height = int(np.ceil((max_y - min_y) / resolution))
+    area = (min_x, min_y, min_x + width * resolution,
+            min_y + height * resolution)
+    
+    grid = travel_time_grid(station_xy, station_times, area, width, height,
+                            walking_speed, max_walk)
+    
+    out = []
+    for limit in minutes:
+        rings = []
+        for ring in contour_rings(grid, limit * 60.0, area):
+            ring = simplify_line(ring, tolerance)
+            if len(ring) >= 4:
+                rings.append(ring)
+        out.append((limit, rings_to_polygons(rings)))
+    return out
+
+
+def isochrone_geojson(isochrones, properties=None):
+    """Convert isochrones (as produced by :py:func:`.isochrone_polygons`) into
+    a GeoJSON FeatureCollection with one MultiPolygon feature per duration.
+    
+    Parameters
+    ----------
+    isochrones : [(minutes, polygons), ...]
+    properties : dict or None
+        Extra properties to give every feature (e.g. the origin).
+    
+    Returns
+    -------
+    dict
+        A JSON-serialisable dict. Coordinates are in EPSG:27700 (named by a
+        'crs' member).
+    """
+    features = []
+    for minutes, polygons in isochrones:
+        feature_properties = dict(properties or {})
+        feature_properties["minutes"] = minutes
+        features.append({
+            "type": "Feature",
+            "properties": feature_properties,
+            "geometry": {
+                "type": "MultiPolygon",
+                "coordinates": [
+                    [[[round(x, 1), round(y, 1)] for x, y in ring]
+                     for ring in polygon]
+                    for polygon in polygons
+                ],
+            },
+        })
+    return {
+        "type": "FeatureCollection",
+        "crs": GEOJSON_CRS,
+        "features": features,
+    }
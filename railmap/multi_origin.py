@@ -0,0 +1,427 @@
+"""Bit-parallel one-to-all journey times from many origins at once.
+
+Rather than running a separate route planner search for every origin, a
+'connection scan' is made through every train movement (connection) in
+departure-time order, carrying a set of origins along with each train. Sets
+of origins are represented as (arbitrarily long) Python integers with one
+bit per origin, so the work done for each connection is shared between all
+of the origins in a batch.
+
+For each TIPLOC, the scan keeps track of which origins have arrived there
+and, of those, which have had time to change trains (and so may board
+departing trains). For each run of a train (trip), it keeps track of which
+origins are on board. Arrivals at a TIPLOC are held in a heap of pending
+events until the scan reaches their time, allowing each TIPLOC's change time
+(and any walking transfers, taken from the schedule's transfer table) to be
+honoured before onward trains are boarded.
+
+The rules followed mirror those of :py:meth:`.Schedule.plan_route` (including
+any delay overlay, see :py:mod:`railmap.delays`) with two exceptions: only
+services departing within a fixed number of days of the start date are
+considered and trains running past midnight are treated as running on the
+day they started.
+"""
+
+import logging
+import datetime
+
+from array import array
+from bisect import bisect_left
+from heapq import heappush, heappop
+
+from railmap.timetable import NO_TIME, PICK_UP, SET_DOWN
+
+logger = logging.getLogger(__name__)
+
+
+UNREACHABLE = -1
+"""The duration reported for TIPLOCs which could not be reached."""
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Pending event types. Arrivals sort before (simultaneous) changes.
+_ARRIVE = 0
+_WALKED = 1
+_READY = 2
+
+
+def _iter_bits(mask):
+    """Internal use. Generate the indices of the set bits in an integer."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class Connections(object):
+    """The train movements of a timetable over a range of days, sorted by
+    departure time.
+    
+    Each connection is a movement between consecutive (non-pass-through)
+    stops of one run of a trip. Any delays and cancellations in the schedule's
+    overlay are applied.
+    
+    Attributes
+    ----------
+    start_date : :py:class:`datetime.date`
+        Times are given in seconds since midnight at the start of this date.
+    days : int
+        The number of days of services included. (Services which started on
+        the day before the start date are also included since they may run
+        past midnight.)
+    departure, arrival : array
+        The departure and arrival time of each connection.
+    from_stop, to_stop : array
+        The timetable stop indices of the start and end of each connection.
+    pick_up, set_down : array
+        Non-zero if passengers may board at the start (or alight at the end)
+        of each connection.
+    instance : array
+        The trip instance of each connection (see :py:meth:`.instance_day`).
+    """
+    
+    def __init__(self, schedule, start_date, days):
+        """Build the connections for the given schedule and dates."""
+        self.start_date = start_date
+        self.days = days
+        
+        timetable = schedule.timetable
+        timetable.build_index(len(schedule.tiploc_list))
+        stop_next = timetable.stop_next
+        stop_flags = timetable.stop_flags
+        stop_departure = timetable.stop_departure
+        trip_validity = timetable.trip_validity
+        validities = timetable.validities
+        
+        # Delays and cancellations apply to stops scheduled during the
+        # overlay's day (in seconds since start midnight).
+        overlay = schedule.overlay
+        if overlay is not None:
+            overlay_start = (overlay.date - start_date).days * SECONDS_PER_DAY
+            overlay_end = overlay_start + SECONDS_PER_DAY
+        
+        def stop_time(stop, time):
+            """The (possibly delayed) time at a stop and whether the stop is
+            cancelled."""
+            if overlay is not None and overlay_start <= time < overlay_end:
+                return (time + overlay.stop_delay[stop],
+                        overlay.stop_cancelled[stop])
+            else:
+                return (time, False)
+        
+        trip_times = [self._trip_times(timetable, trip)
+                      for trip in range(timetable.num_trips)]
+        
+        connections = []
+        for day in range(-1, days):
+            date = start_date + datetime.timedelta(days=day)
+            offset = day * SECONDS_PER_DAY
+            valid = [validity.valid_at(date) for validity in validities]
+            for trip, times in enumerate(trip_times):
+                if not valid[trip_validity[trip]]:
+                    continue
+                instance = trip * (days + 1) + day + 1
+                first_stop = timetable.trip_first_stop[trip]
+                stop = first_stop
+                while stop >= 0:
+                    next_stop = stop_next[stop]
+                    if next_stop >= 0:
+                        dep, dep_cancelled = stop_time(
+                            stop,
+                            offset + times[stop - first_stop][1])
+                        arr, arr_cancelled = stop_time(
+                            next_stop,
+                            offset + times[next_stop - first_stop][0])
+                        connections.append((
+                            dep,
+                            arr,
+                            instance,
+                            stop,
+                            next_stop,
+                            bool(stop_flags[stop] & PICK_UP and
+                                 stop_departure[stop] != NO_TIME and
+                                 not dep_cancelled),
+                            bool(stop_flags[next_stop] & SET_DOWN and
+                                 not arr_cancelled)))
+                    stop = next_stop
+        connections.sort()
+        
+        self.departure = array("l", (c[0] for c in connections))
+        self.arrival = array("l", (c[1] for c in connections))
+        self.instance = array("l", (c[2] for c in connections))
+        self.from_stop = array("l", (c[3] for c in connections))
+        self.to_stop = array("l", (c[4] for c in connections))
+        self.pick_up = array("B", (c[5] for c in connections))
+        self.set_down = array("B", (c[6] for c in connections))
+        
+        logger.debug("Built %d connections for %d day(s) from %s",
+                     len(connections), days, start_date)
+    
+    def __len__(self):
+        return len(self.departure)
+    
+    def instance_day(self, instance):
+        """Get the day (relative to the start date) on which a trip instance
+        started."""
+        return (instance % (self.days + 1)) - 1
+    
+    def instance_of(self, trip, day):
+        """Get the trip instance of a trip starting on the given day (relative
+        to the start date)."""
+        return trip * (self.days + 1) + day + 1
+    
+    @staticmethod
+    def _trip_times(timetable, trip):
+        """Internal use. Compute the (arrival, departure) time of each stop of
+        a trip in seconds since midnight on the day it started, resolving
+        unknown times and journeys past midnight."""
+        times = []
+        now = None
+        for stop in timetable.trip_stops(trip):
+            arrival = timetable.stop_arrival[stop]
+            departure = timetable.stop_departure[stop]
+            
+            out = []
+            for time in (arrival, departure):
+                if time == NO_TIME:
+                    time = now
+                elif now is not None:
+                    # Move past midnight as required
+                    time += (now // SECONDS_PER_DAY) * SECONDS_PER_DAY
+                    if time < now:
+                        time += SECONDS_PER_DAY
+                out.append(time)
+                if time is not None:
+                    now = time
+            
+            # The first stop has no arrival time
+            if out[0] is None:
+                out[0] = out[1]
+            times.append(out)
+        
+        # Stops before the first known time (should not happen in practice)
+        # are assumed to be at that time.
+        first_known = next((t for arr_dep in times for t in arr_dep
+                            if t is not None), 0)
+        return [(a if a is not None else first_known,
+                 d if d is not None else first_known)
+                for a, d in times]
+
+
+class MultiOriginScan(object):
+    """Computes one-to-all journey times for batches of origins using a
+    bit-parallel connection scan."""
+    
+    def __init__(self, schedule, days=2, batch_size=64):
+        """
+        Parameters
+        ----------
+        schedule : :py:class:`railmap.route_planner.Schedule`
+        days : int
+            The number of days (starting with the day of the start time) of
+            services to consider. Journeys which would arrive after the
+            services on these days have run will not be found.
+        batch_size : int
+            The number of origins processed together by
+            :py:meth:`.one_to_all`.
+        """
+        self.schedule = schedule
+        self.days = days
+        self.batch_size = batch_size
+        
+        # {start_date: Connections, ...} for the current schedule generation
+        self._connections = {}
+        self._generation = None
+    
+    def connections(self, start_date):
+        """Get the (cached) :py:class:`.Connections` starting from the given
+        date."""
+        if self._generation != self.schedule.generation:
+            self._connections.clear()
+            self._generation = self.schedule.generation
+        
+        connections = self._connections.get(start_date)
+        if connections is None:
+            connections = self._connections[start_date] = Connections(
+                self.schedule, start_date, self.days)
+        return connections
+    
+    def one_to_all(self, origin_tiploc_codes, start_time):
+        """Compute journey durations from many origins to all TIPLOCs.
+        
+        Parameters
+        ----------
+        origin_tiploc_codes : [str, ...]
+        start_time : :py:class:`datetime.datetime`
+            The time at which all journeys start.
+        
+        Generates
+        ---------
+        (origin_tiploc_code, durations)
+            For each origin, in order, an array giving the journey duration
+            (seconds) to each TIPLOC (by index) or :py:data:`.UNREACHABLE`.
+        """
+        origin_tiploc_codes = list(origin_tiploc_codes)
+        for i in range(0, len(origin_tiploc_codes), self.batch_size):
+            batch = origin_tiploc_codes[i:i + self.batch_size]
+            for origin, durations in zip(batch, self.scan(batch, start_time)):
+                yield (origin, durations)
+    
+    def scan(self, origin_tiploc_codes, start_time):
+        """Compute journey durations from a single batch of origins (of any
+        size) to all TIPLOCs.
+        
+        Returns
+        -------
+        [array, ...]
+            For each origin, an array giving the journey duration (seconds) to
+            each TIPLOC (by index) or :py:data:`.UNREACHABLE`.
+        """
+        schedule = self.schedule
+        schedule.build_transfers()
+        tiploc_list = schedule.tiploc_list
+        timetable = schedule.timetable
+        transfer_first = schedule.transfer_first
+        transfer_to = schedule.transfer_to
+        transfer_cost = schedule.transfer_cost
+        
+        start_midnight = datetime.datetime(start_time.year,
+                                           start_time.month,
+                                           start_time.day)
+        start = int((start_time - start_midnight).total_seconds())
+        connections = self.connections(start_midnight.date())
+        
+        stop_tiploc = timetable.stop_tiploc
+        stop_trip = timetable.stop_trip
+        links = timetable.links
+        validities = timetable.validities
+        
+        # Bitmasks of the origins which have arrived at each TIPLOC and those
+        # which are ready to board trains there.
+        arrived = [0] * len(tiploc_list)
+        ready = [0] * len(tiploc_list)
+        
+        # Bitmasks of the origins on board each trip instance.
+        on_board = {}
+        
+        # The arrival time (seconds since start midnight) of each origin at
+        # each TIPLOC.
+        arrival_times = [array("l", [UNREACHABLE]) * len(tiploc_list)
+                         for _ in origin_tiploc_codes]
+        
+        # Pending events (time, event_type, tiploc_index, mask)
+        pending = []
+        
+        def settle(now, tiploc_index, mask, change):
+            """Record the arrival of some origins at a TIPLOC, returning the
+            origins which had not already arrived."""
+            new = mask & ~arrived[tiploc_index]
+            if new:
+                arrived[tiploc_index] |= new
+                for bit in _iter_bits(new):
+                    arrival_times[bit][tiploc_index] = now
+                
+                # Allow time to change platform etc. if already travelling
+                after_change = now
+                if change:
+                    after_change += tiploc_list[tiploc_index].change_time * 60
+                heappush(pending, (after_change, _READY, tiploc_index, new))
+            return new
+        
+        def start_at(now, tiploc_index, mask):
+            """Start some origins at a TIPLOC (and the other TIPLOCs of the
+            same station) with no change time."""
+            for tiploc in tiploc_list[tiploc_index].same_station:
+                new = settle(now, tiploc.index, mask, False)
+                
+                # Non-rail transfers from here
+                if new:
+                    for segment in tiploc.segments:
+                        if segment.take_up:
+                            for next_segment, _ in segment.destinations:
+                                heappush(pending, (
+                                    now + segment.duration * 60,
+                                    _ARRIVE,
+                                    next_segment.tiploc.index,
+                                    new))
+        
+        def arrive(now, tiploc_index, mask):
+            """Record the arrival of some origins at a TIPLOC and everywhere
+            reachable on foot from it."""
+            new = mask & ~arrived[tiploc_index]
+            if not new:
+                return
+            for i in range(transfer_first[tiploc_index],
+                           transfer_first[tiploc_index + 1]):
+                cost = transfer_cost[i]
+                if cost == 0:
+                    settle(now, transfer_to[i], new, True)
+                else:
+                    heappush(pending, (now + cost, _WALKED,
+                                       transfer_to[i], new))
+        
+        def process_pending(until):
+            """Process all pending events up to (and including) a time."""
+            while pending and pending[0][0] <= until:
+                now, event_type, tiploc_index, mask = heappop(pending)
+                if event_type == _ARRIVE:
+                    arrive(now, tiploc_index, mask)
+                elif event_type == _WALKED:
+                    settle(now, tiploc_index, mask, True)
+                else:
+                    ready[tiploc_index] |= mask
+        
+        # Start all origins
+        for bit, origin in enumerate(origin_tiploc_codes):
+            start_at(start, schedule.tiplocs[origin].index, 1 << bit)
+        
+        departure = connections.departure
+        arrival = connections.arrival
+        instance = connections.instance
+        from_stop = connections.from_stop
+        to_stop = connections.to_stop
+        pick_up = connections.pick_up
+        set_down = connections.set_down
+        
+        for c in range(bisect_left(departure, start), len(connections)):
+            process_pending(departure[c])
+            
+            stop = from_stop[c]
+            trip_instance = instance[c]
+            mask = on_board.get(trip_instance, 0)
+            
+            # Board
+            if pick_up[c]:
+                boarding = ready[stop_tiploc[stop]] & ~mask
+                if boarding:
+                    mask |= boarding
+                    on_board[trip_instance] = mask
+            
+            if not mask:
+                continue
+            
+            # Alight
+            next_stop = to_stop[c]
+            if set_down[c]:
+                heappush(pending, (arrival[c], _ARRIVE,
+                                   stop_tiploc[next_stop], mask))
+            
+            # Join or divide onto another trip (on the same day)
+            if next_stop in links:
+                day = connections.instance_day(trip_instance)
+                date = connections.start_date + datetime.timedelta(days=day)
+                for other_stop, validity_id in links[next_stop]:
+                    if validities[validity_id].valid_at(date):
+                        other_instance = connections.instance_of(
+                            stop_trip[other_stop], day)
+                        on_board[other_instance] = \
+                            on_board.get(other_instance, 0) | mask
+        
+        process_pending(float("inf"))
+        
+        # Convert arrival times into durations
+        for times in arrival_times:
+            for i, time in enumerate(times):
+                if time != UNREACHABLE:
+                    times[i] = time - start
+        return arrival_times
@@ -0,0 +1,304 @@
+"""Writers for (potentially very large) sets of journey time results.
+
+Results are produced one origin (and start time) at a time as an array of
+integer journey durations (seconds) to every station, in the order given by a
+:py:class:`.StationIndex`. Each writer streams these to a file as they arrive
+rather than accumulating them in memory:
+
+* :py:class:`.CSVWriter`: One ``start_station,start_time,station,duration``
+  row per reachable station (the traditional ``railmap_station_times``
+  output).
+* :py:class:`.NDJSONWriter`: One JSON object per origin and start time.
+* :py:class:`.NpyWriter`: A dense matrix of durations with one row per origin
+  and start time and one column per station in NumPy's ``.npy`` format (which
+  is written directly, NumPy is not required) along with sidecar files
+  listing the stations and origins. These may be read back using a
+  :py:class:`.NpyReader`.
+"""
+
+import ast
+import sys
+import csv
+import json
+import struct
+import os.path
+
+from array import array
+
+from railmap.multi_origin import UNREACHABLE
+
+
+FORMATS = ("csv", "ndjson", "npy")
+"""The supported output formats."""
+
+
+class StationIndex(object):
+    """Maps TIPLOCs onto the stations (three-alpha-codes) they belong to.
+    
+    Attributes
+    ----------
+    station_codes : (str, ...)
+        The three-alpha-codes of all stations in the schedule, sorted.
+    tiploc_station : array
+        The index (into station_codes) of the station of each TIPLOC (by
+        TIPLOC index), or -1 for TIPLOCs which are not part of a station.
+    """
+    
+    def __init__(self, schedule):
+        self.station_codes = tuple(sorted(set(
+            tiploc.three_alpha_code
+            for tiploc in schedule.tiploc_list
+            if tiploc.three_alpha_code)))
+        
+        index = {code: i for i, code in enumerate(self.station_codes)}
+        self.tiploc_station = array("l", (
+            index.get(tiploc.three_alpha_code, -1)
+            for tiploc in schedule.tiploc_list))
+    
+    def __len__(self):
+        return len(self.station_codes)
+    
+    def station_durations(self, tiploc_durations):
+        """Convert journey durations to each TIPLOC into the shortest journey
+        duration to each station.
+        
+        Parameters
+        ----------
+        tiploc_durations : [int, ...]
+            The duration (seconds) of the journey to each TIPLOC (by index) or
+            :py:data:`railmap.multi_origin.UNREACHABLE`.
+        
+        Returns
+        -------
+        array
+            The duration (seconds) of the journey to each station or
+            :py:data:`railmap.multi_origin.UNREACHABLE`.
+        """
+        out = array("l", [UNREACHABLE]) * len(self.station_codes)
+        for station, duration in zip(self.tiploc_station, tiploc_durations):
+            if (station >= 0 and duration != UNREACHABLE and
+                    (out[station] == UNREACHABLE or duration < out[station])):
+                out[station] = duration
+        return out
+
+
+class CSVWriter(object):
+    """Writes results as CSV with one row per reachable station."""
+    
+    def __init__(self, f, station_codes):
+        """
+        Parameters
+        ----------
+        f : file
+            A text file to write to.
+        station_codes : [str, ...]
+            The station codes corresponding to the durations written.
+        """
+        self.f = f
+        self.station_codes = station_codes
+        self.f.write("start_station,start_time,station,duration\n")
+    
+    def write(self, origin, start_time, durations):
+        """Write the journey durations from an origin at a given start time.
+        
+        Parameters
+        ----------
+        origin : str
+            The three-alpha-code of the origin station.
+        start_time : :py:class:`datetime.datetime`
+        durations : [int, ...]
+            The duration (seconds) of the journey to each station or
+            :py:data:`railmap.multi_origin.UNREACHABLE`.
+        """
+        prefix = "{},{},".format(origin, start_time)
+        self.f.write("".join(
+            "{}{},{}\n".format(prefix, station, duration)
+            for station, duration in zip(self.station_codes, durations)
+            if duration != UNREACHABLE))
+    
+    def close(self):
+        if self.f is sys.stdout:
+            self.f.flush()
+        else:
+            self.f.close()
+
+
+class NDJSONWriter(object):
+    """Writes results as newline-delimited JSON with one object per origin
+    and start time of the form::
+        
+        {"start_station": "MAN",
+         "start_time": "2016-08-15 09:00:00",
+         "durations": {"EUS": 7800, ...}}
+    
+    Unreachable stations are omitted from "durations".
+    """
+    
+    def __init__(self, f, station_codes):
+        """See :py:class:`.CSVWriter`."""
+        self.f = f
+        self.station_codes = station_codes
+    
+    def write(self, origin, start_time, durations):
+        """See :py:meth:`.CSVWriter.write`."""
+        self.f.write(json.dumps({
+            "start_station": origin,
+            "start_time": str(start_time),
+            "durations": {
+                station: duration
+                for station, duration in zip(self.station_codes, durations)
+                if duration != UNREACHABLE},
+        }, sort_keys=True))
+        self.f.write("\n")
+    
+    def close(self):
+        if self.f is sys.stdout:
+            self.f.flush()
+        else:
+            self.f.close()
+
+
+class NpyWriter(object):
+    """Writes results as a matrix of 32-bit integer durations (seconds) in
+    NumPy's ``.npy`` format.
+    
+    Each row gives the journey durations from one origin and start time to
+    every station, with :py:data:`railmap.multi_origin.UNREACHABLE` for
+    stations which cannot be reached. Two sidecar files are written alongside
+    the matrix: ``<name>.stations.txt`` lists the station code of each column
+    (one per line) and ``<name>.origins.csv`` lists the start station and
+    start time of each row.
+    
+    Rows are appended as they are written and the header (which records the
+    number of rows) is rewritten by :py:meth:`.close`.
+    """
+    
+    # A fixed-size header is reserved so that the row count can be filled in
+    # once known. (Must be a multiple of 64 bytes.)
+    HEADER_SIZE = 128
+    
+    def __init__(self, filename, station_codes):
+        """
+        Parameters
+        ----------
+        filename : str
+            The '.npy' file to write.
+        station_codes : [str, ...]
+            The station codes corresponding to the durations written.
+        """
+        self.station_codes = station_codes
+        self.rows = 0
+        
+        base, _ = os.path.splitext(filename)
+        with open("{}.stations.txt".format(base), "w") as f:
+            f.write("".join("{}\n".format(code) for code in station_codes))
+        self.origins_file = open("{}.origins.csv".format(base), "w")
+        self.origins_file.write("start_station,start_time\n")
+        
+        self.f = open(filename, "wb")
+        self._write_header()
+    
+    def _write_header(self):
+        """Internal use. (Re)write the .npy header at the start of the
+        file."""
+        header = "{{'descr': '{}i4', 'fortran_order': False, " \
+                 "'shape': ({}, {}), }}".format(
+                     "<" if sys.byteorder == "little" else ">",
+                     self.rows, len(self.station_codes))
+        prefix = b"\x93NUMPY\x01\x00"
+        padding = self.HEADER_SIZE - len(prefix) - 2 - len(header) - 1
+        header = (header + " " * padding + "\n").encode("latin1")
+        
+        self.f.seek(0)
+        self.f.write(prefix + struct.pack("<H", len(header)) + header)
+        self.f.seek(0, os.SEEK_END)
+    
+    def write(self, origin, start_time, durations):
+        """See :py:meth:`.CSVWriter.write`."""
+        array("i", durations).tofile(self.f)
+        self.origins_file.write("{},{}\n".format(origin, start_time))
+        self.rows += 1
+    
+    def close(self):
+        self._write_header()
+        self.f.close()
+        self.origins_file.close()
+
+
+class NpyReader(object):
+    """Reads back the results written by a :py:class:`.NpyWriter`, one row at
+    a time.
+    
+    Attributes
+    ----------
+    station_codes : [str, ...]
+        The station code of each column.
+    origins : [(start_station, start_time), ...]
+        The start station and time (as a string) of each row.
+    """
+    
+    def __init__(self, filename):
+        self.filename = filename
+        
+        base, _ = os.path.splitext(filename)
+        with open("{}.stations.txt".format(base), "r") as f:
+            self.station_codes = f.read().split()
+        with open("{}.origins.csv".format(base), "r", newline="") as f:
+            self.origins = [(row["start_station"], row["start_time"])
+                            for row in csv.DictReader(f)]
+    
+    def __len__(self):
+        return len(self.origins)
+    
+    def __iter__(self):
+        """Iterate over (start_station, start_time, durations) tuples where
+        durations is an array giving the duration to each station."""
+        with open(self.filename, "rb") as f:
+            prefix = f.read(10)
+            if prefix[:6] != b"\x93NUMPY":
+                raise ValueError("{} is not a .npy file".format(
+                    self.filename))
+            header_length = struct.unpack("<H", prefix[8:10])[0]
+            header = ast.literal_eval(f.read(header_length).decode("latin1"))
+            rows, columns = header["shape"]
+            if (header["descr"][1:] != "i4" or header["fortran_order"] or
+                    columns != len(self.station_codes) or
+                    rows != len(self.origins)):
+                raise ValueError("{} was not written by railmap".format(
+                    self.filename))
+            swap = header["descr"][0] != ("<" if sys.byteorder == "little"
+                                          else ">")
+            
+            for start_station, start_time in self.origins:
+                durations = array("i")
+                durations.fromfile(f, columns)
+                if swap:
+                    durations.byteswap()
+                yield (start_station, start_time, durations)
+
+
+def open_writer(format, filename, station_codes):
+    """Create a writer for the given format.
+    
+    Parameters
+    ----------
+    format : str
+        One of :py:data:`.FORMATS`.
+    filename : str or None
+        The file to write to. For text formats, None means stdout.
+    station_codes : [str, ...]
+    """
+    if format == "npy":
+        if filename is None:
+            raise ValueError("An output filename is required for npy output")
+        return NpyWriter(filename, station_codes)
+    elif format in ("csv", "ndjson"):
+        if filename is None:
+            f = sys.stdout
+        else:
+            # NB: A large buffer since many small writes are made
+            f = open(filename, "w", buffering=1024 * 1024)
+        cls = CSVWriter if format == "csv" else NDJSONWriter
+        return cls(f, station_codes)
+    else:
+        raise ValueError("Unknown output format {!r}".format(format))
@@ -0,0 +1,272 @@
+"""A memory-bounded cache of route planner results.
+
+Popular origins tend to be queried repeatedly at almost identical times. To
+avoid recomputing the same route planner search each time, queries are keyed
+by their origin, service date and departure time rounded down to a
+configurable 'bucket' (along with any other query options). Queries falling
+into the same bucket are answered as if they had been made at the start of
+the bucket and so can share a result.
+
+The cache is bound to a particular :py:class:`.Schedule` and is emptied
+automatically whenever a different schedule is bound or the bound schedule
+reports that it has changed (see :py:meth:`.Schedule.changed`).
+"""
+
+import sys
+import datetime
+
+from array import array
+from collections import OrderedDict
+
+
+def round_time(start_time, bucket):
+    """Round a datetime down to the start of its time bucket.
+    
+    Parameters
+    ----------
+    start_time : :py:class:`datetime.datetime`
+    bucket : :py:class:`datetime.timedelta`
+        The bucket width. Buckets are aligned to midnight.
+    
+    Returns
+    -------
+    :py:class:`datetime.datetime`
+    """
+    midnight = start_time.replace(hour=0, minute=0, second=0, microsecond=0)
+    bucket_seconds = int(bucket.total_seconds())
+    if bucket_seconds <= 0:
+        return start_time
+    
+    seconds = int((start_time - midnight).total_seconds())
+    return midnight + datetime.timedelta(
+        seconds=seconds - (seconds % bucket_seconds))
+
+
+class OneToAllResult(object):
+    """A compact one-to-all route planner result.
+    
+    Journey durations are held in an array with one entry per station (in the
+    order given by the station code list it was created with) rather than as a
+    dictionary of datetimes.
+    """
+    
+    __slots__ = ["station_codes", "durations"]
+    
+    UNREACHABLE = -1
+    """The duration recorded for unreachable stations."""
+    
+    def __init__(self, station_codes, durations):
+        """
+        Parameters
+        ----------
+        station_codes : (str, ...)
+            The (three-alpha) station codes corresponding with each entry of
+            the durations array. This tuple is expected to be shared between
+            all results.
+        durations : :py:class:`array.array`
+            The journey duration (seconds) to each station or
+            :py:attr:`.UNREACHABLE`.
+        """
+        self.station_codes = station_codes
+        self.durations = durations
+    
+    @classmethod
+    def from_dict(cls, station_codes, station_index, durations):
+        """Create a result from a dict {station_code: seconds, ...}.
+        
+        Parameters
+        ----------
+        station_codes : (str, ...)
+        station_index : {station_code: index, ...}
+            The index of each station code in station_codes. Stations not in
+            this index are ignored.
+        durations : {station_code: seconds, ...}
+        """
+        out = array("l", [cls.UNREACHABLE]) * len(station_codes)
+        for station_code, duration in durations.items():
+            index = station_index.get(station_code)
+            if index is not None:
+                out[index] = int(duration)
+        return cls(station_codes, out)
+    
+    def to_dict(self):
+        """Return a dict {station_code: seconds, ...} of reachable stations."""
+        return {station_code: duration
+                for station_code, duration in zip(self.station_codes,
+                                                  self.durations)
+                if duration != self.UNREACHABLE}
+    
+    @property
+    def nbytes(self):
+        """Approximate memory used by this result (not including the shared
+        station code list)."""
+        return (sys.getsizeof(self) +
+                sys.getsizeof(self.durations))
+
+
+class QueryCache(object):
+    """A least-recently-used cache of query results with a memory limit."""
+    
+    def __init__(self, max_bytes=64*1024*1024,
+                 bucket=datetime.timedelta(minutes=5)):
+        """Create an empty cache.
+        
+        Parameters
+        ----------
+        max_bytes : int
+            The (approximate) maximum number of bytes of results to retain.
+            Least-recently used results are evicted first.
+        bucket : :py:class:`datetime.timedelta`
+            The departure-time rounding granularity.
+        """
+        self.max_bytes = max_bytes
+        self.bucket = bucket
+        
+        # {key: (value, nbytes), ...} in least-recently-used-first order.
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        
+        self.schedule = None
+        self.generation = None
+        self.station_codes = ()
+        self.station_index = {}
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+    
+    def bind(self, schedule):
+        """Bind the cache to a schedule, invalidating any existing entries."""
+        self.schedule = schedule
+        self.generation = schedule.generation
+        self.station_codes = tuple(sorted(set(
+            tiploc.three_alpha_code
+            for tiploc in schedule.tiplocs.values()
+            if tiploc.three_alpha_code)))
+        self.station_index = {code: i
+                              for i, code in enumerate(self.station_codes)}
+        self.clear()
+    
+    def clear(self):
+        """Remove all entries from the cache."""
+        if self.entries:
+            self.invalidations += 1
+        self.entries.clear()
+        self.nbytes = 0
+    
+    def _check_schedule(self):
+        """Internal use. Invalidate the cache if the schedule has changed."""
+        if (self.schedule is not None and
+                self.schedule.generation != self.generation):
+            self.bind(self.schedule)
+    
+    def key(self, kind, origin, start_time, **options):
+        """Construct the cache key for a query.
+        
+        Parameters
+        ----------
+        kind : str
+            The type of query (e.g. 'one_to_all').
+        origin : str
+            The starting station.
+        start_time : :py:class:`datetime.datetime`
+            The requested departure time.
+        **options
+            Any other (hashable) query options which affect the result.
+        
+        Returns
+        -------
+        (key, rounded_start_time)
+            The key under which the result is cached and the start time which
+            should be used to compute the result.
+        """
+        rounded_start_time = round_time(start_time, self.bucket)
+        key = (kind,
+               origin,
+               rounded_start_time.date(),
+               rounded_start_time.time(),
+               tuple(sorted(options.items())))
+        return (key, rounded_start_time)
+    
+    def get(self, key):
+        """Look up a cached result, returning None if not present."""
+        self._check_schedule()
+        
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+    
+    def put(self, key, value, nbytes=None, source=None):
+        """Add a result to the cache, evicting older entries as required.
+        
+        Parameters
+        ----------
+        key
+            As produced by :py:meth:`.key`.
+        value
+            The result to cache.
+        nbytes : int or None
+            The size of the result. If None, the value's 'nbytes' attribute is
+            used.
+        source : (:py:class:`.Schedule`, generation) or None
+            If given, the schedule (and its generation) the result was
+            computed from. The result is discarded unless this is the
+            schedule currently bound to the cache, unchanged.
+        """
+        self._check_schedule()
+        
+        if source is not None:
+            schedule, generation = source
+            if (schedule is not self.schedule or
+                    generation != self.generation):
+                return
+        
+        if nbytes is None:
+            nbytes = value.nbytes
+        
+        # Never cache things which would immediately be evicted
+        if nbytes > self.max_bytes:
+            return
+        
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[1]
+        
+        self.entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        
+        while self.nbytes > self.max_bytes:
+            _key, (_value, old_nbytes) = self.entries.popitem(last=False)
+            self.nbytes -= old_nbytes
+            self.evictions += 1
+    
+    def one_to_all_result(self, durations):
+        """Convert a dict {station_code: seconds, ...} into a compact
+        :py:class:`.OneToAllResult` for the bound schedule."""
+        return OneToAllResult.from_dict(self.station_codes,
+                                        self.station_index,
+                                        durations)
+    
+    @property
+    def hit_rate(self):
+        """The fraction of lookups which were answered from the cache."""
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+    
+    def stats(self):
+        """Return a JSON-serialisable summary of cache statistics."""
+        return OrderedDict([
+            ("hits", self.hits),
+            ("misses", self.misses),
+            ("hit_rate", round(self.hit_rate, 4)),
+            ("entries", len(self.entries)),
+            ("bytes", self.nbytes),
+            ("max_bytes", self.max_bytes),
+            ("evictions", self.evictions),
+            ("invalidations", self.invalidations),
+        ])
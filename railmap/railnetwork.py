@@ -3,34 +3,220 @@ Read all of the line segments out of a shape file in a National Rail Railway
 Network Inspire data shapefile.
 """
 
-# Provided by the PyPI package 'pyshp'
-import shapefile
+import struct
 
-def shp_to_lists(filename):
-    """Read all of the line segments out of a shape file in a National Rail
-    Railway Network Inspire data shapefile. Outputs a simple list of lists of
-    (x, y) tuples for all line segments.
+import numpy as np
+
+
+class LineGeometry(object):
+    """A set of lines (e.g. from a shapefile) stored compactly in arrays.
+    
+    Attributes
+    ----------
+    coords : :py:class:`numpy.ndarray`
+        A (num_points, 2) float64 array giving the (x, y) coordinates of every
+        point of every line, one line after another.
+    offsets : :py:class:`numpy.ndarray`
+        A (num_lines + 1) int64 array giving the index into coords of the
+        first point of each line followed by the total number of points. Every
+        line has at least one point.
     """
-    sf = shapefile.Reader(filename)
     
-    lists = []
+    def __init__(self, coords, offsets):
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+    
+    @classmethod
+    def from_lists(cls, lists):
+        """Create a LineGeometry from a list of lists of (x, y) tuples."""
+        lists = [line for line in lists if len(line)]
+        offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+        np.cumsum([len(line) for line in lists], out=offsets[1:])
+        if lists:
+            coords = np.concatenate([np.asarray(line, dtype=np.float64)
+                                     for line in lists])
+        else:
+            coords = np.zeros((0, 2))
+        return cls(coords, offsets)
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def __iter__(self):
+        """Iterate over the lines as lists of [x, y] lists."""
+        coords = self.coords
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield coords[start:end].tolist()
     
-    cur_list = []
+    def line(self, num):
+        """Get the coordinates of a single line as a (num_points, 2) array."""
+        return self.coords[self.offsets[num]:self.offsets[num + 1]]
     
-    for s in sf.shapes():
-        # All shapes are PolyLines in a valid data file.
-        assert s.shapeType == 3
+    @property
+    def num_points(self):
+        return len(self.coords)
+    
+    @property
+    def nbytes(self):
+        """The memory used by the coordinate and offset arrays."""
+        return self.coords.nbytes + self.offsets.nbytes
+    
+    def to_lists(self):
+        """Convert into a list of lists of (x, y) tuples (as produced by
+        :py:func:`.shp_to_lists`)."""
+        return [list(map(tuple, line)) for line in self]
+    
+    @property
+    def bounds(self):
+        """The bounding box of all lines as a (min_x, min_y, max_x, max_y)
+        tuple or None if there are no lines."""
+        if not len(self.coords):
+            return None
+        min_x, min_y = self.coords.min(axis=0).tolist()
+        max_x, max_y = self.coords.max(axis=0).tolist()
+        return (min_x, min_y, max_x, max_y)
+    
+    def line_bounds(self):
+        """Get the bounding box of each line as a (num_lines, 4) array of
+        (min_x, min_y, max_x, max_y) rows."""
+        if not len(self):
+            return np.zeros((0, 4))
+        starts = self.offsets[:-1]
+        return np.hstack([np.minimum.reduceat(self.coords, starts),
+                          np.maximum.reduceat(self.coords, starts)])
+    
+    def transform(self, scale_x=1.0, scale_y=1.0, offset_x=0.0, offset_y=0.0):
+        """Get a copy with every point's coordinates scaled and then
+        offset."""
+        return LineGeometry(self.coords * (scale_x, scale_y) +
+                            (offset_x, offset_y),
+                            self.offsets)
+    
+    def subset(self, line_nums):
+        """Get a new LineGeometry containing only the given lines (in the
+        order given)."""
+        line_nums = np.asarray(line_nums, dtype=np.int64)
+        return self._gather(self.offsets[line_nums],
+                            self.offsets[line_nums + 1] - 1)
+    
+    def split(self, max_segments):
+        """Split every line into pieces of at most max_segments segments
+        (adjacent pieces share an end point)."""
+        offsets = self.offsets
+        lengths = np.diff(offsets)
+        num_pieces = np.maximum(-(-(lengths - 1) // max_segments), 1)
+        
+        line_nums = np.repeat(np.arange(len(self)), num_pieces)
+        piece_nums = (np.arange(len(line_nums)) -
+                      np.repeat(np.cumsum(num_pieces) - num_pieces,
+                                num_pieces))
+        starts = offsets[line_nums] + piece_nums * max_segments
+        ends = np.minimum(starts + max_segments, offsets[line_nums + 1] - 1)
+        return self._gather(starts, ends)
+    
+    def clip(self, min_x, min_y, max_x, max_y):
+        """Get the parts of the lines which may be visible within a
+        rectangle: segments whose bounding boxes do not overlap the rectangle
+        are removed, splitting lines where necessary.
+        """
+        coords = self.coords
+        a = coords[:-1]
+        b = coords[1:]
+        keep = ((np.minimum(a[:, 0], b[:, 0]) <= max_x) &
+                (np.maximum(a[:, 0], b[:, 0]) >= min_x) &
+                (np.minimum(a[:, 1], b[:, 1]) <= max_y) &
+                (np.maximum(a[:, 1], b[:, 1]) >= min_y))
+        # The 'segments' joining the end of one line to the start of the next
+        keep[self.offsets[1:-1] - 1] = False
+        
+        segments = np.flatnonzero(keep)
+        if not len(segments):
+            return LineGeometry(np.zeros((0, 2)), np.zeros(1))
         
-        parts = list(s.parts)
-        for n, (x, y) in enumerate(s.points):
-            if parts and n == parts[0]:
-                parts.pop(0)
-                if cur_list:
-                    lists.append(cur_list)
-                cur_list = []
-            cur_list.append((x, y))
-    
-    if cur_list:
-        lists.append(cur_list)
-    
-    return lists
+        # Runs of consecutive segments become lines
+        run_starts = np.ones(len(segments), dtype=bool)
+        run_starts[1:] = segments[1:] != segments[:-1] + 1
+        run_ends = np.append(run_starts[1:], True)
+        return self._gather(segments[run_starts], segments[run_ends] + 1)
+    
+    def _gather(self, starts, ends):
+        """Internal use. Create a new LineGeometry whose lines are the points
+        from starts[i] to ends[i] (inclusive)."""
+        lengths = ends - starts + 1
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        indices = (np.repeat(starts - offsets[:-1], lengths) +
+                   np.arange(offsets[-1]))
+        return LineGeometry(self.coords[indices], offsets)
+
+
+# The shapefile shape types which are read (PolyLine and Polygon along with
+# their Z and M variants, whose X and Y coordinates are laid out identically)
+# and the null shape type, which is skipped.
+_LINE_SHAPE_TYPES = (3, 5, 13, 15, 23, 25)
+_NULL_SHAPE_TYPE = 0
+
+def read_shp(filename):
+    """Read all of the lines out of a shape file in a National Rail Railway
+    Network Inspire data shapefile (or any other shapefile of lines or
+    polygons). Each part of each shape becomes a line.
+    
+    The file is decoded directly (without pyshp) with each shape's points
+    copied straight from the file into a :py:class:`.LineGeometry`.
+    """
+    with open(filename, "rb") as f:
+        data = f.read()
+    
+    file_code, = struct.unpack_from(">i", data, 0)
+    if file_code != 9994:
+        raise ValueError("{} is not a shapefile".format(filename))
+    file_length = struct.unpack_from(">i", data, 24)[0] * 2
+    
+    coords = []
+    offsets = [0]
+    num_points_total = 0
+    position = 100
+    while position + 8 <= min(file_length, len(data)):
+        content_length = struct.unpack_from(">i", data, position + 4)[0] * 2
+        content = position + 8
+        position = content + content_length
+        
+        shape_type, = struct.unpack_from("<i", data, content)
+        if shape_type == _NULL_SHAPE_TYPE:
+            continue
+        elif shape_type not in _LINE_SHAPE_TYPES:
+            raise ValueError(
+                "{} contains unsupported shape type {}".format(
+                    filename, shape_type))
+        
+        # Skip the shape type and bounding box
+        num_parts, num_points = struct.unpack_from("<ii", data, content + 36)
+        if num_parts == 0 or num_points == 0:
+            continue
+        parts = np.frombuffer(data, dtype="<i4", count=num_parts,
+                              offset=content + 44)
+        points = np.frombuffer(data, dtype="<f8", count=num_points * 2,
+                               offset=content + 44 + num_parts * 4)
+        
+        # Ignore empty parts
+        part_ends = np.append(parts[1:], num_points)
+        parts = parts[part_ends > parts]
+        
+        coords.append(points)
+        offsets.extend((num_points_total + parts[1:]).tolist())
+        offsets.append(num_points_total + num_points)
+        num_points_total += num_points
+    
+    if coords:
+        coords = np.concatenate(coords)
+    else:
+        coords = np.zeros((0, 2))
+    return LineGeometry(coords, offsets)
+
+def shp_to_lists(filename):
+    """Read all of the line segments out of a shape file in a National Rail
+    Railway Network Inspire data shapefile. Outputs a simple list of lists of
+    (x, y) tuples for all line segments.
+    """
+    return read_shp(filename).to_lists()
@@ -2,25 +2,39 @@
 data from the Timetable Information Service (TTIS) data and other data files.
 """
 
+import json
 import logging
 import datetime
 
+from array import array
 from heapq import heappush, heappop
+from itertools import count
+from time import perf_counter
 
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, OrderedDict, Counter
 
 from railmap.cif import parse_mca, parse_msn
 from railmap.flf import parse_flf
+from railmap.timetable import \
+    Timetable, NO_TIME, PICK_UP, SET_DOWN, time_to_seconds, seconds_to_time
 
 from railmap.cif.mca import \
     RecordIdentity, STPIndicator, TransactionType, AssociationCateogry, \
-    Activity
+    Activity, TrainStatus, TrainCategory
 
 from railmap.cif.msn import \
     RecordType
 
 logger = logging.getLogger(__name__)
 
+ON_FOOT = -1
+"""Used by :py:meth:`.Schedule.plan_route` in place of a stop index when not
+on a train."""
+
+WALKED = -2
+"""Used by :py:meth:`.Schedule.plan_route` in place of a stop index when a
+TIPLOC was reached by a (precomputed) chain of transfers."""
+
 class Validity(object):
     """Defines the regularity with which a train service runs."""
     
@@ -150,7 +164,11 @@ class Segment(object):
 
 
 class RailSegment(Segment):
-    """A segment of a timetabled service made by rail."""
+    """A segment of a timetabled service made by rail.
+    
+    NB: Timetabled services are stored in a :py:class:`.Timetable` rather than
+    as RailSegments. RailSegments are produced to describe planned routes.
+    """
     
     __slots__ = ["arrival", "departure"]
     
@@ -274,10 +292,10 @@ class TIPLOC(object):
     """
     
     __slots__ = ["code", "three_alpha_code", "segments", "change_time",
-                 "same_station", "visited"]
+                 "same_station", "visited", "index"]
     
     def __init__(self, code, three_alpha_code=None, segments=None,
-                 change_time=0, same_station=None, visited=None):
+                 change_time=0, same_station=None, visited=None, index=None):
         """Create a new TIPLOC.
         
         All parameters can be changed later by setting the same-named
@@ -290,8 +308,9 @@ class TIPLOC(object):
         three_alpha_code : str or None
             The three-alpha station code, if known.
         segments : [:py:class:`.Segment`, ...]
-            The list of segments which pass through/start/terminate at this
-            TIPLOC.
+            The list of non-rail (i.e. transfer) segments which start or
+            terminate at this TIPLOC. (Rail services are stored in the
+            schedule's :py:class:`railmap.timetable.Timetable`.)
         change_time : int
             Time (minutes) to allow for transferring between different trains.
             Defaults to 0 if unknown.
@@ -299,6 +318,8 @@ class TIPLOC(object):
             A set identifying TIPLOCs which are part of the same station.
         visited : anything
             A user-defined flag for graph search purposes
+        index : int or None
+            The index of this TIPLOC within its :py:class:`.Schedule`.
         """
         self.code = code
         self.three_alpha_code = three_alpha_code
@@ -306,6 +327,7 @@ class TIPLOC(object):
         self.change_time = change_time
         self.same_station = same_station if same_station is not None else set([self])
         self.visited = visited
+        self.index = index
     
     def __repr__(self):
         return "<{} {} ({}) {} segments>".format(
@@ -320,6 +342,15 @@ class TIPLOC(object):
         return id(self) < id(other)
 
 
+def _segment_attributes(cls):
+    """Internal use. The names of the attributes of a :py:class:`.Segment`
+    class other than its 'tiploc' and 'destinations'."""
+    return [name
+            for base in reversed(cls.__mro__)
+            for name in getattr(base, "__slots__", ())
+            if name not in ("tiploc", "destinations")]
+
+
 def time_to_datetime(datetime_now, then):
     """Convert a datetime.time into the first datetime.datetime after
     datetime_now.
@@ -339,11 +370,130 @@ def time_to_datetime(datetime_now, then):
         return datetime_day + datetime.timedelta(days=1) + then_delta
 
 
+class PlannerStats(object):
+    """Counters and timers describing a single route planner query.
+    
+    Pass an instance to :py:meth:`.Schedule.plan_route` to have it filled in.
+    When no instance is given, the route planner skips collecting statistics
+    altogether.
+    
+    Attributes
+    ----------
+    heap_pushes, heap_pops : int
+        Number of entries added to/removed from the route planner's queue.
+    peak_heap_size : int
+        The largest the queue grew.
+    tiplocs_settled : int
+        Number of TIPLOCs reached (and from which onward journeys were
+        considered).
+    segments_expanded : int
+        Number of stops (and transfers) whose onward connections were
+        considered.
+    validity_checks : int
+        Number of times the days a service runs were checked.
+    validity_evaluations : int
+        The subset of validity_checks which were not answered from the
+        planner's memo.
+    phase_times : {phase: seconds, ...}
+        Wall-clock time spent in each phase of the query ('setup', 'search'
+        and 'finish').
+    trace : [dict, ...]
+        If trace_every is non-zero, a sample of the entries removed from the
+        queue (one in every trace_every). Each is a dict with the entry's
+        'pop' number, the 'elapsed' journey time (seconds), 'tiploc' code,
+        timetable 'stop' index (or -1 if not on a train) and the 'heap_size'
+        at that point.
+    """
+    
+    def __init__(self, trace_every=0):
+        """
+        Parameters
+        ----------
+        trace_every : int
+            If non-zero, record a search trace entry for every trace_every-th
+            entry removed from the queue.
+        """
+        self.heap_pushes = 0
+        self.heap_pops = 0
+        self.peak_heap_size = 0
+        self.tiplocs_settled = 0
+        self.segments_expanded = 0
+        self.validity_checks = 0
+        self.validity_evaluations = 0
+        self.phase_times = OrderedDict()
+        
+        self.trace_every = trace_every
+        self.trace = []
+    
+    def __repr__(self):
+        return "<{} {}>".format(
+            self.__class__.__name__,
+            ", ".join("{}={}".format(k, v)
+                      for k, v in self.as_dict().items()
+                      if not isinstance(v, dict)),
+        )
+    
+    def as_dict(self):
+        """Return a JSON-serialisable summary (excluding the trace)."""
+        return OrderedDict([
+            ("heap_pushes", self.heap_pushes),
+            ("heap_pops", self.heap_pops),
+            ("peak_heap_size", self.peak_heap_size),
+            ("tiplocs_settled", self.tiplocs_settled),
+            ("segments_expanded", self.segments_expanded),
+            ("validity_checks", self.validity_checks),
+            ("validity_evaluations", self.validity_evaluations),
+            ("phase_times", OrderedDict(
+                (phase, round(seconds, 6))
+                for phase, seconds in self.phase_times.items())),
+        ])
+    
+    def dump_trace(self, f, **fields):
+        """Write the search trace to a file as newline-delimited JSON. Any
+        keyword arguments are added as extra fields to every entry (e.g. to
+        identify the query)."""
+        for entry in self.trace:
+            f.write(json.dumps(OrderedDict(list(fields.items()) +
+                                           list(entry.items()))))
+            f.write("\n")
+
+
 class Schedule(object):
     """A schedule graph which may be queried for routes.
+    
+    Timetabled rail services are held in a compact :py:class:`.Timetable`
+    while TIPLOCs (and the non-rail transfers between them) are represented
+    by objects.
+    
+    For route planning, the transfers and same-station relationships between
+    TIPLOCs are flattened into a transitively closed transfer table (see
+    :py:meth:`.build_transfers`).
+    
+    Attributes
+    ----------
+    overlay : :py:class:`railmap.delays.DelayOverlay` or None
+        Real-time delays and cancellations to take into account when planning
+        routes. Set using :py:meth:`.set_overlay`.
+    transfer_first, transfer_to, transfer_cost, transfer_via : array
+        The transfer table built by :py:meth:`.build_transfers`. The TIPLOCs
+        reachable on foot from TIPLOC ``i`` (including ``i`` itself) are
+        ``transfer_to[transfer_first[i]:transfer_first[i + 1]]``, in order of
+        increasing cost. ``transfer_cost`` gives the time (seconds) before
+        each may be considered reached and ``transfer_via`` the TIPLOC
+        visited immediately before it.
+    transfer_into_first, transfer_into_from, ... : array
+        The index of (non-rail) transfers arriving at each TIPLOC, also built
+        by :py:meth:`.build_transfers`. The transfers into TIPLOC ``i`` are
+        those at ``transfer_into_first[i]:transfer_into_first[i + 1]``.
+        ``transfer_into_from`` gives the TIPLOC each transfer leaves,
+        ``transfer_into_segment`` the position of the transfer in that
+        TIPLOC's segment list, ``transfer_into_destination`` the position of
+        the arriving segment in the transfer's destinations and
+        ``transfer_into_cost`` the time taken (seconds) including the change
+        time of the TIPLOC left.
     """
     
-    def __init__(self, tiplocs=None):
+    def __init__(self, tiplocs=None, timetable=None):
         """Create a schedule.
         
         Parameters
@@ -351,8 +501,161 @@ class Schedule(object):
         tiplocs : {tiploc_code: :py:class:`.TIPLOC`, ...} or None
             If None (the default) the tiploc list is set to an empty list. Maps
             TIPLOC codes to their associated object.
+        timetable : :py:class:`railmap.timetable.Timetable` or None
+            The timetabled services. If None, an empty timetable is created.
+            The TIPLOC indices used in the timetable correspond with the
+            'index' attribute of the TIPLOCs.
         """
         self.tiplocs = tiplocs if tiplocs is not None else {}
+        self.timetable = timetable if timetable is not None else Timetable()
+        self.generation = 0
+        self.overlay = None
+        
+        # TIPLOCs, listed by their index
+        self.tiploc_list = []
+        for tiploc in self.tiplocs.values():
+            if tiploc.index is None:
+                tiploc.index = len(self.tiploc_list)
+            self.tiploc_list.append(tiploc)
+        self.tiploc_list.sort(key=lambda tiploc: tiploc.index)
+        
+        self.transfer_first = array("i", [0])
+        self.transfer_to = array("i")
+        self.transfer_cost = array("i")
+        self.transfer_via = array("i")
+        self.transfer_into_first = array("i", [0])
+        self.transfer_into_from = array("i")
+        self.transfer_into_segment = array("i")
+        self.transfer_into_destination = array("i")
+        self.transfer_into_cost = array("i")
+        self._transfers_generation = None
+    
+    def __getstate__(self):
+        """Flatten the TIPLOCs (and the segments between them) for pickling.
+        
+        TIPLOCs refer to one another via their transfer segments so pickling
+        them directly recurses along chains of connected TIPLOCs, exceeding
+        Python's recursion limit for large networks. Instead, TIPLOCs,
+        segments and same-station groups are listed with references between
+        them given as indices.
+        """
+        state = self.__dict__.copy()
+        del state["tiplocs"]
+        del state["tiploc_list"]
+        
+        # Number every segment reachable from the TIPLOCs
+        segment_list = []
+        segment_ids = {}
+        to_visit = [segment
+                    for tiploc in self.tiploc_list
+                    for segment in tiploc.segments]
+        while to_visit:
+            segment = to_visit.pop()
+            if id(segment) not in segment_ids:
+                segment_ids[id(segment)] = len(segment_list)
+                segment_list.append(segment)
+                to_visit.extend(dst for dst, _ in segment.destinations)
+        
+        # Number the (shared) same-station sets
+        group_ids = {}
+        groups = []
+        for tiploc in self.tiploc_list:
+            if id(tiploc.same_station) not in group_ids:
+                group_ids[id(tiploc.same_station)] = len(groups)
+                groups.append(tuple(other.index
+                                    for other in tiploc.same_station))
+        
+        state["_tiplocs"] = [
+            (tiploc.code,
+             tiploc.three_alpha_code,
+             tiploc.change_time,
+             tuple(segment_ids[id(segment)] for segment in tiploc.segments),
+             group_ids[id(tiploc.same_station)])
+            for tiploc in self.tiploc_list]
+        state["_tiploc_order"] = [tiploc.index
+                                  for tiploc in self.tiplocs.values()]
+        state["_same_station"] = groups
+        state["_segments"] = [
+            (type(segment),
+             segment.tiploc.index,
+             tuple((segment_ids[id(dst)], validity)
+                   for dst, validity in segment.destinations),
+             {name: getattr(segment, name)
+              for name in _segment_attributes(type(segment))})
+            for segment in segment_list]
+        return state
+    
+    def __setstate__(self, state):
+        """Rebuild the TIPLOCs and segments flattened by
+        :py:meth:`.__getstate__`."""
+        state = state.copy()
+        tiplocs = state.pop("_tiplocs")
+        tiploc_order = state.pop("_tiploc_order")
+        groups = state.pop("_same_station")
+        segments = state.pop("_segments")
+        self.__dict__.update(state)
+        
+        self.tiploc_list = [
+            TIPLOC(code, three_alpha_code, change_time=change_time,
+                   index=index)
+            for index, (code, three_alpha_code, change_time, _, _)
+            in enumerate(tiplocs)]
+        self.tiplocs = {self.tiploc_list[index].code: self.tiploc_list[index]
+                        for index in tiploc_order}
+        
+        groups = [set(self.tiploc_list[index] for index in group)
+                  for group in groups]
+        
+        segment_list = []
+        for cls, tiploc_index, _, attributes in segments:
+            segment = cls.__new__(cls)
+            segment.tiploc = self.tiploc_list[tiploc_index]
+            for name, value in attributes.items():
+                setattr(segment, name, value)
+            segment_list.append(segment)
+        for segment, (_, _, destinations, _) in zip(segment_list, segments):
+            segment.destinations = [(segment_list[segment_id], validity)
+                                    for segment_id, validity in destinations]
+        
+        for tiploc, (_, _, _, segment_ids, group_id) in zip(self.tiploc_list,
+                                                            tiplocs):
+            tiploc.segments = [segment_list[segment_id]
+                               for segment_id in segment_ids]
+            tiploc.same_station = groups[group_id]
+    
+    def changed(self):
+        """Record that the schedule has been modified.
+        
+        Must be called after any change to the schedule (e.g. loading more
+        data into it) so that cached query results (which note the generation
+        they were computed for) can be invalidated.
+        """
+        self.generation += 1
+    
+    def set_overlay(self, overlay):
+        """Replace the real-time delay overlay used when planning routes.
+        
+        The overlay is swapped in a single step: route planning already in
+        progress continues to use the previous overlay.
+        
+        Parameters
+        ----------
+        overlay : :py:class:`railmap.delays.DelayOverlay` or None
+            An overlay built for this schedule, or None to plan using the
+            timetable alone.
+        """
+        if (overlay is not None and
+                len(overlay.stop_delay) != self.timetable.num_stops):
+            raise ValueError(
+                "Delay overlay was not built for this schedule's timetable.")
+        
+        # NB: The transfer table does not depend on the overlay and so need
+        # not be rebuilt.
+        transfers_current = self._transfers_generation == self.generation
+        self.overlay = overlay
+        self.changed()
+        if transfers_current:
+            self._transfers_generation = self.generation
     
     def __repr__(self):
         return "<{} {} tiplocs>".format(
@@ -360,7 +663,126 @@ class Schedule(object):
             len(self.tiplocs),
         )
     
-    def plan_route(self, start_tiploc_code, end_tiploc_code, start_time):
+    def get_tiploc(self, code):
+        """Get the TIPLOC with the given code, adding a new one to the schedule
+        if it does not exist already."""
+        tiploc = self.tiplocs.get(code)
+        if tiploc is None:
+            tiploc = TIPLOC(code, index=len(self.tiploc_list))
+            self.tiplocs[code] = tiploc
+            self.tiploc_list.append(tiploc)
+        return tiploc
+    
+    def build_transfers(self):
+        """(Re)build the transitively closed transfer table if the schedule
+        has changed since it was last built.
+        
+        Having arrived at a TIPLOC, a passenger may move (at no cost) to any
+        other TIPLOC of the same station or take a (non-rail) transfer from
+        any of them, allowing the change time of the TIPLOC left for each
+        transfer. The table lists, for every TIPLOC, every TIPLOC which may be
+        reached by some chain of these moves along with the minimum time
+        taken, allowing all onward transfers to be considered at once.
+        
+        An index of the transfers arriving at each TIPLOC is built alongside
+        the table.
+        """
+        if (self._transfers_generation == self.generation and
+                len(self.transfer_first) == len(self.tiploc_list) + 1):
+            return
+        
+        # The direct moves from each TIPLOC [(tiploc_index, seconds), ...]
+        moves = [[] for _ in self.tiploc_list]
+        # The transfers into each TIPLOC
+        #   [(from_index, segment_num, destination_num, seconds), ...]
+        transfers_into = [[] for _ in self.tiploc_list]
+        for tiploc in self.tiploc_list:
+            for other in tiploc.same_station:
+                if other is not tiploc:
+                    moves[tiploc.index].append((other.index, 0))
+            for segment_num, segment in enumerate(tiploc.segments):
+                if segment.take_up:
+                    for destination_num, (next_segment, _) in \
+                            enumerate(segment.destinations):
+                        seconds = (tiploc.change_time + segment.duration) * 60
+                        moves[tiploc.index].append((
+                            next_segment.tiploc.index, seconds))
+                        transfers_into[next_segment.tiploc.index].append((
+                            tiploc.index, segment_num, destination_num,
+                            seconds))
+        
+        transfer_into_first = array("i", [0])
+        transfer_into_from = array("i")
+        transfer_into_segment = array("i")
+        transfer_into_destination = array("i")
+        transfer_into_cost = array("i")
+        for transfers in transfers_into:
+            for from_index, segment_num, destination_num, seconds in \
+                    transfers:
+                transfer_into_from.append(from_index)
+                transfer_into_segment.append(segment_num)
+                transfer_into_destination.append(destination_num)
+                transfer_into_cost.append(seconds)
+            transfer_into_first.append(len(transfer_into_from))
+        
+        transfer_first = array("i", [0])
+        transfer_to = array("i")
+        transfer_cost = array("i")
+        transfer_via = array("i")
+        for tiploc_index in range(len(self.tiploc_list)):
+            # Dijkstra's algorithm over the moves
+            best = {}
+            to_visit = [(0, tiploc_index, tiploc_index)]
+            while to_visit:
+                cost, index, via = heappop(to_visit)
+                if index in best:
+                    continue
+                best[index] = cost
+                transfer_to.append(index)
+                transfer_cost.append(cost)
+                transfer_via.append(via)
+                for next_index, move_cost in moves[index]:
+                    if next_index not in best:
+                        heappush(to_visit,
+                                 (cost + move_cost, next_index, index))
+            transfer_first.append(len(transfer_to))
+        
+        self.transfer_first = transfer_first
+        self.transfer_to = transfer_to
+        self.transfer_cost = transfer_cost
+        self.transfer_via = transfer_via
+        self.transfer_into_first = transfer_into_first
+        self.transfer_into_from = transfer_into_from
+        self.transfer_into_segment = transfer_into_segment
+        self.transfer_into_destination = transfer_into_destination
+        self.transfer_into_cost = transfer_into_cost
+        self._transfers_generation = self.generation
+    
+    def find_tiploc_code(self, three_alpha_code):
+        """Find the code of a TIPLOC with the given three-alpha code.
+        
+        Where a station consists of several TIPLOCs, the first one found is
+        returned. Returns None if no TIPLOC has the given code.
+        """
+        for tiploc in self.tiplocs.values():
+            if tiploc.three_alpha_code == three_alpha_code:
+                return tiploc.code
+        return None
+    
+    def stop_segment(self, stop):
+        """Produce a :py:class:`.RailSegment` describing a stop in the
+        timetable (e.g. for describing a planned route)."""
+        timetable = self.timetable
+        flags = timetable.stop_flags[stop]
+        return RailSegment(
+            tiploc=self.tiploc_list[timetable.stop_tiploc[stop]],
+            set_down=bool(flags & SET_DOWN),
+            take_up=bool(flags & PICK_UP),
+            arrival=seconds_to_time(timetable.stop_arrival[stop]),
+            departure=seconds_to_time(timetable.stop_departure[stop]))
+    
+    def plan_route(self, start_tiploc_code, end_tiploc_code, start_time,
+                   stats=None):
         """Find a route (if possible) between the two specified TIPLOCs.
         
         Parameters
@@ -374,105 +796,563 @@ class Schedule(object):
             that location.
         start_time : :py:class:`datetime.datetime`
             The date/time at which the journey commences.
+        stats : :py:class:`.PlannerStats` or None
+            If given, this object will be populated with statistics about the
+            search.
         
         Returns
         -------
         None or (end_time, [Segment, ...])
         """
+        if stats is not None:
+            phase_start = perf_counter()
+        
         start_tiploc = self.tiplocs[start_tiploc_code]
         if end_tiploc_code is not None:
-            end_tiploc = self.tiplocs[end_tiploc_code]
+            end_index = self.tiplocs[end_tiploc_code].index
         else:
-            end_tiploc = None
+            end_index = None
         
-        # Clear the "visited" attribute of all TIPLOCs
-        for tiploc in self.tiplocs.values():
-            tiploc.visited = None
+        tiploc_list = self.tiploc_list
+        
+        timetable = self.timetable
+        timetable.build_index(len(tiploc_list))
+        self.build_transfers()
+        
+        # The (non-rail) transfers arriving at the destination. Since merely
+        # reaching another TIPLOC of the destination station does not count as
+        # arriving, arrivals by these are considered separately from the
+        # transfer table.
+        #   {tiploc_index: [(seconds, segment, next_segment), ...], ...}
+        end_transfers = {}
+        if end_index is not None:
+            for i in range(self.transfer_into_first[end_index],
+                           self.transfer_into_first[end_index + 1]):
+                from_index = self.transfer_into_from[i]
+                segment = tiploc_list[from_index].segments[
+                    self.transfer_into_segment[i]]
+                next_segment, _ = segment.destinations[
+                    self.transfer_into_destination[i]]
+                end_transfers.setdefault(from_index, []).append((
+                    self.transfer_into_cost[i], segment, next_segment))
+        
+        trip_validity = timetable.trip_validity
+        stop_next = timetable.stop_next
+        stop_trip = timetable.stop_trip
+        stop_tiploc = timetable.stop_tiploc
+        stop_arrival = timetable.stop_arrival
+        stop_departure = timetable.stop_departure
+        stop_flags = timetable.stop_flags
+        links = timetable.links
+        tiploc_first_stop = timetable.tiploc_first_stop
+        tiploc_stops = timetable.tiploc_stops
+        validities = timetable.validities
+        transfer_first = self.transfer_first
+        transfer_to = self.transfer_to
+        transfer_cost = self.transfer_cost
+        
+        # All times are handled as integer seconds since midnight at the start
+        # of the journey's first day.
+        start_midnight = datetime.datetime(start_time.year,
+                                           start_time.month,
+                                           start_time.day)
+        start_date = start_midnight.date()
+        
+        # Real-time delays and cancellations apply to the stops scheduled on
+        # the overlay's day (counting from the start day).
+        overlay = self.overlay
+        if overlay is not None:
+            overlay_day = (overlay.date - start_date).days
+            stop_delay = overlay.stop_delay
+            stop_cancelled = overlay.stop_cancelled
+        else:
+            overlay_day = None
+        
+        # The time at which each TIPLOC was first reached (or -1)
+        visited = array("l", [-1]) * len(tiploc_list)
+        
+        # Memoised lookups of the next day (counting from the start day) on
+        # which a given validity is valid.
+        #  {(validity_id, day): day or None, ...}
+        next_valid_days = {}
         
-        # A queue of TIPLOCs to visit, the time at which the visit occurred and
-        # the list of segments visited thus far to reach that station
-        #  (datetime, TIPLOC, segments_used)
+        def next_valid_day(validity_id, day):
+            key = (validity_id, day)
+            if stats is not None:
+                stats.validity_checks += 1
+            if key not in next_valid_days:
+                if stats is not None:
+                    stats.validity_evaluations += 1
+                date = validities[validity_id].next_valid_at(
+                    start_date + datetime.timedelta(days=day))
+                next_valid_days[key] = (date - start_date).days if date else None
+            return next_valid_days[key]
+        
+        def stop_links(stop):
+            """The (stop, validity_id) pairs which follow on from a stop
+            (skipping any pass-through stops)."""
+            next_stop = stop_next[stop]
+            if next_stop >= 0:
+                out = [(next_stop, trip_validity[stop_trip[stop]])]
+            else:
+                out = []
+            if stop in links:
+                out.extend(links[stop])
+            return out
+        
+        # A queue of TIPLOCs to visit. Entries are tuples:
+        #   (time, seq, tiploc_index, stop, route, overlaid)
+        # Where 'seq' is a unique, increasing, number which breaks ties, 'stop'
+        # is the timetable stop index the TIPLOC was reached by (or
+        # ON_FOOT if reached by a transfer at the start of the journey or
+        # WALKED if reached via the transfer table) and
+        # 'route' is a linked list of the stop indices or segments used thus
+        # far as a tuple (stop_or_segment, route) or None. (Chains of
+        # transfers from the transfer table are recorded as a
+        # (from_tiploc_index, to_tiploc_index) tuple.) 'overlaid' is True
+        # when 'stop' is scheduled on the overlay's day, in which case 'time'
+        # includes its delay.
         to_visit = []
-        heappush(to_visit, (start_time, start_tiploc, []))
+        seq = count()
         
-        # Counter for number of tiplocs visited thus far (for debug messages)
-        tiplocs_visited = 0
+        # The (stop, time) pairs already added to the queue. Since the onward
+        # journey from a given stop at a given time is always the same, these
+        # need not be explored more than once.
+        queued = set()
         
-        while to_visit:
-            now, tiploc, segments_used = heappop(to_visit)
+        def ride(stop, now, route):
+            """Queue the stops which follow on from a stop the train is at.
+            'now' is the scheduled (not delayed) time at the stop."""
+            if stats is not None:
+                stats.segments_expanded += 1
+            
+            day, time_of_day = divmod(now, 24 * 60 * 60)
+            for next_stop, validity_id in stop_links(stop):
+                # If arrival time is unknown, just use current time
+                arrival = stop_arrival[next_stop]
+                if arrival == NO_TIME:
+                    arrival = time_of_day
+                
+                # Have we missed this link for the day? If so, move on to the
+                # next day and then find the day where this service is next
+                # valid (in case it doesn't run that day).
+                arrival_day = next_valid_day(
+                    validity_id, day + 1 if arrival < time_of_day else day)
+                if arrival_day is None:
+                    continue
+                
+                arrival += arrival_day * 24 * 60 * 60
+                if (next_stop, arrival) not in queued:
+                    queued.add((next_stop, arrival))
+                    overlaid = arrival_day == overlay_day
+                    if overlaid:
+                        arrival += stop_delay[next_stop]
+                    heappush(to_visit, (arrival,
+                                        next(seq),
+                                        stop_tiploc[next_stop],
+                                        next_stop,
+                                        (next_stop, route),
+                                        overlaid))
+                    if stats is not None:
+                        stats.heap_pushes += 1
+                        stats.peak_heap_size = max(stats.peak_heap_size,
+                                                   len(to_visit))
+        
+        def next_run_day(stop, day):
+            """The first day (from the given day) on which the train at a
+            stop continues its journey, or None."""
+            return min((d for d in (next_valid_day(validity_id, day)
+                                    for _, validity_id in stop_links(stop))
+                        if d is not None),
+                       default=None)
+        
+        def board(stop, now, route):
+            """Board the train at a stop, if possible."""
+            departure = stop_departure[stop]
+            if departure == NO_TIME or not stop_flags[stop] & PICK_UP:
+                return
+            
+            # If time is in the past, we'll have to try tomorrow
+            day, time_of_day = divmod(now, 24 * 60 * 60)
+            if departure < time_of_day:
+                day += 1
             
-            # Is this our destination?
-            if tiploc == end_tiploc:
-                # Terminate if we are allowed to get off only!
-                if not segments_used or segments_used[-1].set_down:
-                    return (now, segments_used)
+            # Find the next day this service runs
+            departure_day = next_run_day(stop, day)
             
-            # Are we already on a sequence of segments, if so, consider staying
-            # on it
-            if segments_used:
-                cur_segment = segments_used[-1]
-                for next_time, next_segment in cur_segment.next_segments(now):
-                    heappush(to_visit, (next_time,
-                                        next_segment.tiploc,
-                                        segments_used + [next_segment]))
+            if overlay_day is not None:
+                # The service on the overlay's day is considered separately
+                # since it may run late (or early) or be cancelled.
+                if departure_day == overlay_day:
+                    departure_day = next_run_day(stop, overlay_day + 1)
+                
+                scheduled = overlay_day * 24 * 60 * 60 + departure
+                delayed = scheduled + stop_delay[stop]
+                if departure_day is not None:
+                    next_departure = departure_day * 24 * 60 * 60 + departure
+                else:
+                    next_departure = None
+                if (delayed >= now and
+                        not stop_cancelled[stop] and
+                        (next_departure is None or delayed < next_departure) and
+                        next_run_day(stop, overlay_day) == overlay_day):
+                    ride(stop, scheduled, (stop, route))
+                    return
+            
+            if departure_day is not None:
+                ride(stop,
+                     departure_day * 24 * 60 * 60 + departure,
+                     (stop, route))
+        
+        def push(entry):
+            heappush(to_visit, entry)
+            if stats is not None:
+                stats.heap_pushes += 1
+                stats.peak_heap_size = max(stats.peak_heap_size,
+                                           len(to_visit))
+        
+        def settle(tiploc_index, now, route, change=True):
+            """Mark a TIPLOC as visited and consider boarding all trains
+            calling there."""
+            # Mark tiploc as visited (and record the time we arrived at it)
+            visited[tiploc_index] = now
+            
+            if stats is not None:
+                stats.tiplocs_settled += 1
+            
+            # Allow time to change platform etc. if already on something
+            if change:
+                after_change = now + tiploc_list[tiploc_index].change_time * 60
             else:
-                cur_segment = None
+                after_change = now
+            
+            # Consider all trains calling here
+            for i in range(tiploc_first_stop[tiploc_index],
+                           tiploc_first_stop[tiploc_index + 1]):
+                board(tiploc_stops[i], after_change, route)
+        
+        def finish():
+            """Record the visited times in the TIPLOCs."""
+            if stats is not None:
+                end_phase("search")
+            
+            for tiploc, time in zip(tiploc_list, visited):
+                if time >= 0:
+                    tiploc.visited = start_midnight + datetime.timedelta(
+                        seconds=time)
+                else:
+                    tiploc.visited = None
+        
+        def end_phase(name):
+            """Record the time spent in the phase just finished."""
+            nonlocal phase_start
+            now = perf_counter()
+            stats.phase_times[name] = now - phase_start
+            phase_start = now
+        
+        start = int((start_time - start_midnight).total_seconds())
+        heappush(to_visit,
+                 (start, next(seq), start_tiploc.index, ON_FOOT, None, False))
+        
+        if stats is not None:
+            stats.heap_pushes += 1
+            stats.peak_heap_size = max(stats.peak_heap_size, 1)
+            end_phase("setup")
+        
+        while to_visit:
+            now, _, tiploc_index, stop, route, overlaid = heappop(to_visit)
+            
+            if stats is not None:
+                stats.heap_pops += 1
+                if (stats.trace_every and
+                        stats.heap_pops % stats.trace_every == 0):
+                    stats.trace.append(OrderedDict([
+                        ("pop", stats.heap_pops),
+                        ("elapsed", now - start),
+                        ("tiploc", tiploc_list[tiploc_index].code),
+                        ("stop", stop),
+                        ("heap_size", len(to_visit)),
+                    ]))
+            
+            set_down = stop < 0 or (stop_flags[stop] & SET_DOWN and
+                                    not (overlaid and stop_cancelled[stop]))
+            
+            # Is this our destination? (Entries reached via the transfer table
+            # may have arrived at another TIPLOC of the destination station
+            # and so do not count.)
+            if tiploc_index == end_index and set_down and stop != WALKED:
+                finish()
+                result = (start_midnight + datetime.timedelta(seconds=now),
+                          self._route_segments(route))
+                if stats is not None:
+                    end_phase("finish")
+                return result
+            
+            # Are we already on a train, if so, consider staying on it
+            if stop >= 0:
+                ride(stop, now - stop_delay[stop] if overlaid else now, route)
             
             # Consider changing train if we've not changed at this station
-            # before and the current segment can set us down here.
-            if cur_segment is None or cur_segment.set_down:
-                # Stations may consist of several tiplocs, hence this loop
-                for tiploc in tiploc.same_station:
-                    if tiploc.visited is None:
-                        # Mark tiploc as visited (and record the time we arrived
-                        # at it)
-                        tiploc.visited = now
+            # before and the current train can set us down here.
+            if stop == WALKED:
+                # Reached via the transfer table: onward transfers have
+                # already been considered.
+                if visited[tiploc_index] < 0:
+                    settle(tiploc_index, now, route)
+            elif route is None:
+                # At the start of the journey no change time is required.
+                # Stations may consist of several tiplocs, hence this loop.
+                for tiploc in tiploc_list[tiploc_index].same_station:
+                    if visited[tiploc.index] < 0:
+                        settle(tiploc.index, now, route, False)
                         
-                        tiplocs_visited += 1
-                        logging.debug("Reached %d of %d TIPLOCs",
-                                      tiplocs_visited, 
-                                      len(self.tiplocs))
-                        
-                        # Allow time to change platform etc. if already on something
-                        if cur_segment is not None:
-                            after_change = now + datetime.timedelta(seconds=tiploc.change_time * 60)
+                        # Consider all (non-rail) transfers from here
+                        for segment in tiploc.segments:
+                            if segment.take_up:
+                                for next_segment, _ in segment.destinations:
+                                    push((now + segment.duration * 60,
+                                          next(seq),
+                                          next_segment.tiploc.index,
+                                          ON_FOOT,
+                                          (next_segment, (segment, route)),
+                                          False))
+                                    if stats is not None:
+                                        stats.segments_expanded += 1
+            elif set_down and visited[tiploc_index] < 0:
+                # Consider everywhere reachable from here on foot (including
+                # this TIPLOC and others at the same station).
+                for i in range(transfer_first[tiploc_index],
+                               transfer_first[tiploc_index + 1]):
+                    to_index = transfer_to[i]
+                    if visited[to_index] < 0:
+                        cost = transfer_cost[i]
+                        if cost == 0:
+                            settle(to_index, now, route)
                         else:
-                            after_change = now
+                            push((now + cost,
+                                  next(seq),
+                                  to_index,
+                                  WALKED,
+                                  ((tiploc_index, to_index), route),
+                                  False))
+                            if stats is not None:
+                                stats.segments_expanded += 1
                         
-                        # Consider all segments which are taking up passengers
-                        for segment in tiploc.segments:
-                            next_departure = segment.next_departure(after_change)
-                            if segment.take_up and next_departure is not None:
-                                for next_time, next_segment in segment.next_segments(next_departure):
-                                    heappush(to_visit, (next_time,
-                                                        next_segment.tiploc,
-                                                        segments_used + [segment, next_segment]))
+                        # Arrive at the destination by any transfer into it
+                        # (even if the destination has already been
+                        # visited, e.g. from another TIPLOC of its station).
+                        for duration, segment, next_segment in \
+                                end_transfers.get(to_index, ()):
+                            push((now + cost + duration,
+                                  next(seq),
+                                  end_index,
+                                  ON_FOOT,
+                                  (next_segment,
+                                   (segment,
+                                    ((tiploc_index, to_index), route))),
+                                  False))
+                            if stats is not None:
+                                stats.segments_expanded += 1
         
+        finish()
+        if stats is not None:
+            end_phase("finish")
         return None
+    
+    def _route_segments(self, route):
+        """Internal use. Convert a route linked-list from
+        :py:meth:`.plan_route` into a list of :py:class:`.Segment`.
+        
+        Any pass-through stops skipped over by the route planner are
+        reinstated.
+        """
+        stop_trip = self.timetable.stop_trip
+        
+        segments = []
+        next_stop = None
+        while route is not None:
+            stop_or_segment, route = route
+            if isinstance(stop_or_segment, Segment):
+                segments.append(stop_or_segment)
+                next_stop = None
+            elif isinstance(stop_or_segment, tuple):
+                from_index, to_index = stop_or_segment
+                segments.extend(reversed(self._transfer_segments(from_index,
+                                                                 to_index)))
+                next_stop = None
+            else:
+                stop = stop_or_segment
+                if (next_stop is not None and
+                        stop_trip[next_stop] == stop_trip[stop]):
+                    for skipped in range(next_stop - 1, stop, -1):
+                        segments.append(self.stop_segment(skipped))
+                segments.append(self.stop_segment(stop))
+                next_stop = stop
+        return segments[::-1]
+    
+    def _transfer_segments(self, from_index, to_index):
+        """Internal use. Get the :py:class:`.TransferSegment`s making up the
+        chain of transfers between two TIPLOCs in the transfer table."""
+        # The TIPLOC visited before each TIPLOC reachable from from_index
+        vias = {self.transfer_to[i]: self.transfer_via[i]
+                for i in range(self.transfer_first[from_index],
+                               self.transfer_first[from_index + 1])}
+        
+        segments = []
+        index = to_index
+        while index != from_index:
+            via = vias[index]
+            tiploc = self.tiploc_list[via]
+            
+            # Find the transfer used (if not just a move within a station)
+            transfers = [
+                (segment.duration, segment, next_segment)
+                for segment in tiploc.segments if segment.take_up
+                for next_segment, _ in segment.destinations
+                if next_segment.tiploc.index == index]
+            same_station = self.tiploc_list[index] in tiploc.same_station
+            if transfers and not same_station:
+                _, segment, next_segment = min(transfers,
+                                               key=lambda t: t[0])
+                segments.append(next_segment)
+                segments.append(segment)
+            
+            index = via
+        
+        return segments[::-1]
 
 
 _DivideJoinEvent = namedtuple("_DivideJoinEvent",
                               "main_train_uid,associated_train_uid,location,validity")
 
 
-def _load_mca_file(schedule, filename):
-    """Internal use. Loads an MCA (CIF timetable) into a schedule."""
+def _stop_flags(activities):
+    """Internal use. Determine the :py:data:`.PICK_UP` and
+    :py:data:`.SET_DOWN` flags for a list of activities at a location."""
+    flags = 0
+    for activity in activities:
+        if activity == Activity.stop_to_set_down_passengers:
+            flags |= SET_DOWN
+        elif activity == Activity.train_finishes:
+            flags |= SET_DOWN
+        elif activity == Activity.stop_to_take_up_passengers:
+            flags |= PICK_UP
+        elif activity == Activity.train_begins:
+            flags |= PICK_UP
+        elif activity == Activity.stop_to_take_up_and_set_down_passengers:
+            flags |= SET_DOWN | PICK_UP
+    return flags
+
+
+PASSENGER_TRAIN_STATUSES = frozenset([
+    TrainStatus.bus,
+    TrainStatus.passenger_and_parcels,
+    TrainStatus.ship,
+    TrainStatus.stp_passenger_and_parcels,
+    TrainStatus.stp_ship,
+    TrainStatus.stp_bus,
+])
+"""The train statuses of services which may carry passengers."""
+
+PASSENGER_TRAIN_CATEGORIES = frozenset([
+    TrainCategory.london_underground_or_metro,
+    TrainCategory.ordinary_passenger,
+    TrainCategory.mixed,
+    TrainCategory.channel_tunnel,
+    TrainCategory.sleeper_europe_night_service,
+    TrainCategory.international,
+    TrainCategory.motorail,
+    TrainCategory.express_passenger,
+    TrainCategory.sleeper,
+    TrainCategory.bus_replacement,
+    TrainCategory.bus,
+])
+"""The train categories of advertised passenger services. (Unadvertised,
+staff, empty coaching stock, parcels, departmental, light locomotive and
+freight categories are excluded.)"""
+
+
+def _in_horizon(validity, horizon):
+    """Internal use. Test whether a Validity is valid on any day within a
+    (first_date, last_date) horizon (or horizon is None)."""
+    if horizon is None:
+        return True
+    first_date, last_date = horizon
+    next_valid = validity.next_valid_at(first_date)
+    return next_valid is not None and next_valid <= last_date
+
+
+def _schedule_drop_reason(record, train_statuses, train_categories, horizon):
+    """Internal use. Determine why a basic schedule record should be dropped
+    while loading, or return None if it should be kept. See
+    :py:func:`.load_schedule` for the arguments."""
+    if train_statuses is not None and record.train_status not in train_statuses:
+        return "train_status"
+    
+    # NB: Schedules without a category (e.g. ships) are always kept
+    if (train_categories is not None and
+            record.train_category is not None and
+            record.train_category not in train_categories):
+        return "train_category"
+    
+    if not _in_horizon(Validity(record.date_runs_from,
+                                record.date_runs_to,
+                                record.days_run), horizon):
+        return "horizon"
+    
+    return None
+
+
+def _load_mca_file(schedule, filename, train_statuses=None,
+                   train_categories=None, horizon=None):
+    """Internal use. Loads an MCA (CIF timetable) into a schedule.
+    
+    Schedules rejected by the filters (see :py:func:`.load_schedule`) are
+    skipped without parsing their location records.
+    """
+    timetable = schedule.timetable
+    
+    # The number of schedules dropped for each reason
+    dropped = Counter()
+    
+    def skip_schedule(record):
+        # NB: Cancellations have no location records and are ignored anyway
+        if record.stp_indicator == STPIndicator.stp_cancellation:
+            return False
+        
+        reason = _schedule_drop_reason(record, train_statuses,
+                                       train_categories, horizon)
+        if reason is None:
+            return False
+        else:
+            dropped[reason] += 1
+            return True
+    
     # Accumulate a list of train divison events and join events as
     # '_DivideJoinEvent's. Pulled out when parsing association entries
     joins_and_divisions = []
     
-    # A mapping {(train_uid, tiploc_code): RailSegment, ...}
-    segments = {}
+    # The (train_uid, tiploc_code) pairs involved in joins/divisions.
+    association_stops = set()
+    
+    # A mapping {(train_uid, tiploc_code): stop, ...} for the stops in
+    # association_stops.
+    stops = {}
     
     # The current train details
     cur_train_uid = None
     cur_validity = None
     
-    # The last segment to be created
-    last_segment = None
+    # The stops of the current train
+    # [(tiploc_index, arrival, departure, flags), ...]
+    cur_stops = []
+    
+    def add_trip():
+        if cur_train_uid is not None and cur_stops:
+            timetable.add_trip(cur_train_uid, cur_validity, cur_stops)
     
     with open(filename, "r") as f:
-        for n, record in enumerate(parse_mca(f)):
+        for n, record in enumerate(parse_mca(f, skip_schedule)):
             if n % 10000 == 0:
                 logger.debug("Parsing MCA record %d", n)
             
@@ -494,12 +1374,23 @@ def _load_mca_file(schedule, filename):
                             record.association_days,
                         ),
                     )
+                    if not _in_horizon(dje.validity, horizon):
+                        dropped["association_horizon"] += 1
+                        continue
                     
                     joins_and_divisions.append(dje)
+                    association_stops.add((dje.main_train_uid, dje.location))
+                    association_stops.add((dje.associated_train_uid,
+                                           dje.location))
             # Start of a (not-cancelled) train schedule entry
-            elif (record.record_identity == RecordIdentity.basic_schedule and
-                    record.stp_indicator != STPIndicator.stp_cancellation):
-                if record.transaction_type != TransactionType.new:
+            elif record.record_identity == RecordIdentity.basic_schedule:
+                add_trip()
+                cur_train_uid = None
+                cur_stops = []
+                
+                if record.stp_indicator == STPIndicator.stp_cancellation:
+                    pass
+                elif record.transaction_type != TransactionType.new:
                     logger.warning("Unexpected non-new association: %r",
                                    record)
                 else:
@@ -508,65 +1399,52 @@ def _load_mca_file(schedule, filename):
                                             record.date_runs_to,
                                             record.days_run)
             # Start of a journey
-            elif (record.record_identity == RecordIdentity.origin_location or
-                  record.record_identity == RecordIdentity.intermediate_location or
-                  record.record_identity == RecordIdentity.terminating_location):
-                # Find out if we're setting down or picking up
-                set_down = False
-                take_up = False
-                for activity in record.activity:
-                    if activity == Activity.stop_to_set_down_passengers:
-                        set_down = True
-                    elif activity == Activity.train_finishes:
-                        set_down = True
-                    elif activity == Activity.stop_to_take_up_passengers:
-                        take_up = True
-                    elif activity == Activity.train_begins:
-                        take_up = True
-                    elif activity == Activity.stop_to_take_up_and_set_down_passengers:
-                        set_down = True
-                        take_up = True
-                
-                if record.location in schedule.tiplocs:
-                    tiploc = schedule.tiplocs[record.location]
-                else:
-                    tiploc = TIPLOC(record.location)
-                    schedule.tiplocs[record.location] = tiploc
+            elif ((record.record_identity == RecordIdentity.origin_location or
+                   record.record_identity == RecordIdentity.intermediate_location or
+                   record.record_identity == RecordIdentity.terminating_location) and
+                  cur_train_uid is not None):
+                tiploc = schedule.get_tiploc(record.location)
                 
-                segment = RailSegment(tiploc=tiploc,
-                                      set_down=set_down,
-                                      take_up=take_up,
-                                      arrival=((record.public_arrival or
-                                                record.scheduled_arrival)
-                                               if hasattr(record, "public_arrival")
-                                               else None),
-                                      departure=((record.public_departure or
-                                                  record.scheduled_departure)
-                                                 if hasattr(record, "public_departure")
-                                                 else None))
+                arrival = ((record.public_arrival or
+                            record.scheduled_arrival)
+                           if hasattr(record, "public_arrival")
+                           else None)
+                departure = ((record.public_departure or
+                              record.scheduled_departure)
+                             if hasattr(record, "public_departure")
+                             else None)
                 
-                # Record the segment (for later join/division edits)
-                segments[(cur_train_uid, record.location)] = segment
+                # Record the stop (for later join/division edits)
+                if (cur_train_uid, record.location) in association_stops:
+                    stops[(cur_train_uid, record.location)] = \
+                        timetable.num_stops + len(cur_stops)
                 
-                # Add to the TIPLOC
-                tiploc.segments.append(segment)
-                
-                # If this isn't the start of the journey, add a link from the
-                # previous segment to this one
-                if record.record_identity != RecordIdentity.origin_location:
-                    last_segment.destinations.append((segment, cur_validity))
-                
-                last_segment = segment
+                cur_stops.append((tiploc.index,
+                                  time_to_seconds(arrival),
+                                  time_to_seconds(departure),
+                                  _stop_flags(record.activity)))
+    
+    add_trip()
     
     # Process joins/divisions
     for dje in joins_and_divisions:
-        main_segment = segments.get((dje.main_train_uid, dje.location))
-        associated_segment = segments.get((dje.associated_train_uid, dje.location))
+        main_stop = stops.get((dje.main_train_uid, dje.location))
+        associated_stop = stops.get((dje.associated_train_uid, dje.location))
         
         # Skip joins/divisions for which no route is known in the first
         # place...
-        if main_segment and associated_segment:
-            main_segment.destinations.append((associated_segment, dje.validity))
+        if main_stop is not None and associated_stop is not None:
+            timetable.add_link(main_stop, associated_stop, dje.validity)
+    
+    if dropped:
+        logger.info("Dropped %s while loading %s",
+                    ", ".join("{} ({})".format(count, reason)
+                              for reason, count in sorted(dropped.items())),
+                    filename)
+    
+    schedule.changed()
+    
+    return dropped
 
 def _load_msn_file(schedule, filename):
     """Internal use. Loads three-alpha codes and change times from a MSN
@@ -595,6 +1473,8 @@ def _load_msn_file(schedule, filename):
         for tiploc in tiplocs:
             tiploc.same_station = tiplocs
     
+    schedule.changed()
+
 def _load_flf_file(schedule, filename):
     """Internal use. Loads non-rail transfers from a fixed link file."""
     tac_to_tiploc = {t.three_alpha_code: t
@@ -619,10 +1499,16 @@ def _load_flf_file(schedule, filename):
                 dst_tiploc.segments.append(dst_segment)
                 src_tiploc.segments.append(src_segment)
     
+    schedule.changed()
 
-def load_schedule(mca_filename, msn_filename=None, flf_filename=None):
+def load_schedule(mca_filename, msn_filename=None, flf_filename=None,
+                  train_statuses=None, train_categories=None, horizon=None):
     """Load a schedule database from published datafiles.
     
+    Services which passengers cannot use or which do not run within the dates
+    of interest may be filtered out while loading to save memory, loading time
+    and route planning time.
+    
     Parameters
     ----------
     mca_filename : str
@@ -640,10 +1526,23 @@ def load_schedule(mca_filename, msn_filename=None, flf_filename=None):
         
         If not None, ``msn_filename`` argument must also be provided otherwise
         this data cannot be loaded.
+    train_statuses : set([:py:class:`railmap.cif.mca.TrainStatus`, ...]) or None
+        If not None, only load schedules with one of the given train statuses
+        (e.g. :py:data:`.PASSENGER_TRAIN_STATUSES`).
+    train_categories : set([:py:class:`railmap.cif.mca.TrainCategory`, ...]) or None
+        If not None, only load schedules with one of the given train
+        categories (e.g. :py:data:`.PASSENGER_TRAIN_CATEGORIES`). Schedules
+        with no category given are always loaded.
+    horizon : (:py:class:`datetime.date`, :py:class:`datetime.date`) or None
+        If not None, only load schedules (and joins/divisions) which run on at
+        least one day between the given first and last dates (inclusive).
+        Routes found for journeys which extend beyond the horizon will be
+        incomplete.
     """
     schedule = Schedule()
     
-    _load_mca_file(schedule, mca_filename)
+    _load_mca_file(schedule, mca_filename,
+                   train_statuses, train_categories, horizon)
     
     if msn_filename is not None:
         _load_msn_file(schedule, msn_filename)
@@ -651,4 +1550,6 @@ def load_schedule(mca_filename, msn_filename=None, flf_filename=None):
     if flf_filename is not None:
         _load_flf_file(schedule, flf_filename)
     
+    schedule.build_transfers()
+    
     return schedule
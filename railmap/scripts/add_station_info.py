@@ -5,7 +5,7 @@ import datetime
 
 from argparse import ArgumentParser
 
-from railmap.stations import dbf_to_dict
+from railmap.stations import load_stations
 from railmap.cif.msn import parse_msn, StationDetailsRecord
 
 
@@ -21,6 +21,10 @@ def main():
                              "Railway Network Inspire station data. If "
                              "provided an 'eastings' and 'northings' column "
                              "will be added to the output.")
+    parser.add_argument("--cache-dir", metavar="DIRECTORY",
+                        help="A directory in which to cache the Inspire "
+                             "station data (in a binary form which is much "
+                             "faster to load) between runs.")
     parser.add_argument("--ttis", "-t",
                         help="The .msn file containing the Timetable "
                              "Information Service (TTIS) master station names "
@@ -36,7 +40,7 @@ def main():
     
     # Load inspire data
     if args.inspire:
-        inspire_data = dbf_to_dict(args.inspire)
+        inspire_data = load_stations(args.inspire, args.cache_dir)
     else:
         inspire_data = {}
     
@@ -0,0 +1,138 @@
+"""
+Script which benchmarks the route planner against synthetic timetables, or
+compares the results of two benchmark runs.
+"""
+
+import sys
+import json
+import logging
+import datetime
+
+from collections import OrderedDict
+
+from argparse import ArgumentParser
+
+from railmap.synthetic import NETWORKS
+from railmap.benchmark import \
+    run_benchmark, run_label_benchmark, run_heatmap_benchmark, compare, \
+    format_comparison
+
+
+def main():
+    parser = ArgumentParser(
+        description="Benchmark the route planner on synthetic timetables. "
+                    "Results are written as JSON. Alternatively, with "
+                    "--compare, compare two previously written results.")
+    
+    parser.add_argument("--output", "-o", metavar="FILENAME",
+                        help="Write the JSON results to the named file "
+                             "rather than stdout.")
+    
+    parser.add_argument("--network", "-n", action="append",
+                        choices=sorted(NETWORKS),
+                        help="The network shape to benchmark. May be given "
+                             "multiple times. (Default: all shapes)")
+    parser.add_argument("--scale", "-s", action="append",
+                        choices=["small", "medium", "large"],
+                        help="The network scale to benchmark. May be given "
+                             "multiple times. (Default: small and medium)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="The random seed used to generate networks and "
+                             "queries. (Default: %(default)s)")
+    
+    parser.add_argument("--one-to-one", type=int, default=50, metavar="N",
+                        help="Number of one-to-one queries per case. "
+                             "(Default: %(default)s)")
+    parser.add_argument("--one-to-all", type=int, default=5, metavar="N",
+                        help="Number of one-to-all queries per case. "
+                             "(Default: %(default)s)")
+    parser.add_argument("--multi-departure", type=int, default=2,
+                        metavar="N",
+                        help="Number of origins for multi-departure queries "
+                             "per case. (Default: %(default)s)")
+    parser.add_argument("--departures", type=int, default=6, metavar="N",
+                        help="Number of departure times for each "
+                             "multi-departure query. (Default: %(default)s)")
+    
+    parser.add_argument("--no-isolation", action="store_true",
+                        help="Run all cases in this process rather than "
+                             "forking a process per case (peak memory "
+                             "figures then accumulate across cases).")
+    
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="Compare two JSON result files rather than "
+                             "running the benchmark.")
+    
+    parser.add_argument("--labels", type=int, nargs="+", metavar="N",
+                        help="Rather than benchmarking the route planner, "
+                             "benchmark map label placement (as used by "
+                             "railmap_draw) with each of the given numbers "
+                             "of labels (e.g. 10000 100000).")
+    
+    parser.add_argument("--heatmap", type=int, nargs="+", metavar="SIZE",
+                        help="Rather than benchmarking the route planner, "
+                             "benchmark travel-time heatmap rendering (as "
+                             "used by railmap_draw) for square rasters of "
+                             "each of the given sizes (e.g. 1000 3000).")
+    parser.add_argument("--heatmap-stations", type=int, default=2500,
+                        metavar="N",
+                        help="The number of stations in heatmap benchmarks. "
+                             "(Default: %(default)s)")
+    
+    parser.add_argument("--verbose", "-v", action="store_true",
+                        help="Show verbose status during processing.")
+    
+    args = parser.parse_args()
+    
+    # Handle arguments
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+    
+    if args.compare:
+        old_filename, new_filename = args.compare
+        with open(old_filename, "r") as f:
+            old = json.load(f)
+        with open(new_filename, "r") as f:
+            new = json.load(f)
+        print(format_comparison(compare(old, new)))
+        return 0
+    
+    if args.labels:
+        report = OrderedDict([
+            ("created", datetime.datetime.now().isoformat()),
+            ("seed", args.seed),
+            ("labels", run_label_benchmark(args.labels, args.seed)),
+        ])
+    elif args.heatmap:
+        report = OrderedDict([
+            ("created", datetime.datetime.now().isoformat()),
+            ("seed", args.seed),
+            ("heatmap", run_heatmap_benchmark(args.heatmap,
+                                              args.heatmap_stations,
+                                              args.seed)),
+        ])
+    else:
+        report = run_benchmark(args.network,
+                               args.scale or ("small", "medium"),
+                               args.seed,
+                               isolated=not args.no_isolation,
+                               one_to_one=args.one_to_one,
+                               one_to_all=args.one_to_all,
+                               multi_departure=args.multi_departure,
+                               departures=args.departures)
+    
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
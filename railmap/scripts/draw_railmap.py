@@ -4,17 +4,38 @@ script.
 """
 
 import re
+import os
+import csv
+import json
+import string
+import hashlib
+import logging
+import datetime
+import tempfile
+import multiprocessing
 
 from argparse import ArgumentParser
+from collections import namedtuple, OrderedDict
 from contextlib import contextmanager
-from math import pi
+from itertools import groupby
+from math import pi, ceil
+
+import numpy as np
 
 import cairocffi as cairo
 
-from railmap.railnetwork import shp_to_lists
-from railmap.stations import dbf_to_dict
+from railmap.cache import hash_files, load_cached
+from railmap.railnetwork import LineGeometry
+from railmap.simplify import SimplifiedShapes, tolerance_level
+from railmap.stations import load_stations
 from railmap.cif import msn_to_dict
 from railmap.cif.msn import InterchangeStatus
+from railmap.spatial import ObstructionTester
+from railmap.output import NpyReader
+from railmap.multi_origin import UNREACHABLE
+from railmap.heatmap import iter_travel_time_tiles, colour_times
+
+logger = logging.getLogger(__name__)
 
 
 @contextmanager
@@ -49,6 +70,18 @@ def cairo_pdf(filename, width, height):
     ctx.show_page()
 
 
+def fit_scale(page_width, page_height, min_x, min_y, max_x, max_y):
+    """Get the scale factor (page units per map unit) used by
+    fit_and_center.
+    """
+    area_width = max_x - min_x
+    area_height = max_y - min_y
+    
+    # Scale based on whichever dimension is tighter
+    scale_x = page_width / area_width
+    scale_y = page_height / area_height
+    return min(scale_x, scale_y)
+
 @contextmanager
 def fit_and_center(ctx, page_width, page_height, min_x, min_y, max_x, max_y):
     """Setup a cairo transformation which translates/sccales coordinates such
@@ -59,10 +92,7 @@ def fit_and_center(ctx, page_width, page_height, min_x, min_y, max_x, max_y):
     area_width = max_x - min_x
     area_height = max_y - min_y
     
-    # Scale based on whichever dimension is tighter
-    scale_x = page_width / area_width
-    scale_y = page_height / area_height
-    scale = min(scale_x, scale_y)
+    scale = fit_scale(page_width, page_height, min_x, min_y, max_x, max_y)
     
     with ctx:
         ctx.scale(scale, scale)
@@ -76,48 +106,123 @@ def fit_and_center(ctx, page_width, page_height, min_x, min_y, max_x, max_y):
         
         yield ctx
 
-def draw_text_bounds(ctx, ox, oy, text, font="Sans", align_point=0.0, size=1.0, outline_size=0.1, *args, **kwargs):
-    """
-    Get the bounding box of the specified text as a (x1, y1, x2, y2) tuple.
+class TextCache(object):
+    """A cache of text extents and (optionally) outline paths keyed by font,
+    size and text.
+    
+    Maps contain thousands of labels but relatively few distinct strings
+    (e.g. journey times like '1:23') so measuring and converting each to a
+    path only once saves many calls into Cairo. Paths are relative to the
+    point text is drawn from. The extents and paths are those produced by
+    the first context used to measure each string.
     """
-    with ctx:
-        ctx.select_font_face(font)
-        ctx.set_font_size(size)
-        x,y, w,h, _w,_h = ctx.text_extents(text)
-        x1 = -x + ((1.0-w)*align_point)
-        y1 = -y
-        x2 = x1 + w
-        y2 = y1 - h
+    
+    def __init__(self, paths=True):
+        """
+        Parameters
+        ----------
+        paths : bool
+            If True, cache the outline path of text as well as its extents.
+        """
+        self.paths = paths
         
+        # {(font, size, text): (x, y, w, h, x_advance, y_advance), ...}
+        self._extents = {}
         
-        # The bounding box on global coordinates
-        x1, y1, x2, y2 = (ox+x1,oy+y1, ox+x2,oy+y2)
+        # {(font, size, text): path, ...}
+        self._paths = {}
+    
+    def __len__(self):
+        return len(self._extents)
+    
+    def extents(self, ctx, font, size, text):
+        """Get the text_extents of some text."""
+        key = (font, size, text)
+        extents = self._extents.get(key)
+        if extents is None:
+            with ctx:
+                ctx.select_font_face(font)
+                ctx.set_font_size(size)
+                extents = self._extents[key] = ctx.text_extents(text)
+        return extents
+    
+    def append_text_path(self, ctx, font, size, text):
+        """Append the outline of some text, drawn from the current point, to
+        the current path (like ctx.text_path).
+        """
+        if not self.paths:
+            with ctx:
+                ctx.select_font_face(font)
+                ctx.set_font_size(size)
+                ctx.text_path(text)
+            return
         
-        # Account for outline
-        x1 -= outline_size/2
-        x2 += outline_size/2
-        y1 += outline_size/2
-        y2 -= outline_size/2
+        key = (font, size, text)
+        path = self._paths.get(key)
+        if path is None:
+            with ctx:
+                # NB: The path is generated on its own, drawn from (0, 0)
+                current_path = ctx.copy_path()
+                ctx.new_path()
+                ctx.select_font_face(font)
+                ctx.set_font_size(size)
+                ctx.move_to(0, 0)
+                ctx.text_path(text)
+                path = self._paths[key] = ctx.copy_path()
+                ctx.new_path()
+                ctx.append_path(current_path)
         
-        # Finally, center vertically
-        return (x1, y1 - h/2,
-                x2, y2 - h/2)
+        x, y = ctx.get_current_point()
+        with ctx:
+            ctx.translate(x, y)
+            ctx.append_path(path)
+
+default_text_cache = TextCache()
+"""The TextCache used by draw_text_bounds and draw_text by default. Since it
+is kept for the lifetime of the process it is shared by every map drawn."""
+
+def draw_text_bounds(ctx, ox, oy, text, font="Sans", align_point=0.0, size=1.0, outline_size=0.1, text_cache=None, *args, **kwargs):
+    """
+    Get the bounding box of the specified text as a (x1, y1, x2, y2) tuple.
+    """
+    if text_cache is None:
+        text_cache = default_text_cache
+    x,y, w,h, _w,_h = text_cache.extents(ctx, font, size, text)
+    x1 = -x + ((1.0-w)*align_point)
+    y1 = -y
+    x2 = x1 + w
+    y2 = y1 - h
+    
+    
+    # The bounding box on global coordinates
+    x1, y1, x2, y2 = (ox+x1,oy+y1, ox+x2,oy+y2)
+    
+    # Account for outline
+    x1 -= outline_size/2
+    x2 += outline_size/2
+    y1 += outline_size/2
+    y2 -= outline_size/2
+    
+    # Finally, center vertically
+    return (x1, y1 - h/2,
+            x2, y2 - h/2)
 
 def draw_text(ctx, ox, oy, text, font="Sans", align_point=0.0, size=1.0,
               rgba=(0.0,0.0,0.0, 1.0),
               outline_size=0.1,
-              outline_rgba=(1.0,1.0,1.0, 1.0)):
+              outline_rgba=(1.0,1.0,1.0, 1.0),
+              text_cache=None):
     """
     Draw the desired text centered vertically around (0,0) horizontally
     "align_point" along the text's width.
     """
+    if text_cache is None:
+        text_cache = default_text_cache
     with ctx:
         ctx.translate(ox, oy)
-        ctx.select_font_face(font)
-        ctx.set_font_size(size)
-        x,y, w,h, _w,_h = ctx.text_extents(text)
+        x,y, w,h, _w,_h = text_cache.extents(ctx, font, size, text)
         ctx.move_to(-x + ((1.0-w)*align_point), -y - h/2)
-        ctx.text_path(text)
+        text_cache.append_text_path(ctx, font, size, text)
         
         ctx.set_line_width(outline_size)
         ctx.set_source_rgba(*outline_rgba)
@@ -128,23 +233,65 @@ def draw_text(ctx, ox, oy, text, font="Sans", align_point=0.0, size=1.0,
 
 
 def get_network_bounds(network_lines):
-    """Given the output of shp_to_lists, return the bottom-left and top-right
-    corners of the bounding box covering the network.
+    """Given a list of lists of (x, y) tuples (or a LineGeometry), return the
+    bottom-left and top-right corners of the bounding box covering the
+    network.
     """
-    xys = []
-    for line in network_lines:
-        xys.extend(line)
+    if not isinstance(network_lines, LineGeometry):
+        network_lines = LineGeometry.from_lists(network_lines)
+    return network_lines.bounds
+
+def iter_station_times(filename):
+    """
+    Iterate over the journey times in a file produced by the
+    ``railmap_station_times`` script (in CSV, NDJSON or npy format) or a
+    directory of such files.
     
-    min_x = min(x for (x, y) in xys)
-    min_y = min(y for (x, y) in xys)
-    max_x = max(x for (x, y) in xys)
-    max_y = max(y for (x, y) in xys)
+    Yields
+    ------
+    (start_station, start_time, {three_alpha_code: duration_in_seconds, ...})
+        The start time is given as a string.
+    """
+    if os.path.isdir(filename):
+        for name in sorted(os.listdir(filename)):
+            if name.lower().endswith((".csv", ".ndjson", ".npy")):
+                for result in iter_station_times(os.path.join(filename,
+                                                              name)):
+                    yield result
+        return
     
-    return (min_x, min_y, max_x, max_y)
+    filetype = filename.split(".")[-1].lower()
+    if filetype == "npy":
+        reader = NpyReader(filename)
+        for start_station, start_time, durations in reader:
+            yield (start_station, start_time, {
+                station: duration
+                for station, duration in zip(reader.station_codes, durations)
+                if duration != UNREACHABLE})
+    elif filetype in ("ndjson", "jsonl"):
+        with open(filename) as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    yield (result["start_station"], result["start_time"],
+                           result["durations"])
+    else:
+        with open(filename, newline="") as f:
+            # NB: Rows for each start station and time are contiguous
+            rows = csv.DictReader(f)
+            for (start_station, start_time), group in groupby(
+                    rows, key=lambda row: (row.get("start_station"),
+                                           row.get("start_time"))):
+                out = {}
+                for row in group:
+                    station = row["station"]
+                    duration = float(row["duration"])
+                    out[station] = min(out.get(station, duration), duration)
+                yield (start_station, start_time, out)
 
 def load_station_times(filename):
     """
-    Given a route-times CSV file produced by the ``railmap_station_times``
+    Given a route-times file produced by the ``railmap_station_times``
     script, extracts the duration for each three-alpha-code. Blindly assumes
     all entries start from the same station. Take the minimum of all reported
     journey durations.
@@ -154,17 +301,9 @@ def load_station_times(filename):
     {three_alpha_code: duration_in_seconds, ...}
     """
     out = {}
-    with open(filename) as f:
-        lines = list(filter(None, f.read().split("\n")))
-        
-        cols = lines[0].split(",")
-        station_col = cols.index("station")
-        duration_col = cols.index("duration")
-        
-        for line in lines[1:]:
-            cols = line.split(",")
-            station = cols[station_col]
-            duration = float(cols[duration_col])
+    for _start_station, _start_time, station_times in \
+            iter_station_times(filename):
+        for station, duration in station_times.items():
             out[station] = min(out.get(station, duration), duration)
     return out
 
@@ -192,68 +331,854 @@ def time_and_colour(string):
     else:
         raise ValueError(string)
 
-class ObstructionTester(object):
-    """Test if a given rectangle is obstructed by a set of existing rectangles.
+def draw_shp_lists(ctx, lines):
+    """Given a LineGeometry, e.g. from ``read_shp``, execute the Cairo drawing
+    commands to draw these outlines. Note that the caller is responsible for
+    setting sources and stroking the path.
+    """
+    for line in lines.transform(scale_y=-1.0):
+        ctx.move_to(*line[0])
+        
+        for x, y in line[1:]:
+            ctx.line_to(x, y)
+
+OutputFormat = namedtuple("OutputFormat",
+                          "surface,vector,default_width,default_simplify,"
+                          "dimension_format,raster_scale")
+"""The properties of an output file type. 'surface' is a context manager
+(e.g. cairo_png), 'vector' is True for vector formats and 'raster_scale' is
+the number of pixels per output unit used for rasters (e.g. heatmaps)."""
+
+def get_output_format(filename):
+    """Get the OutputFormat for a filename (based on its extension), raising a
+    ValueError for unsupported types.
+    """
+    filetype = filename.split(".")[-1].lower()
+    if filetype == "png":
+        return OutputFormat(cairo_png, False, 1000, 0.25, int, 1.0)
+    elif filetype == "pdf":
+        # A4
+        return OutputFormat(cairo_pdf, True, 297.0, 0.02, float, 10.0)
+    else:
+        raise ValueError("Output filename must end with *.png or *.pdf.")
+
+class MapInputs(object):
+    """The (origin-independent) input data used to draw maps, loaded from the
+    files given on the command line.
+    
+    Attributes
+    ----------
+    railway_stations : [StationRecord, ...]
+        All stations at valid locations.
+    railway_station_details : {three_alpha_code: [StationDetailsRecord, ...]}
+    coastline, railway_lines : SimplifiedShapes or None
+    """
+    
+    def __init__(self, args):
+        # Filter out stations at the invalid coordinate (0, 0)
+        self.railway_stations = [
+            station for station in load_stations(args.railway_stations,
+                                                 args.cache_dir).values()
+            if (station.eastings, station.northings) != (0, 0)
+        ]
+        
+        if args.railway_station_details is not None:
+            self.railway_station_details = msn_to_dict(
+                args.railway_station_details)
+        else:
+            self.railway_station_details = {}
+        
+        # NB: Shapes are loaded (and simplified) lazily since a suitable level
+        # of detail can only be chosen once the map scale is known.
+        self.coastline = None
+        if args.coastline is not None:
+            self.coastline = SimplifiedShapes(args.coastline, args.cache_dir)
+        
+        self.railway_lines = None
+        if args.railway_lines is not None:
+            self.railway_lines = SimplifiedShapes(args.railway_lines,
+                                                  args.cache_dir)
+    
+    @property
+    def shapes(self):
+        return [shape for shape in (self.coastline, self.railway_lines)
+                if shape is not None]
+
+def get_interchange_statuses(minimum_size):
+    """Get the interchange statuses of stations whose names are shown for a
+    given --minimum-size.
+    """
+    interchange_statuses = []
+    if minimum_size in ("large", "medium", "small"):
+        interchange_statuses.append(InterchangeStatus.large)
+    if minimum_size in ("medium", "small"):
+        interchange_statuses.append(InterchangeStatus.medium)
+    if minimum_size in ("small"):
+        interchange_statuses.append(InterchangeStatus.small)
+    return interchange_statuses
+
+def get_map_stations(map_inputs, station_times, prioritise, area=None):
+    """Get the stations to show on a map: those for which journey time
+    information is available (and, if given, which lie within the area
+    (min_x, min_y, max_x, max_y)), sorted to put high-priority stations first.
+    """
+    railway_station_details = map_inputs.railway_station_details
+    
+    railway_stations = [
+        station for station in map_inputs.railway_stations
+        if station.station_code in station_times and
+        (area is None or
+         (area[0] <= station.eastings <= area[2] and
+          area[1] <= station.northings <= area[3]))
+    ]
+    
+    # Sort the station list to put high-priorty entities first
+    def interchange_score(station):
+        substations = railway_station_details.get(station.station_code)
+        if substations:
+            return max(s.interchange_status.score for s in substations)
+        else:
+            return 0
+    return sorted(railway_stations, key=(lambda station:
+        prioritise.index(station.station_code)
+        if station.station_code in prioritise
+        else len(prioritise) + (10 - interchange_score(station))))
+
+def get_station_colours(railway_stations, station_times, colours):
+    """Get the colour of each station given a sorted list of (time, colour)
+    pairs from time_and_colour.
+    
+    Returns
+    -------
+    {three_alpha_code: (r, g, b, a), ...}
+    """
+    station_colours = {}
+    for station in railway_stations:
+        journey_time = station_times[station.station_code]
+        colour = (0.0, 0.0, 0.0, 1.0)
+        for threshold, colour in colours:
+            if journey_time <= threshold:
+                break
+        station_colours[station.station_code] = colour
+    return station_colours
+
+def get_map_extent(map_inputs, railway_stations, args):
+    """Determine the area (min_x, min_y, max_x, max_y) to draw in map
+    coordinates.
+    """
+    # Determine the dimensions of the network
+    min_x, min_y, max_x, max_y = get_network_bounds(
+        [[shape.bounds[:2], shape.bounds[2:]]
+         for shape in map_inputs.shapes if shape.bounds is not None] +
+        [[(station.eastings, station.northings) for station in railway_stations]])
+    
+    # Add padding around edges for labels (a bit over-generous since we can't
+    # compute text extents before the context is created)
+    text_size = max(args.station_name_size, args.journey_time_size)
+    w = text_size * 4  # Station names are 3 characters wide, allow for spacing/variable font width
+    h = text_size * 1.5
+    min_x -= w
+    max_x += w
+    min_y -= h
+    max_y += h
     
-    This object is used to avoid drawing (textual) labels on-top of previously
-    drawn labels. Each time a label is drawn, it should be add()-ed to this
-    object. Subsequent labels should be drawn iff the rectangle is not 'in'
-    this object.
+    return (min_x, min_y, max_x, max_y)
+
+def get_map_size(extent, output_format, width=None, height=None):
+    """Determine the output dimensions for a map, filling in any dimensions
+    not given.
     """
+    min_x, min_y, max_x, max_y = extent
     
-    def __init__(self):
-        # Internally this uses the simplest method that could possibly work:
-        # scanning a list of previously added rectangles to see if any overlap
-        # each time. Though It has O(N^2) runtime complexity, in practice N is
-        # small enough that this process doesn't contribute noticably to the
-        # runtime of this script. If the UK ever has a *lot* more train
-        # stations one day, a quad tree/pack tree or something could probably
-        # be used.
-        self.obstructions = []
+    # Determine map dimensions
+    network_width = max_x - min_x
+    network_height = max_y - min_y
+    network_ratio = network_width / network_height
     
-    def add(self, x1,y1, x2,y2):
-        """Add a rectangle to the structure."""
-        self.obstructions.append((x1,y1, x2,y2))
+    # Determine requested dimensions
+    if width is None:
+        width = output_format.default_width
+    if height is None:
+        height = width / network_ratio
+    
+    return (output_format.dimension_format(width),
+            output_format.dimension_format(height))
+
+def get_visible_lines(shape, tolerance, thickness, visible=None):
+    """Get the (simplified) lines of a SimplifiedShapes which should be drawn.
+    If the visible area (min_x, min_y, max_x, max_y) is given, only the parts
+    of lines which (allowing for their thickness) may be visible are
+    returned.
+    """
+    if visible is None:
+        return shape.at_tolerance(tolerance)
     
-    def __contains__(self, rect):
-        """Check if a given rectangle as a tuple (x1,y1, x2,y2) is obstructed
-        by any rectangle previously added. Returns True if so, False otherwise.
+    margin = thickness / 2.0
+    min_x, min_y, max_x, max_y = visible
+    return shape.index(tolerance).query(min_x - margin, min_y - margin,
+                                        max_x + margin, max_y + margin)
+
+def draw_base_layer(ctx, map_inputs, tolerance, args, visible=None):
+    """Draw the (origin-independent) coastline and railway lines. The context
+    should already be transformed into (y-inverted) map coordinates. If the
+    visible area is given, lines outside it are skipped (see
+    get_visible_lines).
+    """
+    # Draw coastline
+    if map_inputs.coastline is not None:
+        ctx.set_line_width(args.coastline_thickness)
+        ctx.set_source_rgba(*args.coastline_colour)
+        draw_shp_lists(ctx, get_visible_lines(map_inputs.coastline,
+                                              tolerance,
+                                              args.coastline_thickness,
+                                              visible))
+        ctx.stroke()
+    
+    # Draw railway lines
+    if map_inputs.railway_lines is not None:
+        ctx.set_line_width(args.railway_line_thickness)
+        ctx.set_source_rgba(*args.railway_line_colour)
+        draw_shp_lists(ctx, get_visible_lines(map_inputs.railway_lines,
+                                              tolerance,
+                                              args.railway_line_thickness,
+                                              visible))
+        ctx.stroke()
+
+def get_heatmap_stations(map_inputs, station_times):
+    """Get the locations of, and journey times to, all reachable stations as
+    a (num_stations, 2) array and a (num_stations, ) array respectively.
+    """
+    stations = [station for station in map_inputs.railway_stations
+                if station.station_code in station_times]
+    station_xy = np.array([(station.eastings, station.northings)
+                           for station in stations], dtype=np.float64)
+    times = np.array([station_times[station.station_code]
+                      for station in stations], dtype=np.float64)
+    return (station_xy.reshape(-1, 2), times)
+
+def draw_heatmap(ctx, map_inputs, station_times, colours, area, width,
+                 height, raster_scale, args):
+    """Draw a raster showing the travel time to every point on the page: the
+    journey time to a station followed by a walk at args.walking_speed.
+    
+    Parameters
+    ----------
+    ctx : cairo.Context
+        A context in page coordinates.
+    area : (min_x, min_y, max_x, max_y)
+        The area covered by the page (see get_visible_area).
+    width, height : number
+        The page size.
+    raster_scale : float
+        The number of raster pixels per page unit.
+    """
+    raster_width = max(int(ceil(width * raster_scale)), 1)
+    raster_height = max(int(ceil(height * raster_scale)), 1)
+    
+    station_xy, times = get_heatmap_stations(map_inputs, station_times)
+    if args.max_walk is not None:
+        max_walk = args.max_walk * 60.0
+    else:
+        max_walk = None
+    
+    # Fill the image surface a tile at a time with premultiplied ARGB pixels
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                 raster_width, raster_height)
+    surface.flush()
+    pixels = np.frombuffer(surface.get_data(), dtype=np.uint32).reshape(
+        raster_height, surface.get_stride() // 4)
+    for row, column, tile in iter_travel_time_tiles(
+            station_xy, times, area, raster_width, raster_height,
+            args.walking_speed * 1000.0 / 3600.0, max_walk):
+        rgba = colour_times(tile, colours).astype(np.uint32)
+        alpha = rgba[..., 3]
+        pixels[row:row + tile.shape[0], column:column + tile.shape[1]] = (
+            (alpha << 24) |
+            ((rgba[..., 0] * alpha // 255) << 16) |
+            ((rgba[..., 1] * alpha // 255) << 8) |
+            (rgba[..., 2] * alpha // 255))
+    surface.mark_dirty()
+    
+    with ctx:
+        ctx.scale(1.0 / raster_scale, 1.0 / raster_scale)
+        ctx.set_source_surface(surface, 0, 0)
+        ctx.paint_with_alpha(args.heatmap_opacity)
+
+def setup_line_style(ctx):
+    """Set the line cap and join style used for all lines."""
+    # Draw lines with rounded joints and caps to avoid highly detailed
+    # segments (e.g. coastline) becoming jagged horror-shows with large
+    # mitres pointing out.
+    ctx.set_line_cap(cairo.LINE_CAP_ROUND)
+    ctx.set_line_join(cairo.LINE_JOIN_ROUND)
+
+class BaseLayerCache(object):
+    """Pre-rendered base layers (coastline and railway lines) which may be
+    reused by any map with the same extent, size and style.
+    
+    Raster base layers are rendered into an image surface which may also be
+    cached on disk (as a PNG). Vector base layers are recorded into a
+    recording surface so that they remain vectors in the output but are only
+    cached in memory.
+    """
+    
+    def __init__(self, cache_dir=None):
+        """
+        Parameters
+        ----------
+        cache_dir : str or None
+            If given, the directory in which to keep raster base layers
+            between runs.
         """
-        ax1,ay1, ax2,ay2 = rect
-        for bx1,by1, bx2,by2 in self.obstructions:
-            if ax1 < bx2 and ax2 > bx1 and ay1 > by2 and ay2 < by1:
-                return True
-        return False
-
-
-def draw_shp_lists(ctx, lists):
-    """Given a list of lists containing line segments, e.g. from
-    ``shp_to_lists``, execute the Cairo drawing commands to draw these
-    outlines. Note that the caller is responsible for setting sources and
-    stroking the path.
-    """
-    for line in lists:
-        x, y = line[0]
-        ctx.move_to(x, -y)
+        self.cache_dir = cache_dir
         
-        for x, y in line[1:]:
-            ctx.line_to(x, -y)
+        # {key: surface, ...}
+        self._layers = {}
+        
+        # {filename: hash, ...}
+        self._file_hashes = {}
+    
+    def get_key(self, map_inputs, extent, width, height, vector, tolerance,
+                args):
+        """Get the key which identifies a base layer."""
+        filenames = [shape.filename for shape in map_inputs.shapes]
+        for filename in filenames:
+            if filename not in self._file_hashes:
+                self._file_hashes[filename] = hash_files([filename])
+        
+        return hashlib.sha1(json.dumps([
+            [self._file_hashes[filename] for filename in filenames],
+            list(extent), width, height, vector, tolerance_level(tolerance),
+            args.coastline_thickness, list(args.coastline_colour),
+            args.railway_line_thickness, list(args.railway_line_colour),
+        ]).encode("utf-8")).hexdigest()
+    
+    def get(self, map_inputs, extent, width, height, vector, tolerance,
+            args, visible=None):
+        """Get a surface containing the base layer (rendering it if
+        necessary) to be painted at (0, 0) on the page. See
+        render_base_layer.
+        """
+        key = self.get_key(map_inputs, extent, width, height, vector,
+                           tolerance, args)
+        if key in self._layers:
+            return self._layers[key]
+        
+        filename = None
+        if self.cache_dir is not None and not vector:
+            filename = os.path.join(self.cache_dir, "base-{}.png".format(key))
+        
+        if filename is not None and os.path.exists(filename):
+            surface = cairo.ImageSurface.create_from_png(filename)
+        else:
+            surface = render_base_layer(map_inputs, extent, width, height,
+                                        vector, tolerance, args, visible)
+            if filename is not None:
+                # Write atomically so concurrent runs never see a partial
+                # file.
+                os.makedirs(self.cache_dir, exist_ok=True)
+                fd, temp_filename = tempfile.mkstemp(dir=self.cache_dir,
+                                                     suffix=".tmp")
+                os.close(fd)
+                surface.write_to_png(temp_filename)
+                os.replace(temp_filename, filename)
+        
+        self._layers[key] = surface
+        return surface
 
-def main():
-    parser = ArgumentParser(
-        description="Render a map showing journey times calculated by the "
-                    "railmap_station_times script.")
+def render_base_layer(map_inputs, extent, width, height, vector, tolerance,
+                      args, visible=None):
+    """Render the base layer into a new surface of the given page size. See
+    BaseLayerCache and draw_base_layer.
+    """
+    if vector:
+        surface = cairo.RecordingSurface(cairo.CONTENT_COLOR_ALPHA, None)
+    else:
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+    ctx = cairo.Context(surface)
+    setup_line_style(ctx)
     
-    output_group = parser.add_argument_group("output options")
+    min_x, min_y, max_x, max_y = extent
+    with fit_and_center(ctx, width, height, min_x, -max_y, max_x, -min_y):
+        draw_base_layer(ctx, map_inputs, tolerance, args, visible)
+    
+    return surface
 
-    output_group.add_argument("filename", metavar="FILENAME",
-                              help="The output filename *.pdf or *.png")
-    output_group.add_argument("width", nargs="?", metavar="WIDTH", type=float,
-                              help="Output size (PDF: mm, PNG: px). "
-                                   "Automatic if not given.")
-    output_group.add_argument("height", nargs="?", metavar="HEIGHT", type=float,
-                              help="Automatic if not given.")
+StationDot = namedtuple("StationDot", "x,y,radius,rgba")
+"""A dot to be drawn at a station (in y-inverted map coordinates)."""
+
+Label = namedtuple("Label", "x,y,text,style,bbox")
+"""A label to be drawn by draw_text at (x, y) (in y-inverted map coordinates)
+with the keyword arguments in the 'style' dict. The bbox is the label's
+bounding box as given by draw_text_bounds."""
+
+def station_name_shown(station, railway_station_details,
+                       interchange_statuses, prioritise):
+    """Should the name of a station be shown (space permitting)? Only the
+    names of sufficiently major stations, or stations granted higher
+    priority, are shown.
+    """
+    sub_stations = railway_station_details.get(station.station_code)
+    return bool(not railway_station_details or
+                station.station_code.upper() in prioritise or
+                (sub_stations and any(s.interchange_status
+                                      in interchange_statuses
+                                      for s in sub_stations)))
+
+def layout_station_names(ctx, map_inputs, railway_stations,
+                         interchange_statuses, args):
+    """Decide which station names to draw (avoiding overlapping names). The
+    context is only used to measure text.
+    
+    The layout does not depend on journey times and so may be shared by maps
+    of different origins (see NameLayoutCache): the labels' colours are left
+    as None, to be filled in by layout_stations.
     
+    Returns
+    -------
+    [Label, ...]
+        The station name labels (whose text is the station's three-alpha
+        code).
+    """
+    railway_station_details = map_inputs.railway_station_details
+    
+    labels = []
+    label_ot = ObstructionTester()
+    for station in railway_stations:
+        if not station_name_shown(station, railway_station_details,
+                                  interchange_statuses, args.prioritise):
+            continue
+        
+        fargs = [station.eastings - args.station_dot_size*1.05,
+                 -station.northings,
+                 station.station_code]
+        fkwargs = {"align_point": 1,
+                   "font": args.font,
+                   "size": args.station_name_size,
+                   "rgba": None,
+                   "outline_size": args.station_name_outline_size,
+                   "outline_rgba": args.station_name_outline_colour}
+        bbox = draw_text_bounds(ctx, *fargs, **fkwargs)
+        if bbox not in label_ot:
+            label_ot.add(*bbox)
+            labels.append(Label(*fargs, style=fkwargs, bbox=bbox))
+    
+    return labels
+
+def layout_stations(ctx, map_inputs, railway_stations, station_times,
+                    station_colours, interchange_statuses, args,
+                    station_names=None):
+    """Decide which station dots, names and journey times to draw (avoiding
+    overlapping labels). The context is only used to measure text.
+    
+    Station names are placed first (see layout_station_names) and journey
+    times are then placed into the remaining space.
+    
+    Parameters
+    ----------
+    station_names : [Label, ...] or None
+        If given, a (possibly cached) name layout from layout_station_names
+        to use. Names of stations not in railway_stations are omitted. If
+        None, the names of railway_stations are laid out.
+    
+    Returns
+    -------
+    ([StationDot, ...], [Label, ...])
+        The dots and labels in the order they should be drawn.
+    """
+    dots = []
+    labels = []
+    
+    # Station dots
+    dot_ot = ObstructionTester()
+    for station in railway_stations:
+        # Draw a dot where the station is located
+        x = station.eastings
+        y = -station.northings
+        r = args.station_dot_size/2.0
+        dots.append(StationDot(x, y, r, station_colours[station.station_code]))
+        
+        dot_ot.add(x-r, y+r, x+r, y-r)
+    
+    # Station names, coloured by journey time
+    if station_names is None:
+        station_names = layout_station_names(ctx, map_inputs,
+                                             railway_stations,
+                                             interchange_statuses, args)
+    label_ot = ObstructionTester()
+    named_stations = set()
+    for label in station_names:
+        if label.text in station_colours:
+            label_ot.add(*label.bbox)
+            labels.append(label._replace(style=dict(
+                label.style, rgba=station_colours[label.text])))
+            named_stations.add(label.text)
+    
+    # Journey times
+    for station in railway_stations:
+        duration = int(station_times[station.station_code]) // 60
+        hours = duration // 60
+        minutes = duration - (hours * 60)
+        fargs = [station.eastings + args.station_dot_size*1.05,
+                 -station.northings,
+                 "{}:{:02d}".format(hours, minutes)]
+        fkwargs = {"align_point": 0,
+                   "font": args.font,
+                   "size": args.journey_time_size,
+                   "rgba": station_colours[station.station_code],
+                   "outline_size": args.journey_time_outline_size,
+                   "outline_rgba": args.journey_time_outline_colour}
+        bbox = draw_text_bounds(ctx, *fargs, **fkwargs)
+        # Avoid writing times over dots unless the station label was
+        # also displayed (i.e. this station is of higher than usual
+        # priority/interest). Also don't write times which are
+        # outrageous (e.g. >24 hours) since these are probably stations
+        # for which timetable information is very dubious.
+        if (bbox not in label_ot and
+                (bbox not in dot_ot or
+                 station.station_code in named_stations) and
+                hours < 24):
+            label_ot.add(*bbox)
+            labels.append(Label(*fargs, style=fkwargs, bbox=bbox))
+    
+    return (dots, labels)
+
+class NameLayoutCache(object):
+    """Station name layouts (see layout_station_names) which may be reused by
+    any map with the same stations, extent, size and style, regardless of
+    its origin.
+    
+    Layouts are kept in memory and, if a cache directory is given, on disk.
+    """
+    
+    def __init__(self, cache_dir=None):
+        """
+        Parameters
+        ----------
+        cache_dir : str or None
+            If given, the directory in which to keep layouts between runs.
+        """
+        self.cache_dir = cache_dir
+        
+        # {key: [Label, ...], ...}
+        self._layouts = {}
+    
+    def get_key(self, map_inputs, railway_stations, interchange_statuses,
+                extent, width, height, args):
+        """Get the key which identifies a name layout. This incorporates the
+        location of every station (in priority order) and whether its name
+        may be shown, and so reflects the station data and priorities used.
+        """
+        railway_station_details = map_inputs.railway_station_details
+        return hashlib.sha1(json.dumps([
+            [[station.station_code, station.eastings, station.northings,
+              station_name_shown(station, railway_station_details,
+                                 interchange_statuses, args.prioritise)]
+             for station in railway_stations],
+            list(extent), width, height,
+            args.font, args.station_dot_size, args.station_name_size,
+            args.station_name_outline_size,
+            list(args.station_name_outline_colour),
+        ]).encode("utf-8")).hexdigest()
+    
+    def get(self, ctx, map_inputs, railway_stations, interchange_statuses,
+            extent, width, height, args):
+        """Get the name layout for a map (laying it out if necessary). See
+        layout_station_names.
+        """
+        key = self.get_key(map_inputs, railway_stations,
+                           interchange_statuses, extent, width, height, args)
+        if key not in self._layouts:
+            def layout():
+                return layout_station_names(ctx, map_inputs,
+                                            railway_stations,
+                                            interchange_statuses, args)
+            if self.cache_dir is not None:
+                self._layouts[key] = load_cached(
+                    self.cache_dir, "names-{}.pickle".format(key), layout,
+                    "station name layout")
+            else:
+                self._layouts[key] = layout()
+        return self._layouts[key]
+
+def draw_station_layout(ctx, dots, labels):
+    """Draw the dots and labels produced by layout_stations. The context
+    should already be transformed into (y-inverted) map coordinates.
+    """
+    for dot in dots:
+        ctx.set_source_rgba(*dot.rgba)
+        ctx.arc(dot.x, dot.y, dot.radius, 0.0, 2.0*pi)
+        ctx.fill()
+    
+    for label in labels:
+        draw_text(ctx, label.x, label.y, label.text, **label.style)
+
+def get_visible_area(extent, width, height):
+    """Get the area (min_x, min_y, max_x, max_y) which will be visible on a
+    page when the given extent is drawn with fit_and_center (i.e. the extent
+    grown along one axis to match the page's aspect ratio).
+    """
+    min_x, min_y, max_x, max_y = extent
+    scale = fit_scale(width, height, min_x, min_y, max_x, max_y)
+    centre_x = (min_x + max_x) / 2.0
+    centre_y = (min_y + max_y) / 2.0
+    half_width = width / scale / 2.0
+    half_height = height / scale / 2.0
+    return (centre_x - half_width, centre_y - half_height,
+            centre_x + half_width, centre_y + half_height)
+
+def get_viewport(args, map_inputs):
+    """Get the area (min_x, min_y, max_x, max_y) selected by the --bbox or
+    --centre and --radius arguments, or None to show everything. Raises a
+    ValueError if the --centre station is unknown.
+    """
+    if args.bbox is not None:
+        min_x, min_y, max_x, max_y = args.bbox
+        return (min(min_x, max_x), min(min_y, max_y),
+                max(min_x, max_x), max(min_y, max_y))
+    elif args.centre is not None:
+        for station in map_inputs.railway_stations:
+            if station.station_code == args.centre:
+                return (station.eastings - args.radius,
+                        station.northings - args.radius,
+                        station.eastings + args.radius,
+                        station.northings + args.radius)
+        raise ValueError("Unknown --centre station {}".format(args.centre))
+    else:
+        return None
+
+def render_map(filename, map_inputs, station_times, colours, args,
+               base_layers=None, viewport=None, name_layouts=None):
+    """Render a map of journey times to a PNG or PDF file.
+    
+    Parameters
+    ----------
+    filename : str
+        The output filename (*.png or *.pdf).
+    map_inputs : MapInputs
+    station_times : {three_alpha_code: duration_in_seconds, ...}
+    colours : [(seconds, (r, g, b, a)), ...]
+        The parsed (and sorted) --colours.
+    args
+        The parsed command line arguments (giving the output size and style
+        options).
+    base_layers : BaseLayerCache or None
+        If given, the coastline and railway lines are drawn from (and added
+        to) this cache rather than being drawn directly.
+    viewport : (min_x, min_y, max_x, max_y) or None
+        If given, the area (in eastings and northings) to draw (see
+        get_viewport). Stations and lines which are not visible are culled
+        before drawing. If None, all stations are shown.
+    name_layouts : NameLayoutCache or None
+        If given, station names are laid out for every station (whether or
+        not it is reachable) using (and adding to) this cache, rather than
+        being laid out for this map alone. This allows the layout to be
+        shared by maps of different origins but may leave reachable stations
+        unnamed where their names collide with those of unreachable
+        stations.
+    """
+    output_format = get_output_format(filename)
+    
+    if viewport is not None:
+        width, height = get_map_size(viewport, output_format,
+                                     args.width, args.height)
+        visible = get_visible_area(viewport, width, height)
+        
+        # Include stations just out of view whose labels may be visible
+        text_size = max(args.station_name_size, args.journey_time_size)
+        margin = text_size * 4 + args.station_dot_size
+        min_x, min_y, max_x, max_y = visible
+        area = (min_x - margin, min_y - margin,
+                max_x + margin, max_y + margin)
+        railway_stations = get_map_stations(map_inputs, station_times,
+                                            args.prioritise, area)
+        extent = viewport
+    else:
+        visible = None
+        area = None
+        railway_stations = get_map_stations(map_inputs, station_times,
+                                            args.prioritise)
+        extent = get_map_extent(map_inputs, railway_stations, args)
+        width, height = get_map_size(extent, output_format,
+                                     args.width, args.height)
+    
+    min_x, min_y, max_x, max_y = extent
+    station_colours = get_station_colours(railway_stations, station_times,
+                                          colours)
+    interchange_statuses = get_interchange_statuses(args.minimum_size)
+    
+    # Choose the level of detail for lines (in map units)
+    if args.simplify is None:
+        simplify = output_format.default_simplify
+    else:
+        simplify = args.simplify
+    tolerance = simplify / fit_scale(width, height,
+                                     min_x, -max_y, max_x, -min_y)
+    
+    with output_format.surface(filename, width, height) as ctx:
+        setup_line_style(ctx)
+        
+        if args.heatmap:
+            draw_heatmap(ctx, map_inputs, station_times, colours,
+                         get_visible_area(extent, width, height),
+                         width, height, output_format.raster_scale, args)
+        
+        if base_layers is not None:
+            with ctx:
+                ctx.set_source_surface(
+                    base_layers.get(map_inputs, extent, width, height,
+                                    output_format.vector, tolerance, args,
+                                    visible),
+                    0, 0)
+                ctx.paint()
+        
+        # Center the map and re-scale to map distance units... NB: From here
+        # on, 'y' coordinates are inverted as map coordinates go from south to
+        # north while Cairo coordinates do the opposite.
+        with fit_and_center(ctx, width, height, min_x, -max_y, max_x, -min_y):
+            if base_layers is None:
+                draw_base_layer(ctx, map_inputs, tolerance, args, visible)
+            
+            if name_layouts is not None:
+                all_stations = set(station.station_code
+                                   for station in map_inputs.railway_stations)
+                station_names = name_layouts.get(
+                    ctx, map_inputs,
+                    get_map_stations(map_inputs, all_stations,
+                                     args.prioritise, area),
+                    interchange_statuses, extent, width, height, args)
+            else:
+                station_names = None
+            
+            dots, labels = layout_stations(
+                ctx, map_inputs, railway_stations, station_times,
+                station_colours, interchange_statuses, args, station_names)
+            draw_station_layout(ctx, dots, labels)
+
+BATCH_FIELDS = ("origin", "start_time")
+"""The placeholders which may appear in a batch output filename."""
+
+def get_batch_fields(filename):
+    """Get the set of BATCH_FIELDS placeholders (e.g. '{origin}') used in an
+    output filename, raising a ValueError for unknown placeholders.
+    """
+    fields = set(field for _literal, field, _spec, _conversion
+                 in string.Formatter().parse(filename)
+                 if field is not None)
+    unknown = fields - set(BATCH_FIELDS)
+    if unknown:
+        raise ValueError(
+            "Unknown output filename placeholder(s): {}".format(
+                ", ".join(sorted(unknown))))
+    return fields
+
+def format_start_time(start_time):
+    """Format a start time string (as given in station times files) in a
+    filename-friendly way, e.g. '20160815-0900'.
+    """
+    try:
+        return datetime.datetime.strptime(
+            start_time, "%Y-%m-%d %H:%M:%S").strftime("%Y%m%d-%H%M")
+    except (TypeError, ValueError):
+        return re.sub(r"[^0-9A-Za-z_-]", "", str(start_time))
+
+# Set in the parent process before worker processes are forked by
+# render_batch (and so inherited by them).
+_worker_batch = None
+_worker_map_inputs = None
+_worker_colours = None
+_worker_args = None
+_worker_base_layers = None
+_worker_viewport = None
+_worker_name_layouts = None
+
+def _render_batch_map(filename):
+    """Internal use. Render one map of a batch in a worker process."""
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    render_map(filename, _worker_map_inputs, _worker_batch[filename],
+               _worker_colours, _worker_args, _worker_base_layers,
+               _worker_viewport, _worker_name_layouts)
+    return filename
+
+def render_batch(filename_pattern, station_times_filename, map_inputs,
+                 colours, args, base_layers, jobs=1, viewport=None,
+                 name_layouts=None):
+    """Render one map per origin and/or start time in a station times file
+    (or directory).
+    
+    Parameters
+    ----------
+    filename_pattern : str
+        The output filename with '{origin}' and/or '{start_time}'
+        placeholders. Journey times from results which map to the same
+        filename are combined (taking the minimum duration to each station).
+    station_times_filename : str
+        See iter_station_times.
+    map_inputs, colours, args, base_layers, viewport, name_layouts
+        See render_map.
+    jobs : int or None
+        The number of processes to render maps with (None means one per
+        CPU).
+    
+    Returns
+    -------
+    [filename, ...]
+        The maps drawn.
+    """
+    # Combine the journey times for each output file
+    batch = OrderedDict()
+    for start_station, start_time, station_times in \
+            iter_station_times(station_times_filename):
+        filename = filename_pattern.format(
+            origin=start_station,
+            start_time=format_start_time(start_time))
+        combined = batch.setdefault(filename, {})
+        for station, duration in station_times.items():
+            combined[station] = min(combined.get(station, duration),
+                                    duration)
+    filenames = list(batch)
+    if not filenames:
+        return []
+    
+    global _worker_batch, _worker_map_inputs, _worker_colours
+    global _worker_args, _worker_base_layers, _worker_viewport
+    global _worker_name_layouts
+    _worker_batch = batch
+    _worker_map_inputs = map_inputs
+    _worker_colours = colours
+    _worker_args = args
+    _worker_base_layers = base_layers
+    _worker_viewport = viewport
+    _worker_name_layouts = name_layouts
+    
+    # The first map is drawn before any worker processes are started so that
+    # the geometry it loads and simplifies and the base layer and station name
+    # layout it produces are inherited by (rather than repeated in) every
+    # worker.
+    _render_batch_map(filenames[0])
+    logger.info("Drew %s (1 of %d)", filenames[0], len(filenames))
+    
+    if jobs == 1 or len(filenames) == 1:
+        pool = None
+        drawn = map(_render_batch_map, filenames[1:])
+    else:
+        pool = multiprocessing.get_context("fork").Pool(jobs)
+        drawn = pool.imap_unordered(_render_batch_map, filenames[1:])
+    try:
+        for num, filename in enumerate(drawn, 2):
+            logger.info("Drew %s (%d of %d)", filename, num, len(filenames))
+    finally:
+        if pool is not None:
+            pool.terminate()
+    
+    return filenames
+
+def add_map_arguments(parser):
+    """Add the input, style and performance arguments shared by all map
+    drawing commands to an ArgumentParser.
+    """
     input_group = parser.add_argument_group("input files")
     
     input_group.add_argument("--station-times", "-i", metavar="FILENAME",
@@ -261,7 +1186,8 @@ def main():
                              help="(Required.) CSV file enumerating "
                                   "journey times to all stations to be shown. "
                                   "The output of the railmap_station_times "
-                                  "command.")
+                                  "command (in any --format) or a directory "
+                                  "of such files.")
     
     input_group.add_argument("--railway-stations", "-t", metavar="FILENAME",
                              required=True,
@@ -288,7 +1214,26 @@ def main():
                                   "the outline of the UK, e.g. from OS "
                                   "Open Data. If omitted the UK outline will "
                                   "be omitted.")
-
+    
+    area_group = parser.add_argument_group(
+        "area options",
+        description="Options which select the area to draw. By default the "
+                    "whole network is drawn.")
+    
+    area_group.add_argument("--bbox", type=float, nargs=4,
+                            metavar=("MIN_X", "MIN_Y", "MAX_X", "MAX_Y"),
+                            help="Draw only the area between the given "
+                                 "eastings and northings.")
+    area_group.add_argument("--centre", type=str.upper, metavar="STATION",
+                            help="Draw only the area around the station with "
+                                 "the given three-alpha code (see "
+                                 "--radius).")
+    area_group.add_argument("--radius", type=float, default=20000.0,
+                            metavar="METERS",
+                            help="The distance from the --centre station to "
+                                 "the edges of the area drawn. "
+                                 "(Default: %(default)s)")
+    
     style_group = parser.add_argument_group(
         "aesthetic options",
         description="Options which affect the style of the generated image. "
@@ -375,206 +1320,131 @@ def main():
     style_group.add_argument("--font", type=str, default="Sans",
                              help="The font to use for all text.")
     
-    args = parser.parse_args()
+    performance_group = parser.add_argument_group("performance options")
     
-    interchange_statuses = []
-    if args.minimum_size in ("large", "medium", "small"):
-        interchange_statuses.append(InterchangeStatus.large)
-    if args.minimum_size in ("medium", "small"):
-        interchange_statuses.append(InterchangeStatus.medium)
-    if args.minimum_size in ("small"):
-        interchange_statuses.append(InterchangeStatus.small)
+    performance_group.add_argument("--jobs", type=int, default=1,
+                                   metavar="N",
+                                   help="When drawing a batch of maps (or "
+                                        "tiles), the number to draw in "
+                                        "parallel. 0 means one per CPU. "
+                                        "(Default: %(default)s)")
     
-    # Check filetype and select sensible default image sizes etc.
-    filetype = args.filename.split(".")[-1].lower()
-    if filetype == "png":
-        cairo_env_decorator = cairo_png
-        default_width = 1000
-        dimension_format = int
-    elif filetype == "pdf":
-        cairo_env_decorator = cairo_pdf
-        # A4
-        default_width = 297.0
-        dimension_format = float
-    else:
-        parser.error("Output filename must end with *.png or *.pdf.")
+    performance_group.add_argument("--simplify", type=float,
+                                   metavar="TOLERANCE",
+                                   help="Simplify railway lines and the "
+                                        "coastline, removing detail smaller "
+                                        "than this size on the output (PDF: "
+                                        "mm, PNG: px). 0 disables "
+                                        "simplification. (Default: 0.02 for "
+                                        "PDF, 0.25 for PNG)")
+    performance_group.add_argument("--cache-dir", metavar="DIRECTORY",
+                                   help="A directory in which to cache "
+                                        "the station table, (simplified) "
+                                        "railway line and coastline geometry "
+                                        "and (for PNG output) the rendered "
+                                        "coastline and railway lines between "
+                                        "runs.")
+
+def add_heatmap_arguments(parser):
+    """Add the arguments which control travel-time heatmaps (see
+    draw_heatmap) to an ArgumentParser."""
+    heatmap_group = parser.add_argument_group(
+        "heatmap options",
+        description="Options which control the travel-time heatmap: a "
+                    "raster coloured (using --colours) by the time taken to "
+                    "reach each point by rail and then on foot from the "
+                    "best station.")
     
-    # Load and parse input data files
-    station_times = load_station_times(args.station_times)
-    railway_stations = dbf_to_dict(args.railway_stations)
+    heatmap_group.add_argument("--heatmap", action="store_true",
+                               help="Draw a travel-time heatmap beneath the "
+                                    "map.")
+    heatmap_group.add_argument("--walking-speed", type=float, default=5.0,
+                               metavar="KM/H",
+                               help="The walking speed from stations. "
+                                    "(Default: %(default)s)")
+    heatmap_group.add_argument("--max-walk", type=float, default=60.0,
+                               metavar="MINUTES",
+                               help="The longest walk from a station. Places "
+                                    "further from every station are left "
+                                    "blank. (Default: %(default)s)")
+    heatmap_group.add_argument("--heatmap-opacity", type=float, default=0.5,
+                               metavar="OPACITY",
+                               help="The opacity of the heatmap, from 0.0 "
+                                    "to 1.0. (Default: %(default)s)")
+
+def main():
+    parser = ArgumentParser(
+        description="Render a map showing journey times calculated by the "
+                    "railmap_station_times script.")
     
-    # Filter station list to just those stations for which distance information
-    # is available and which are not at the invalid coordinate (0, 0)
-    railway_stations = [
-        station for station in railway_stations.values()
-        if station.station_code in station_times and
-        (station.eastings, station.northings) != (0, 0)
-    ]
+    output_group = parser.add_argument_group("output options")
     
-    if args.railway_station_details is not None:
-        railway_station_details = msn_to_dict(args.railway_station_details)
-    else:
-        railway_station_details = {}
+    output_group.add_argument("filename", metavar="FILENAME",
+                              help="The output filename *.pdf or *.png. "
+                                   "If this contains '{origin}' and/or "
+                                   "'{start_time}' one map is drawn for "
+                                   "each start station and/or start time "
+                                   "in the --station-times file, e.g. "
+                                   "'maps/{origin}-{start_time}.png'.")
+    output_group.add_argument("width", nargs="?", metavar="WIDTH", type=float,
+                              help="Output size (PDF: mm, PNG: px). "
+                                   "Automatic if not given.")
+    output_group.add_argument("height", nargs="?", metavar="HEIGHT", type=float,
+                              help="Automatic if not given.")
     
-    # Sort the station list to put high-priorty entities first
-    def interchange_score(station):
-        substations = railway_station_details.get(station.station_code)
-        if substations:
-            return max(s.interchange_status.score for s in substations)
-        else:
-            return 0
-    railway_stations = sorted(railway_stations, key=(lambda station:
-        args.prioritise.index(station.station_code)
-        if station.station_code in args.prioritise
-        else len(args.prioritise) + (10 - interchange_score(station))))
+    add_map_arguments(parser)
+    add_heatmap_arguments(parser)
+    
+    parser.add_argument("--verbose", "-v", action="store_true",
+                        help="Show verbose status during processing.")
+    
+    args = parser.parse_args()
+    
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+    
+    # Check filetype and batch filename placeholders
+    try:
+        get_output_format(args.filename)
+        batch_fields = get_batch_fields(args.filename)
+    except ValueError as e:
+        parser.error(str(e))
     
     # Parse the colour list
     try:
         colours = sorted(map(time_and_colour, args.colours))
     except ValueError:
         parser.error("All --colours must be of the form H:MM#RRGGBB.")
-    station_colours = {}
-    for station in railway_stations:
-        journey_time = station_times[station.station_code]
-        colour = (0.0, 0.0, 0.0, 1.0)
-        for threshold, colour in colours:
-            if journey_time <= threshold:
-                break
-        station_colours[station.station_code] = colour
-    
-    if args.railway_lines is not None:
-        railway_lines = shp_to_lists(args.railway_lines)
-    else:
-        railway_lines = []
     
-    if args.coastline is not None:
-        coastline = shp_to_lists(args.coastline)
-    else:
-        coastline = []
-    
-    
-    # Determine the dimensions of the network
-    min_x, min_y, max_x, max_y = get_network_bounds(
-        coastline + railway_lines +
-        [[(station.eastings, station.northings) for station in railway_stations]])
-    
-    # Add padding around edges for labels (a bit over-generous since we can't
-    # compute text extents before the context is created)
-    text_size = max(args.station_name_size, args.journey_time_size)
-    w = text_size * 4  # Station names are 3 characters wide, allow for spacing/variable font width
-    h = text_size * 1.5
-    min_x -= w
-    max_x += w
-    min_y -= h
-    max_y += h
+    # Load and parse input data files
+    map_inputs = MapInputs(args)
     
-    # Determine map dimensions
-    network_width = max_x - min_x
-    network_height = max_y - min_y
-    network_ratio = network_width / network_height
+    try:
+        viewport = get_viewport(args, map_inputs)
+    except ValueError as e:
+        parser.error(str(e))
     
-    # Determine requested dimensions
-    if args.width is None:
-        width = default_width
+    if batch_fields:
+        # Within a batch the base layer and station name layout are (almost
+        # always) shared by every map and so are always cached.
+        render_batch(args.filename, args.station_times, map_inputs, colours,
+                     args, BaseLayerCache(args.cache_dir),
+                     args.jobs or None, viewport,
+                     NameLayoutCache(args.cache_dir))
     else:
-        width = args.width
-    if args.height is None:
-        height = width / network_ratio
-    else:
-        height = args.height
-    
-    width = dimension_format(width)
-    height = dimension_format(height)
-    
-    with cairo_env_decorator(args.filename, width, height) as ctx:
-        # Draw lines with rounded joints and caps to avoid highly detailed
-        # segments (e.g. coastline) becoming jagged horror-shows with large
-        # mitres pointing out.
-        ctx.set_line_cap(cairo.LINE_CAP_ROUND)
-        ctx.set_line_join(cairo.LINE_JOIN_ROUND)
+        station_times = load_station_times(args.station_times)
         
-        # Center the map and re-scale to map distance units... NB: From here
-        # on, 'y' coordinates are inverted as map coordinates go from south to
-        # north while Cairo coordinates do the opposite.
-        with fit_and_center(ctx, width, height, min_x, -max_y, max_x, -min_y):
-            # Draw coastline
-            ctx.set_line_width(args.coastline_thickness)
-            ctx.set_source_rgba(*args.coastline_colour)
-            draw_shp_lists(ctx, coastline)
-            ctx.stroke()
-            
-            # Draw railway lines
-            ctx.set_line_width(args.railway_line_thickness)
-            ctx.set_source_rgba(*args.railway_line_colour)
-            draw_shp_lists(ctx, railway_lines)
-            ctx.stroke()
-            
-            # Draw station dots
-            dot_ot = ObstructionTester()
-            for station in railway_stations:
-                # Draw a dot where the station is located
-                ctx.set_source_rgba(*station_colours[station.station_code])
-                x = station.eastings
-                y = -station.northings
-                r = args.station_dot_size/2.0
-                ctx.arc(x, y, r, 0.0, 2.0*pi)
-                ctx.fill()
-                
-                dot_ot.add(x-r, y+r, x+r, y-r)
-            
-            # Draw station names and journey times
-            label_ot = ObstructionTester()
-            for station in railway_stations:
-                # Only show station names for sufficiently major stations, or
-                # stations granted higher priority
-                sub_stations = railway_station_details.get(station.station_code)
-                station_name_visible = False
-                if (not railway_station_details or 
-                        station.station_code.upper() in args.prioritise or
-                        (sub_stations and any(s.interchange_status
-                                              in interchange_statuses
-                                              for s in sub_stations))):
-                    fargs = [ctx,
-                             station.eastings - args.station_dot_size*1.05,
-                             -station.northings,
-                             station.station_code]
-                    fkwargs = {"align_point": 1,
-                               "font": args.font,
-                               "size": args.station_name_size,
-                               "rgba": station_colours[station.station_code],
-                               "outline_size": args.station_name_outline_size,
-                               "outline_rgba": args.station_name_outline_colour}
-                    bbox = draw_text_bounds(*fargs, **fkwargs)
-                    if bbox not in label_ot:
-                        label_ot.add(*bbox)
-                        draw_text(*fargs, **fkwargs)
-                        station_name_visible = True
-                
-                # Show journey times
-                duration = int(station_times[station.station_code]) // 60
-                hours = duration // 60
-                minutes = duration - (hours * 60)
-                fargs = [ctx,
-                         station.eastings + args.station_dot_size*1.05,
-                         -station.northings,
-                         "{}:{:02d}".format(hours, minutes)]
-                fkwargs = {"align_point": 0,
-                           "font": args.font,
-                           "size": args.journey_time_size,
-                           "rgba": station_colours[station.station_code],
-                           "outline_size": args.journey_time_outline_size,
-                           "outline_rgba": args.journey_time_outline_colour}
-                bbox = draw_text_bounds(*fargs, **fkwargs)
-                # Avoid writing times over dots unless the station label was
-                # also displayed (i.e. this station is of higher than usual
-                # priority/interest). Also don't write times which are
-                # outrageous (e.g. >24 hours) since these are probably stations
-                # for which timetable information is very dubious.
-                if (bbox not in label_ot and
-                        (bbox not in dot_ot or station_name_visible) and
-                        hours < 24):
-                    label_ot.add(*bbox)
-                    draw_text(*fargs, **fkwargs)
+        if args.cache_dir is not None:
+            base_layers = BaseLayerCache(args.cache_dir)
+        else:
+            base_layers = None
+        
+        # NB: A single map's station names are laid out for its reachable
+        # stations alone (giving their names priority over those of
+        # unreachable stations) rather than using an origin-independent
+        # layout.
+        render_map(args.filename, map_inputs, station_times, colours, args,
+                   base_layers, viewport)
 
 if __name__ == "__main__":
     main()
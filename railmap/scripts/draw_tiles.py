@@ -0,0 +1,330 @@
+"""
+Render a pyramid of map tiles showing journey times calculated by the
+railmap_station_times script, suitable for display in a web map.
+
+Tiles are 'XYZ' tiles in the British National Grid (EPSG:27700) tile matrix
+used by the Ordnance Survey's OS Maps API: the grid's origin (top-left
+corner) is at (-238375, 1376256) and at zoom level 0 each pixel covers 896
+metres, halving with each subsequent level. Tiles are written as
+DIRECTORY/{z}/{x}/{y}.png.
+
+Sizes given in the style options (line thicknesses, dot sizes and text sizes)
+apply at zoom level 0 (where the defaults suit) and are scaled to keep
+features the same size on screen at other zoom levels. Labels are therefore
+laid out separately for each zoom level.
+"""
+
+import os
+import logging
+import multiprocessing
+
+from argparse import ArgumentParser, Namespace
+from math import floor
+
+import cairocffi as cairo
+
+from railmap.spatial import GridIndex, LineIndex
+from railmap.scripts.draw_railmap import \
+    add_map_arguments, time_and_colour, load_station_times, MapInputs, \
+    get_map_stations, get_station_colours, get_interchange_statuses, \
+    get_map_extent, layout_stations, draw_station_layout, draw_shp_lists, \
+    setup_line_style, fit_and_center, get_viewport
+
+logger = logging.getLogger(__name__)
+
+
+TILE_ORIGIN = (-238375.0, 1376256.0)
+"""The top-left corner of the tile grid (eastings, northings)."""
+
+ZOOM_0_RESOLUTION = 896.0
+"""The size of a pixel (metres) at zoom level 0."""
+
+
+def tile_resolution(zoom):
+    """The size of a pixel (metres) at a given zoom level."""
+    return ZOOM_0_RESOLUTION / (2 ** zoom)
+
+def tile_bounds(zoom, x, y, tile_size=256):
+    """Get the area covered by a tile as a (min_x, min_y, max_x, max_y) tuple
+    of eastings and northings.
+    """
+    size = tile_size * tile_resolution(zoom)
+    origin_x, origin_y = TILE_ORIGIN
+    return (origin_x + x*size, origin_y - (y + 1)*size,
+            origin_x + (x + 1)*size, origin_y - y*size)
+
+def tile_range(extent, zoom, tile_size=256):
+    """Get the ranges of tile x and y coordinates which cover an area (given
+    as a (min_x, min_y, max_x, max_y) tuple of eastings and northings).
+    """
+    min_x, min_y, max_x, max_y = extent
+    size = tile_size * tile_resolution(zoom)
+    origin_x, origin_y = TILE_ORIGIN
+    return (range(int(floor((min_x - origin_x) / size)),
+                  int(floor((max_x - origin_x) / size)) + 1),
+            range(int(floor((origin_y - max_y) / size)),
+                  int(floor((origin_y - min_y) / size)) + 1))
+
+SCALED_STYLE_ARGUMENTS = (
+    "railway_line_thickness", "coastline_thickness", "station_dot_size",
+    "station_name_size", "station_name_outline_size", "journey_time_size",
+    "journey_time_outline_size",
+)
+"""The style arguments which give sizes (in metres at zoom level 0)."""
+
+def scale_style(args, zoom):
+    """Scale the size style arguments (given in metres at zoom level 0) such
+    that features are the same size (in pixels) at the given zoom level.
+    Returns a new Namespace.
+    """
+    scaled = Namespace(**vars(args))
+    factor = tile_resolution(zoom) / tile_resolution(0)
+    for name in SCALED_STYLE_ARGUMENTS:
+        setattr(scaled, name, getattr(args, name) * factor)
+    return scaled
+
+class ZoomLevel(object):
+    """Everything drawn on the tiles of one zoom level, indexed so that the
+    parts falling within a tile can be found quickly.
+    
+    Station dots and labels are laid out once for the whole zoom level so
+    that labels crossing tile edges are drawn in full, at the same position,
+    on every tile they touch.
+    """
+    
+    def __init__(self, zoom, map_inputs, railway_stations, station_times,
+                 station_colours, interchange_statuses, tile_size, simplify,
+                 args):
+        """
+        Parameters
+        ----------
+        zoom : int
+        map_inputs, railway_stations, station_times, station_colours,
+        interchange_statuses
+            See layout_stations.
+        tile_size : int
+            Tile width and height (pixels).
+        simplify : float
+            The line simplification tolerance (pixels).
+        args
+            The parsed command line arguments (giving the style options, with
+            sizes as they should appear at zoom level 0).
+        """
+        self.zoom = zoom
+        self.tile_size = tile_size
+        
+        resolution = tile_resolution(zoom)
+        style = scale_style(args, zoom)
+        
+        # Lay out stations in (y-inverted) map units
+        ctx = cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1))
+        self.dots, self.labels = layout_stations(
+            ctx, map_inputs, railway_stations, station_times,
+            station_colours, interchange_statuses, style)
+        
+        cell_size = tile_size * resolution
+        self.dot_index = GridIndex(cell_size)
+        for num, dot in enumerate(self.dots):
+            self.dot_index.add(dot.x - dot.radius, dot.y - dot.radius,
+                               dot.x + dot.radius, dot.y + dot.radius, num)
+        self.label_index = GridIndex(cell_size)
+        for num, label in enumerate(self.labels):
+            self.label_index.add(*label.bbox, value=num)
+        
+        # [(LineIndex, thickness, colour), ...]
+        tolerance = simplify * resolution
+        self.lines = [
+            (LineIndex(shape.at_tolerance(tolerance), cell_size),
+             thickness, colour)
+            for shape, thickness, colour in [
+                (map_inputs.coastline,
+                 style.coastline_thickness,
+                 style.coastline_colour),
+                (map_inputs.railway_lines,
+                 style.railway_line_thickness,
+                 style.railway_line_colour),
+            ]
+            if shape is not None
+        ]
+    
+    def render_tile(self, filename, x, y):
+        """Render a single tile, returning False (and writing nothing) if the
+        tile would be empty.
+        """
+        min_x, min_y, max_x, max_y = tile_bounds(self.zoom, x, y,
+                                                 self.tile_size)
+        
+        # Find the lines, dots and labels within the tile, allowing for the
+        # thickness of lines.
+        lines = []
+        for line_index, thickness, colour in self.lines:
+            margin = thickness / 2.0
+            chunks = line_index.query(min_x - margin, min_y - margin,
+                                      max_x + margin, max_y + margin)
+            if chunks:
+                lines.append((chunks, thickness, colour))
+        
+        # NB: Dots and labels are in y-inverted coordinates
+        dots = [self.dots[i] for i in sorted(
+            self.dot_index.query(min_x, -max_y, max_x, -min_y))]
+        labels = [self.labels[i] for i in sorted(
+            self.label_index.query(min_x, -max_y, max_x, -min_y))]
+        
+        if not (lines or dots or labels):
+            return False
+        
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32,
+                                     self.tile_size, self.tile_size)
+        ctx = cairo.Context(surface)
+        setup_line_style(ctx)
+        with fit_and_center(ctx, self.tile_size, self.tile_size,
+                            min_x, -max_y, max_x, -min_y):
+            for chunks, thickness, colour in lines:
+                ctx.set_line_width(thickness)
+                ctx.set_source_rgba(*colour)
+                draw_shp_lists(ctx, chunks)
+                ctx.stroke()
+            
+            draw_station_layout(ctx, dots, labels)
+        
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        surface.write_to_png(filename)
+        return True
+
+# Set in the parent process before worker processes are forked by
+# render_tiles (and so inherited by them).
+_worker_zoom_levels = None
+
+def _render_tile(tile):
+    """Internal use. Render a tile in a worker process."""
+    filename, zoom, x, y = tile
+    return _worker_zoom_levels[zoom].render_tile(filename, x, y)
+
+def render_tiles(directory, zoom_levels, extent, jobs=1):
+    """Render all non-empty tiles covering an area.
+    
+    Parameters
+    ----------
+    directory : str
+        Tiles are written to DIRECTORY/{z}/{x}/{y}.png.
+    zoom_levels : [ZoomLevel, ...]
+    extent : (min_x, min_y, max_x, max_y)
+        The area to cover (eastings and northings).
+    jobs : int or None
+        The number of processes to render tiles with (None means one per
+        CPU).
+    
+    Returns
+    -------
+    (tiles_written, tiles_skipped)
+    """
+    tiles = []
+    for zoom_level in zoom_levels:
+        zoom = zoom_level.zoom
+        xs, ys = tile_range(extent, zoom, zoom_level.tile_size)
+        for x in xs:
+            for y in ys:
+                filename = os.path.join(directory, str(zoom), str(x),
+                                        "{}.png".format(y))
+                tiles.append((filename, zoom, x, y))
+    
+    global _worker_zoom_levels
+    _worker_zoom_levels = {zoom_level.zoom: zoom_level
+                           for zoom_level in zoom_levels}
+    
+    if jobs == 1:
+        pool = None
+        results = map(_render_tile, tiles)
+    else:
+        pool = multiprocessing.get_context("fork").Pool(jobs)
+        results = pool.imap_unordered(_render_tile, tiles, chunksize=16)
+    
+    written = 0
+    try:
+        for num, result in enumerate(results, 1):
+            written += result
+            if num % 1000 == 0:
+                logger.info("Drawn %d of %d tiles", num, len(tiles))
+    finally:
+        if pool is not None:
+            pool.terminate()
+    
+    return (written, len(tiles) - written)
+
+def main():
+    parser = ArgumentParser(
+        description="Render a pyramid of web map tiles showing journey times "
+                    "calculated by the railmap_station_times script. Tiles "
+                    "use the OS Maps API British National Grid "
+                    "(EPSG:27700) ZXY tile matrix.")
+    
+    output_group = parser.add_argument_group("output options")
+    
+    output_group.add_argument("directory", metavar="DIRECTORY",
+                              help="The directory to write tiles to (as "
+                                   "DIRECTORY/{z}/{x}/{y}.png).")
+    output_group.add_argument("--zoom", "-z", type=int, nargs=2,
+                              default=[0, 6], metavar=("MIN", "MAX"),
+                              help="The range of zoom levels to draw. "
+                                   "(Default: %(default)s)")
+    output_group.add_argument("--tile-size", type=int, default=256,
+                              metavar="PIXELS",
+                              help="The width and height of each tile. "
+                                   "(Default: %(default)s)")
+    
+    add_map_arguments(parser)
+    
+    parser.add_argument("--verbose", "-v", action="store_true",
+                        help="Show verbose status during processing.")
+    
+    args = parser.parse_args()
+    
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+    
+    # Parse the colour list
+    try:
+        colours = sorted(map(time_and_colour, args.colours))
+    except ValueError:
+        parser.error("All --colours must be of the form H:MM#RRGGBB.")
+    
+    # Load and parse input data files
+    station_times = load_station_times(args.station_times)
+    map_inputs = MapInputs(args)
+    
+    try:
+        viewport = get_viewport(args, map_inputs)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    railway_stations = get_map_stations(map_inputs, station_times,
+                                        args.prioritise, viewport)
+    station_colours = get_station_colours(railway_stations, station_times,
+                                          colours)
+    interchange_statuses = get_interchange_statuses(args.minimum_size)
+    
+    # NB: Every zoom level is prepared before any worker processes are
+    # started so that they are shared by (rather than repeated in) every
+    # worker.
+    min_zoom, max_zoom = args.zoom
+    zoom_levels = []
+    for zoom in range(min_zoom, max_zoom + 1):
+        logger.info("Preparing zoom level %d", zoom)
+        zoom_levels.append(ZoomLevel(
+            zoom, map_inputs, railway_stations, station_times,
+            station_colours, interchange_statuses, args.tile_size,
+            0.25 if args.simplify is None else args.simplify, args))
+    
+    if viewport is not None:
+        extent = viewport
+    else:
+        extent = get_map_extent(map_inputs, railway_stations,
+                                scale_style(args, min_zoom))
+    written, skipped = render_tiles(args.directory, zoom_levels, extent,
+                                    args.jobs or None)
+    logger.info("Wrote %d tiles (%d empty tiles skipped)", written, skipped)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Produce isochrone polygons (the areas reachable within given journey
+durations) from journey times calculated by the railmap_station_times script,
+as GeoJSON.
+"""
+
+import os
+import sys
+import json
+import logging
+import multiprocessing
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+
+import numpy as np
+
+from railmap.stations import load_stations
+from railmap.isochrone import isochrone_polygons, isochrone_geojson
+from railmap.scripts.draw_railmap import \
+    iter_station_times, get_batch_fields, format_start_time
+
+logger = logging.getLogger(__name__)
+
+
+def get_isochrones(station_locations, station_times, args):
+    """Compute isochrones (see railmap.isochrone.isochrone_polygons) from a
+    {three_alpha_code: duration, ...} dict of journey times.
+    
+    Parameters
+    ----------
+    station_locations : {three_alpha_code: (eastings, northings), ...}
+    station_times : {three_alpha_code: duration, ...}
+    args
+        The parsed command line arguments.
+    """
+    codes = [code for code in station_times if code in station_locations]
+    station_xy = np.array([station_locations[code] for code in codes],
+                          dtype=np.float64)
+    times = np.array([station_times[code] for code in codes],
+                     dtype=np.float64)
+    return isochrone_polygons(
+        station_xy, times, args.minutes,
+        resolution=args.resolution,
+        walking_speed=args.walking_speed * 1000.0 / 3600.0,
+        max_walk=None if args.max_walk is None else args.max_walk * 60.0,
+        tolerance=args.simplify)
+
+def write_geojson(filename, geojson):
+    """Write a GeoJSON dict to a file (or stdout if filename is '-')."""
+    if filename == "-":
+        json.dump(geojson, sys.stdout)
+        sys.stdout.write("\n")
+        return
+    
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(filename, "w") as f:
+        json.dump(geojson, f)
+
+# Set in the parent process before worker processes are forked by
+# write_isochrones (and so inherited by them).
+_worker_batch = None
+_worker_station_locations = None
+_worker_args = None
+
+def _write_isochrones(filename):
+    """Internal use. Compute and write one file of isochrones in a worker
+    process."""
+    properties, station_times = _worker_batch[filename]
+    isochrones = get_isochrones(_worker_station_locations, station_times,
+                                _worker_args)
+    write_geojson(filename, isochrone_geojson(isochrones, properties))
+    return filename
+
+def write_isochrones(filename_pattern, station_times_filename,
+                     station_locations, args, jobs=1):
+    """Write isochrones for every origin and/or start time in a station times
+    file (or directory).
+    
+    Parameters
+    ----------
+    filename_pattern : str
+        The output filename, with optional '{origin}' and/or '{start_time}'
+        placeholders. Journey times from results which map to the same
+        filename are combined (taking the minimum duration to each station).
+    station_times_filename : str
+        See iter_station_times.
+    station_locations, args
+        See get_isochrones.
+    jobs : int or None
+        The number of processes to use (None means one per CPU).
+    
+    Returns
+    -------
+    [filename, ...]
+        The files written.
+    """
+    # {filename: (properties, {three_alpha_code: duration, ...}), ...}
+    batch = OrderedDict()
+    for start_station, start_time, station_times in \
+            iter_station_times(station_times_filename):
+        filename = filename_pattern.format(
+            origin=start_station,
+            start_time=format_start_time(start_time))
+        properties, combined = batch.setdefault(
+            filename,
+            ({"origin": start_station, "start_time": start_time}, {}))
+        for station, duration in station_times.items():
+            combined[station] = min(combined.get(station, duration),
+                                    duration)
+    filenames = list(batch)
+    
+    global _worker_batch, _worker_station_locations, _worker_args
+    _worker_batch = batch
+    _worker_station_locations = station_locations
+    _worker_args = args
+    
+    if jobs == 1 or len(filenames) <= 1:
+        pool = None
+        written = map(_write_isochrones, filenames)
+    else:
+        pool = multiprocessing.get_context("fork").Pool(jobs)
+        written = pool.imap_unordered(_write_isochrones, filenames)
+    try:
+        for num, filename in enumerate(written, 1):
+            logger.info("Wrote %s (%d of %d)", filename, num, len(filenames))
+    finally:
+        if pool is not None:
+            pool.terminate()
+    
+    return filenames
+
+def main():
+    parser = ArgumentParser(
+        description="Produce GeoJSON isochrone polygons (in British National "
+                    "Grid, EPSG:27700, coordinates) showing the areas "
+                    "reachable by rail and then on foot within given "
+                    "journey durations, from journey times calculated by the "
+                    "railmap_station_times script.")
+    
+    parser.add_argument("filename", metavar="FILENAME",
+                        help="The output filename (or '-' for stdout). If "
+                             "this contains '{origin}' and/or "
+                             "'{start_time}' one file is written for each "
+                             "start station and/or start time in the "
+                             "--station-times file, e.g. "
+                             "'isochrones/{origin}.geojson'.")
+    parser.add_argument("--station-times", "-i", metavar="FILENAME",
+                        required=True,
+                        help="(Required.) The output of the "
+                             "railmap_station_times command (in any "
+                             "--format) or a directory of such files.")
+    parser.add_argument("--railway-stations", "-t", metavar="FILENAME",
+                        required=True,
+                        help="(Required.) DBF file enumerating coordinates "
+                             "of all stations, from the railway 'inspire' "
+                             "data set.")
+    parser.add_argument("--minutes", "-m", type=int, nargs="+",
+                        default=[30, 60, 90],
+                        help="The journey durations to produce isochrones "
+                             "for. (Default: %(default)s)")
+    parser.add_argument("--walking-speed", type=float, default=5.0,
+                        metavar="KM/H",
+                        help="The walking speed from stations. "
+                             "(Default: %(default)s)")
+    parser.add_argument("--max-walk", type=float, default=60.0,
+                        metavar="MINUTES",
+                        help="The longest walk from a station. "
+                             "(Default: %(default)s)")
+    parser.add_argument("--resolution", type=float, default=250.0,
+                        metavar="METERS",
+                        help="The resolution at which journey times are "
+                             "sampled. (Default: %(default)s)")
+    parser.add_argument("--simplify", type=float, metavar="METERS",
+                        help="The maximum distance by which simplified "
+                             "polygon outlines may deviate from the traced "
+                             "outline. (Default: half the --resolution)")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="The number of processes to use when writing "
+                             "several files (0 means one per CPU). "
+                             "(Default: %(default)s)")
+    parser.add_argument("--cache-dir", metavar="DIRECTORY",
+                        help="A directory in which to cache the station "
+                             "table between runs.")
+    parser.add_argument("--verbose", "-v", action="store_true",
+                        help="Show verbose status during processing.")
+    
+    args = parser.parse_args()
+    
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+    
+    try:
+        batch_fields = get_batch_fields(args.filename)
+    except ValueError as e:
+        parser.error(str(e))
+    if batch_fields and args.filename == "-":
+        parser.error("Output filename placeholders cannot be used with "
+                     "stdout.")
+    
+    # Filter out stations at the invalid coordinate (0, 0)
+    station_locations = {
+        station.station_code: (station.eastings, station.northings)
+        for station in load_stations(args.railway_stations,
+                                     args.cache_dir).values()
+        if (station.eastings, station.northings) != (0, 0) and
+        station.eastings is not None and station.northings is not None
+    }
+    
+    write_isochrones(args.filename, args.station_times, station_locations,
+                     args, args.jobs or None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Script which loads a timetable once and then answers route planning queries
+over HTTP until killed.
+"""
+
+import sys
+import signal
+import datetime
+import asyncio
+import logging
+import os.path
+
+from argparse import ArgumentParser
+
+from railmap.route_planner import \
+    load_schedule, PASSENGER_TRAIN_STATUSES, PASSENGER_TRAIN_CATEGORIES
+from railmap.delays import load_delays
+from railmap.server import QueryServer
+from railmap.query_cache import QueryCache
+
+
+def main():
+    parser = ArgumentParser(
+        description="Load Timetable Information Service (TTIS) data and "
+                    "answer route planning queries over HTTP with JSON "
+                    "responses.")
+    
+    parser.add_argument("ttis_files",
+                        help="The name of one of the TTIS data files (.mca, "
+                             ".msn, .flf), the names of the others will be "
+                             "inferred.")
+    
+    parser.add_argument("--all-services", action="store_true",
+                        help="Load all services including freight, empty "
+                             "stock movements and other services which don't "
+                             "carry passengers.")
+    parser.add_argument("--horizon", nargs=2, metavar=("FIRST", "LAST"),
+                        type=lambda s: datetime.datetime.strptime(
+                            s, "%Y-%m-%d").date(),
+                        help="Only load services which run between the given "
+                             "dates (YYYY-MM-DD, inclusive). Queries for "
+                             "journeys outside this period will give "
+                             "incomplete results. (Default: load all "
+                             "services)")
+    parser.add_argument("--delays", metavar="FILENAME",
+                        help="A CSV or JSON file of real-time train delays "
+                             "and cancellations to take into account (see "
+                             "railmap.delays). The file is re-read whenever "
+                             "the server receives SIGHUP.")
+    
+    parser.add_argument("--host", default="localhost",
+                        help="The host to listen on. (Default: %(default)s)")
+    parser.add_argument("--port", "-p", type=int, default=8000,
+                        help="The TCP port to listen on. "
+                             "(Default: %(default)s)")
+    parser.add_argument("--unix-socket", "-u", metavar="PATH",
+                        help="Listen on a Unix domain socket at the given "
+                             "path instead of a TCP port.")
+    
+    parser.add_argument("--workers", "-w", type=int, default=None,
+                        help="Number of worker processes to run queries in. "
+                             "Defaults to the number of CPUs. If 0, queries "
+                             "are answered one at a time within the server "
+                             "process.")
+    
+    parser.add_argument("--cache-size", type=float, default=64.0,
+                        metavar="MB",
+                        help="Maximum size of the query result cache in "
+                             "megabytes. 0 disables the cache. "
+                             "(Default: %(default)s)")
+    parser.add_argument("--cache-bucket", type=int, default=5,
+                        metavar="MINUTES",
+                        help="Queries whose departure times fall into the "
+                             "same bucket of this many minutes share a cached "
+                             "result computed for the start of the bucket. "
+                             "(Default: %(default)s)")
+    
+    parser.add_argument("--stats", action="store_true",
+                        help="Include route planner statistics in responses "
+                             "by default (queries can override this with "
+                             "'stats=0').")
+    
+    parser.add_argument("--verbose", "-v", action="store_true",
+                        help="Show verbose status during processing.")
+    
+    args = parser.parse_args()
+    
+    # Handle arguments
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG)
+    else:
+        logging.basicConfig(level=logging.INFO)
+    
+    base, ext = os.path.splitext(args.ttis_files)
+    
+    # Load schedule
+    schedule = load_schedule(
+        "{}.mca".format(base),
+        "{}.msn".format(base),
+        "{}.flf".format(base),
+        train_statuses=(None if args.all_services
+                        else PASSENGER_TRAIN_STATUSES),
+        train_categories=(None if args.all_services
+                          else PASSENGER_TRAIN_CATEGORIES),
+        horizon=args.horizon)
+    
+    if args.delays:
+        schedule.set_overlay(load_delays(schedule, args.delays))
+    
+    if args.cache_size > 0:
+        cache = QueryCache(int(args.cache_size * 1024 * 1024),
+                           datetime.timedelta(minutes=args.cache_bucket))
+    else:
+        cache = None
+    
+    query_server = QueryServer(schedule, args.workers, cache, args.stats)
+    
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        server = loop.run_until_complete(query_server.start(
+            args.host, args.port, args.unix_socket))
+        logging.info("Listening on %s",
+                     ", ".join(str(s.getsockname()) for s in server.sockets))
+        
+        # Shut down cleanly on SIGTERM as well as Ctrl+C
+        loop.add_signal_handler(signal.SIGTERM, loop.stop)
+        
+        # Reload the delays on SIGHUP
+        if args.delays:
+            reloads = set()
+            
+            def reload_delays():
+                # NB: A reference to the task is kept until it completes
+                task = loop.create_task(_reload_delays(
+                    query_server, schedule, args.delays))
+                reloads.add(task)
+                task.add_done_callback(reloads.discard)
+            
+            loop.add_signal_handler(signal.SIGHUP, reload_delays)
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+    finally:
+        query_server.close()
+        loop.close()
+        if args.unix_socket is not None and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+    
+    return 0
+
+
+async def _reload_delays(query_server, schedule, filename):
+    """Internal use. Reload the delay overlay, restarting the query server's
+    workers (in the background) to pick it up."""
+    # Parsing the delays file may take a while: don't block the event loop
+    loop = asyncio.get_event_loop()
+    try:
+        overlay = await loop.run_in_executor(
+            None, load_delays, schedule, filename)
+    except Exception:
+        logging.exception("Failed to reload delays from %s", filename)
+        return
+    
+    schedule.set_overlay(overlay)
+    try:
+        await query_server.reload_async(schedule)
+    except Exception:
+        logging.exception("Failed to restart workers with delays from %s",
+                          filename)
+        return
+    logging.info("Reloaded delays from %s", filename)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
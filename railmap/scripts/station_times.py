@@ -3,13 +3,25 @@ Script which finds the time taken to reach all stations from a specified
 station.
 """
 
+import sys
+import json
+import hashlib
 import logging
 import os.path
 import datetime
+import multiprocessing
 
 from argparse import ArgumentParser
 
-from railmap.route_planner import load_schedule
+from railmap.route_planner import \
+    load_schedule, PlannerStats, \
+    PASSENGER_TRAIN_STATUSES, PASSENGER_TRAIN_CATEGORIES
+from railmap.multi_origin import MultiOriginScan, UNREACHABLE
+from railmap.delays import load_delays
+from railmap.output import FORMATS, StationIndex, open_writer
+from railmap.cache import \
+    load_schedule_cached, schedule_key, hash_files
+from railmap.checkpoint import Checkpoint, CheckpointMismatchError
 
 
 def main():
@@ -32,6 +44,84 @@ def main():
                         help="The time/date to start at. May be given "
                              "multiple times to test several journeys.")
     
+    parser.add_argument("--all-services", action="store_true",
+                        help="Load all services including freight, empty "
+                             "stock movements and other services which don't "
+                             "carry passengers.")
+    parser.add_argument("--horizon-days", type=int, metavar="N",
+                        help="Only load services which run between the "
+                             "earliest start date and N days after the "
+                             "latest start date. Journeys longer than this "
+                             "will not be found. (Default: load all "
+                             "services)")
+    parser.add_argument("--delays", metavar="FILENAME",
+                        help="A CSV or JSON file of real-time train delays "
+                             "and cancellations to take into account (see "
+                             "railmap.delays).")
+    
+    parser.add_argument("--engine", choices=["search", "scan"],
+                        default="search",
+                        help="The route planning engine to use. 'search' "
+                             "runs a separate route planner search for each "
+                             "station. 'scan' computes journey times from "
+                             "batches of stations at once (much faster when "
+                             "many stations are given, but only considers "
+                             "services running within --scan-days of the "
+                             "start date). (Default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=64, metavar="N",
+                        help="With '--engine scan', the number of stations "
+                             "to process at once. (Default: %(default)s)")
+    parser.add_argument("--scan-days", type=int, default=2, metavar="N",
+                        help="With '--engine scan', the number of days of "
+                             "services (starting with the start date) to "
+                             "consider. (Default: %(default)s)")
+    
+    parser.add_argument("--jobs", "-j", type=int, default=1, metavar="N",
+                        help="Number of worker processes to use. The "
+                             "timetable is loaded once and shared with the "
+                             "workers. If 0, one worker per CPU is used. "
+                             "Output is in the same order regardless. "
+                             "(Default: %(default)s)")
+    
+    parser.add_argument("--output", "-o", metavar="FILENAME",
+                        help="Write the journey times to the named file "
+                             "rather than stdout.")
+    parser.add_argument("--format", "-f", choices=FORMATS,
+                        help="The output format: 'csv' gives one row per "
+                             "station reached, 'ndjson' one JSON object per "
+                             "starting station and time, and 'npy' a matrix "
+                             "of durations (one row per starting station and "
+                             "time, one column per station) with sidecar "
+                             "'.stations.txt' and '.origins.csv' files "
+                             "naming the columns and rows. Durations are "
+                             "given in whole seconds (-1 in 'npy' output for "
+                             "unreachable stations). (Default: inferred from "
+                             "the output filename extension, otherwise csv)")
+    
+    parser.add_argument("--checkpoint", metavar="FILENAME",
+                        help="Record each result in the named checkpoint "
+                             "file as soon as it is computed. If the file "
+                             "already exists (e.g. after an interrupted run), "
+                             "results already recorded in it are reused "
+                             "rather than recomputed. The checkpoint must "
+                             "have been created from the same timetable and "
+                             "options.")
+    parser.add_argument("--schedule-cache", metavar="DIRECTORY",
+                        help="Cache the loaded timetable in the named "
+                             "directory, greatly speeding up subsequent runs "
+                             "using the same TTIS files and options.")
+    
+    parser.add_argument("--stats", action="store_true",
+                        help="Print route planner statistics for each query "
+                             "to stderr as JSON.")
+    parser.add_argument("--trace", metavar="FILENAME",
+                        help="Write a sampled trace of each route planner "
+                             "search to the named file as newline-delimited "
+                             "JSON.")
+    parser.add_argument("--trace-every", type=int, default=100, metavar="N",
+                        help="When --trace is given, record every N-th step "
+                             "of the search. (Default: %(default)s)")
+    
     parser.add_argument("--verbose", "-v", action="store_true",
                         help="Show verbose status during processing.")
     
@@ -41,42 +131,272 @@ def main():
     if args.verbose:
         logging.basicConfig(level=logging.DEBUG)
     
+    if args.engine == "scan" and (args.stats or args.trace):
+        parser.error("--stats and --trace are not supported by the 'scan' "
+                     "engine")
+    
+    if args.format is None:
+        ext = os.path.splitext(args.output or "")[1].lstrip(".").lower()
+        args.format = ext if ext in FORMATS else "csv"
+    if args.format == "npy" and args.output is None:
+        parser.error("--output must be given for 'npy' output")
+    
     if not args.datetime:
         now = datetime.datetime.now()
         args.datetime.append([now.year, now.month, now.day, now.hour, now.minute])
     
+    if args.horizon_days is not None:
+        dates = [datetime.date(year, month, day)
+                 for year, month, day, _hour, _minute in args.datetime]
+        horizon = (min(dates),
+                   max(dates) + datetime.timedelta(days=args.horizon_days))
+    else:
+        horizon = None
+    
     base, ext = os.path.splitext(args.ttis_files)
     
     # Load schedule
-    schedule = load_schedule("{}.mca".format(base),
-                             "{}.msn".format(base),
-                             "{}.flf".format(base))
-    
-    
-    # Output journey times
-    print("start_station,start_time,station,duration")
-    for three_alpha_code in args.three_alpha_code:
-        for year, month, day, hour, minute in args.datetime:
-            # Get TIPLOC code
-            tiploc_code = None
-            for tiploc in schedule.tiplocs.values():
-                if tiploc.three_alpha_code == three_alpha_code:
-                    tiploc_code = tiploc.code
-                    break
+    ttis_filenames = ("{}.mca".format(base),
+                      "{}.msn".format(base),
+                      "{}.flf".format(base))
+    load_options = dict(
+        train_statuses=(None if args.all_services
+                        else PASSENGER_TRAIN_STATUSES),
+        train_categories=(None if args.all_services
+                          else PASSENGER_TRAIN_CATEGORIES),
+        horizon=horizon)
+    if args.schedule_cache:
+        schedule = load_schedule_cached(args.schedule_cache,
+                                        *ttis_filenames, **load_options)
+    else:
+        schedule = load_schedule(*ttis_filenames, **load_options)
+    
+    if args.delays:
+        schedule.set_overlay(load_delays(schedule, args.delays))
+    
+    station_index = StationIndex(schedule)
+    
+    if args.checkpoint:
+        try:
+            checkpoint = Checkpoint(args.checkpoint, _checkpoint_key(
+                schedule_key(*ttis_filenames, **load_options),
+                args, station_index.station_codes))
+        except CheckpointMismatchError as e:
+            parser.error(str(e))
+    else:
+        checkpoint = None
+    
+    # Build the list of work units, in output order
+    starts = [datetime.datetime(year, month, day, hour, minute)
+              for year, month, day, hour, minute in args.datetime]
+    if args.engine == "scan":
+        scan = MultiOriginScan(schedule, args.scan_days, args.batch_size)
+        units = [("scan", args.three_alpha_code[i:i + args.batch_size], start)
+                 for start in starts
+                 for i in range(0, len(args.three_alpha_code),
+                                args.batch_size)]
+        
+        # Prepare the connections for every start date up-front so that
+        # worker processes inherit them rather than each building their own.
+        for start in starts:
+            scan.connections(start.date())
+    else:
+        scan = None
+        units = [("search", three_alpha_code, start,
+                  args.stats or bool(args.trace),
+                  args.trace_every if args.trace else 0)
+                 for three_alpha_code in args.three_alpha_code
+                 for start in starts]
+    
+    global _worker_schedule, _worker_scan, _worker_station_index
+    _worker_schedule = schedule
+    _worker_scan = scan
+    _worker_station_index = station_index
+    
+    # Skip work already recorded in the checkpoint
+    if checkpoint is not None:
+        pending_units = [_remaining_unit(unit, checkpoint) for unit in units]
+    else:
+        pending_units = units
+    to_run = [unit for unit in pending_units if unit is not None]
+    
+    if args.jobs == 1:
+        pool = None
+        results = map(_run_unit, to_run)
+    else:
+        pool = multiprocessing.get_context("fork").Pool(args.jobs or None)
+        results = pool.imap(_run_unit, to_run)
+    
+    # Output journey times (as they arrive)
+    writer = open_writer(args.format, args.output, station_index.station_codes)
+    trace_file = open(args.trace, "w") if args.trace else None
+    try:
+        for unit, pending_unit in zip(units, pending_units):
+            if pending_unit is not None:
+                unit_results, planner_stats = next(results)
+            else:
+                unit_results, planner_stats = [], None
+            
+            # Record new results in the checkpoint
+            new_durations = {}
+            for three_alpha_code, start, durations in unit_results:
+                new_durations[(three_alpha_code, start)] = durations
+                if checkpoint is not None:
+                    checkpoint.add(three_alpha_code, start, durations)
             
-            # Generate routes
-            start = datetime.datetime(year, month, day, hour, minute)
-            schedule.plan_route(tiploc_code, None, start)
-            for tiploc in schedule.tiplocs.values():
-                if tiploc.visited and tiploc.three_alpha_code:
-                    print("{},{},{},{}".format(three_alpha_code,
-                                               start,
-                                               tiploc.three_alpha_code,
-                                               (tiploc.visited - start).total_seconds()))
+            for three_alpha_code, start in _unit_origins(unit):
+                durations = new_durations.get((three_alpha_code, start))
+                if durations is None:
+                    durations = checkpoint.get(three_alpha_code, start)
+                writer.write(three_alpha_code, start, durations)
+            
+            if planner_stats is not None:
+                _kind, three_alpha_code, start = unit[:3]
+                if args.stats:
+                    sys.stderr.write(json.dumps(dict(
+                        start_station=three_alpha_code,
+                        start_time=str(start),
+                        **planner_stats.as_dict())) + "\n")
+                if trace_file:
+                    planner_stats.dump_trace(trace_file,
+                                             start_station=three_alpha_code,
+                                             start_time=str(start))
+    finally:
+        writer.close()
+        if checkpoint is not None:
+            checkpoint.close()
+        if pool is not None:
+            pool.terminate()
+        if trace_file:
+            trace_file.close()
     
     return 0
 
 
+def _checkpoint_key(schedule_key, args, station_codes):
+    """Internal use. The key identifying the schedule and options results in
+    a checkpoint were computed with."""
+    digest = hashlib.sha1()
+    digest.update(json.dumps([
+        schedule_key,
+        args.engine,
+        args.scan_days if args.engine == "scan" else None,
+        hash_files([args.delays]) if args.delays else None,
+        list(station_codes),
+    ]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _unit_origins(unit):
+    """Internal use. List the (three_alpha_code, start) pairs a unit of work
+    computes results for, in output order."""
+    if unit[0] == "scan":
+        _kind, three_alpha_codes, start = unit
+        return [(three_alpha_code, start)
+                for three_alpha_code in three_alpha_codes]
+    else:
+        _kind, three_alpha_code, start = unit[:3]
+        return [(three_alpha_code, start)]
+
+
+def _remaining_unit(unit, checkpoint):
+    """Internal use. Reduce a unit of work to just the results not already in
+    a checkpoint, returning None if no work remains."""
+    remaining = [(three_alpha_code, start)
+                 for three_alpha_code, start in _unit_origins(unit)
+                 if (three_alpha_code, start) not in checkpoint]
+    if not remaining:
+        return None
+    elif unit[0] == "scan":
+        _kind, _three_alpha_codes, start = unit
+        return ("scan", [three_alpha_code
+                         for three_alpha_code, _start in remaining], start)
+    else:
+        return unit
+
+
+# The schedule, MultiOriginScan and StationIndex used by _run_unit. Set
+# before worker processes are forked so that they are inherited
+# (copy-on-write) rather than reloaded by each worker.
+_worker_schedule = None
+_worker_scan = None
+_worker_station_index = None
+
+
+def _run_unit(unit):
+    """Internal use. Compute the journey times for a unit of work.
+    
+    Parameters
+    ----------
+    unit : ("search", three_alpha_code, start, stats, trace_every) or \
+           ("scan", [three_alpha_code, ...], start)
+    
+    Returns
+    -------
+    ([(three_alpha_code, start, durations), ...], \
+     :py:class:`railmap.route_planner.PlannerStats` or None)
+        The durations (seconds) to each station in the
+        :py:class:`railmap.output.StationIndex` for each starting station.
+    """
+    if unit[0] == "scan":
+        _kind, three_alpha_codes, start = unit
+        all_durations = scan_station_times(_worker_scan,
+                                           _worker_station_index,
+                                           three_alpha_codes, start)
+        return ([(three_alpha_code, start, durations)
+                 for three_alpha_code, durations
+                 in zip(three_alpha_codes, all_durations)],
+                None)
+    else:
+        _kind, three_alpha_code, start, stats, trace_every = unit
+        durations, planner_stats = search_station_times(
+            _worker_schedule, _worker_station_index, three_alpha_code, start,
+            stats, trace_every)
+        return ([(three_alpha_code, start, durations)], planner_stats)
+
+
+def search_station_times(schedule, station_index, three_alpha_code, start,
+                         stats=False, trace_every=0):
+    """Find the journey times from a station using a route planner search.
+    
+    Returns
+    -------
+    (durations, :py:class:`railmap.route_planner.PlannerStats` or None)
+        The journey duration (seconds) to each station in the
+        :py:class:`railmap.output.StationIndex` (or
+        :py:data:`railmap.multi_origin.UNREACHABLE`) and, if stats is True,
+        the route planner statistics (with a trace if trace_every is
+        non-zero).
+    """
+    tiploc_code = schedule.find_tiploc_code(three_alpha_code)
+    
+    planner_stats = PlannerStats(trace_every) if stats else None
+    schedule.plan_route(tiploc_code, None, start, planner_stats)
+    
+    tiploc_durations = [
+        int((tiploc.visited - start).total_seconds())
+        if tiploc.visited else UNREACHABLE
+        for tiploc in schedule.tiploc_list]
+    return (station_index.station_durations(tiploc_durations), planner_stats)
+
+
+def scan_station_times(scan, station_index, three_alpha_codes, start):
+    """Find the journey times from a batch of stations using a
+    :py:class:`railmap.multi_origin.MultiOriginScan`.
+    
+    Returns
+    -------
+    [durations, ...]
+        For each starting station, the journey duration (seconds) to each
+        station in the :py:class:`railmap.output.StationIndex` (or
+        :py:data:`railmap.multi_origin.UNREACHABLE`).
+    """
+    schedule = scan.schedule
+    tiploc_codes = [schedule.find_tiploc_code(three_alpha_code)
+                    for three_alpha_code in three_alpha_codes]
+    return [station_index.station_durations(durations)
+            for durations in scan.scan(tiploc_codes, start)]
+
+
 if __name__ == "__main__":
-    import sys
     sys.exit(main())
@@ -0,0 +1,572 @@
+"""A long-running query server which keeps a :py:class:`.Schedule` in memory
+and answers route planning queries over HTTP.
+
+Requests are plain HTTP GETs (served via TCP or a Unix domain socket) and all
+responses are JSON. The following endpoints are provided:
+
+``/route?from=MAN&to=EUS&datetime=2016-08-15T09:00``
+    Plan a route between two stations.
+``/one_to_all?from=MAN&datetime=2016-08-15T09:00``
+    Journey durations (seconds) from one station to all others.
+``/isochrone?from=MAN&datetime=2016-08-15T09:00&minutes=30,60,90``
+    The stations reachable within each of the given journey durations.
+``/stats``
+    Request counts and latency percentiles for each endpoint along with query
+    cache statistics.
+
+Stations may be given either as three-alpha codes or as TIPLOC codes. If no
+datetime is given, the current time is used. Adding ``stats=1`` to a query
+includes the route planner's :py:class:`.PlannerStats` in the response.
+
+Since the route planner is CPU bound (and mutates the schedule while
+searching) queries are dispatched to a pool of worker processes, each of which
+inherits a copy of the schedule when forked.
+"""
+
+import json
+import asyncio
+import logging
+import datetime
+import multiprocessing
+
+from time import monotonic
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from urllib.parse import urlsplit, parse_qs
+
+from railmap.route_planner import PlannerStats
+
+logger = logging.getLogger(__name__)
+
+
+DATETIME_FORMAT = "%Y-%m-%dT%H:%M"
+"""The format used for datetimes in query parameters and responses."""
+
+
+class QueryError(Exception):
+    """Raised when a query is malformed or refers to an unknown station."""
+    
+    def __init__(self, message, status=400):
+        super(QueryError, self).__init__(message)
+        self.status = status
+
+
+def _resolve_tiploc_code(schedule, station):
+    """Internal use. Turn a TIPLOC or three-alpha code into a TIPLOC code."""
+    if station in schedule.tiplocs:
+        return station
+    
+    tiploc_code = schedule.find_tiploc_code(station)
+    if tiploc_code is None:
+        raise QueryError("Unknown station: {}".format(station), 404)
+    return tiploc_code
+
+
+def _format_time(time):
+    """Internal use. Format a datetime.time (or None) for a JSON response."""
+    return time.strftime("%H:%M:%S") if time is not None else None
+
+
+def route_query(schedule, origin, destination, start_time, stats=False):
+    """Plan a route between two stations.
+    
+    If stats is True, the response's 'planner_stats' field contains the route
+    planner's statistics (see :py:class:`.PlannerStats`).
+    
+    Returns
+    -------
+    dict
+        A JSON-serialisable description of the journey. The 'arrival_time',
+        'duration' (seconds) and 'legs' fields are None if no route was
+        found.
+    """
+    start_tiploc_code = _resolve_tiploc_code(schedule, origin)
+    end_tiploc_code = _resolve_tiploc_code(schedule, destination)
+    
+    planner_stats = PlannerStats() if stats else None
+    route = schedule.plan_route(start_tiploc_code, end_tiploc_code, start_time,
+                                planner_stats)
+    
+    response = {
+        "origin": origin,
+        "destination": destination,
+        "start_time": start_time.strftime(DATETIME_FORMAT),
+        "arrival_time": None,
+        "duration": None,
+        "legs": None,
+    }
+    if route is not None:
+        end_time, segments = route
+        response["arrival_time"] = end_time.strftime(DATETIME_FORMAT)
+        response["duration"] = int((end_time - start_time).total_seconds())
+        response["legs"] = [
+            {
+                "tiploc": segment.tiploc.code,
+                "station": segment.tiploc.three_alpha_code,
+                "arrival": _format_time(getattr(segment, "arrival", None)),
+                "departure": _format_time(getattr(segment, "departure", None)),
+            }
+            for segment in segments
+        ]
+    if planner_stats is not None:
+        response["planner_stats"] = planner_stats.as_dict()
+    return response
+
+
+def one_to_all_query(schedule, origin, start_time, stats=False):
+    """Find the journey duration from one station to all others.
+    
+    If stats is True, the response's 'planner_stats' field contains the route
+    planner's statistics (see :py:class:`.PlannerStats`).
+    
+    Returns
+    -------
+    dict
+        A JSON-serialisable dict whose 'durations' field maps station
+        three-alpha codes to the shortest journey duration (seconds) to any
+        TIPLOC of that station. Unreachable stations are omitted.
+    """
+    start_tiploc_code = _resolve_tiploc_code(schedule, origin)
+    
+    planner_stats = PlannerStats() if stats else None
+    schedule.plan_route(start_tiploc_code, None, start_time, planner_stats)
+    
+    durations = {}
+    for tiploc in schedule.tiplocs.values():
+        if tiploc.visited and tiploc.three_alpha_code:
+            duration = int((tiploc.visited - start_time).total_seconds())
+            name = tiploc.three_alpha_code
+            durations[name] = min(durations.get(name, duration), duration)
+    
+    response = {
+        "origin": origin,
+        "start_time": start_time.strftime(DATETIME_FORMAT),
+        "durations": durations,
+    }
+    if planner_stats is not None:
+        response["planner_stats"] = planner_stats.as_dict()
+    return response
+
+
+def isochrone_query(schedule, origin, start_time, minutes, stats=False):
+    """Find the stations reachable within each of a set of journey durations.
+    
+    Parameters
+    ----------
+    minutes : [int, ...]
+        The journey durations (minutes) to produce isochrones for.
+    
+    Returns
+    -------
+    dict
+        A JSON-serialisable dict whose 'isochrones' field is a list of
+        ``{"minutes": int, "stations": [three_alpha_code, ...]}`` in order of
+        increasing duration.
+    """
+    return isochrones_from_one_to_all(
+        one_to_all_query(schedule, origin, start_time, stats), minutes)
+
+
+def isochrones_from_one_to_all(one_to_all, minutes):
+    """Produce an isochrone query response from a one-to-all query response.
+    See :py:func:`.isochrone_query`."""
+    durations = one_to_all["durations"]
+    
+    response = {
+        "origin": one_to_all["origin"],
+        "start_time": one_to_all["start_time"],
+        "isochrones": [
+            {
+                "minutes": limit,
+                "stations": sorted(name for name, duration in durations.items()
+                                   if duration <= limit * 60),
+            }
+            for limit in sorted(minutes)
+        ],
+    }
+    if "planner_stats" in one_to_all:
+        response["planner_stats"] = one_to_all["planner_stats"]
+    return response
+
+
+QUERIES = {
+    "route": route_query,
+    "one_to_all": one_to_all_query,
+    "isochrone": isochrone_query,
+}
+"""The query functions exposed by the server, by endpoint name."""
+
+
+QUERY_PARAMS = {
+    "route": ["to"],
+    "one_to_all": [],
+    "isochrone": ["minutes"],
+}
+"""The query parameters required by each endpoint (in addition to 'from').
+These parameters are not accepted by any other endpoint."""
+
+
+# The schedule used by worker processes. Set before the worker pool is created
+# such that (forked) workers inherit it rather than having it pickled.
+_worker_schedule = None
+
+
+def _run_query(name, kwargs):
+    """Internal use. Run a query against the worker's schedule."""
+    try:
+        return (200, QUERIES[name](_worker_schedule, **kwargs))
+    except QueryError as e:
+        return (e.status, {"error": str(e)})
+
+
+def _worker_ready():
+    """Internal use. A no-op used to force the worker pool to start."""
+    return True
+
+
+class LatencyRecorder(object):
+    """Records request latencies and reports their percentiles.
+    
+    Only the most recent latencies are retained for computing percentiles
+    while the total count covers every request.
+    """
+    
+    def __init__(self, window=10000):
+        """
+        Parameters
+        ----------
+        window : int
+            The number of most recent latencies to compute percentiles from.
+        """
+        self.window = window
+        self.latencies = {}
+        self.counts = {}
+    
+    def record(self, endpoint, seconds):
+        """Record the latency of a request to the named endpoint."""
+        if endpoint not in self.latencies:
+            self.latencies[endpoint] = deque(maxlen=self.window)
+            self.counts[endpoint] = 0
+        self.latencies[endpoint].append(seconds)
+        self.counts[endpoint] += 1
+    
+    def summary(self, percentiles=(50, 90, 99)):
+        """Produce a JSON-serialisable summary of the latencies (in
+        milliseconds) of each endpoint."""
+        summary = OrderedDict()
+        for endpoint in sorted(self.latencies):
+            latencies = sorted(self.latencies[endpoint])
+            entry = OrderedDict([("count", self.counts[endpoint])])
+            for percentile in percentiles:
+                # Nearest-rank percentile
+                rank = max(0, -(-len(latencies) * percentile // 100) - 1)
+                entry["p{}_ms".format(percentile)] = \
+                    round(latencies[rank] * 1000.0, 3)
+            entry["max_ms"] = round(latencies[-1] * 1000.0, 3)
+            summary[endpoint] = entry
+        return summary
+
+
+def _parse_query_params(endpoint, query_string):
+    """Internal use. Parse a URL query string into the keyword arguments of
+    the query function for the named endpoint."""
+    params = {k: v[-1] for k, v in parse_qs(query_string).items()}
+    kwargs = {}
+    
+    if "from" not in params:
+        raise QueryError("Missing 'from' parameter.")
+    
+    required = QUERY_PARAMS[endpoint]
+    for param in required:
+        if param not in params:
+            raise QueryError("Missing '{}' parameter.".format(param))
+    for endpoint_params in QUERY_PARAMS.values():
+        for param in endpoint_params:
+            if param in params and param not in required:
+                raise QueryError(
+                    "The '{}' parameter is not accepted by /{}.".format(
+                        param, endpoint))
+    
+    kwargs["origin"] = params["from"].upper()
+    
+    if "to" in params:
+        kwargs["destination"] = params["to"].upper()
+    
+    if "datetime" in params:
+        try:
+            kwargs["start_time"] = datetime.datetime.strptime(
+                params["datetime"], DATETIME_FORMAT)
+        except ValueError:
+            raise QueryError("Datetime must be in the form YYYY-MM-DDTHH:MM.")
+    else:
+        kwargs["start_time"] = datetime.datetime.now().replace(second=0,
+                                                               microsecond=0)
+    
+    if "stats" in params:
+        kwargs["stats"] = params["stats"].lower() in ("1", "true", "yes")
+    
+    if "minutes" in params:
+        try:
+            kwargs["minutes"] = [int(m) for m in params["minutes"].split(",")]
+        except ValueError:
+            raise QueryError("Minutes must be a comma separated list.")
+    
+    return kwargs
+
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+
+class QueryServer(object):
+    """An asyncio HTTP server answering queries against a schedule."""
+    
+    def __init__(self, schedule, workers=None, cache=None, stats=False):
+        """Create a query server.
+        
+        Parameters
+        ----------
+        schedule : :py:class:`railmap.route_planner.Schedule`
+            The schedule to answer queries with.
+        workers : int or None
+            The number of worker processes to run queries in. If None, one per
+            CPU is used. If 0, queries are run (one at a time) in a background
+            thread of this process instead.
+        cache : :py:class:`railmap.query_cache.QueryCache` or None
+            If given, a cache of query results to consult before running
+            queries. Note that cached queries are answered as if they were
+            made at the start of the cache's departure-time bucket.
+        stats : bool
+            If True, include route planner statistics in responses unless the
+            query specifies otherwise. Results served from the cache have no
+            statistics.
+        """
+        self.workers = workers
+        self.stats = stats
+        self.latency = LatencyRecorder()
+        self.cache = cache
+        self.pool = None
+        
+        # The schedule generation the worker pool was started with
+        self.generation = None
+        
+        # Held while reloading in the background
+        self._reload_lock = asyncio.Lock()
+        
+        self.reload(schedule)
+    
+    def reload(self, schedule):
+        """Replace the schedule used to answer queries, restarting the worker
+        pool and invalidating any cached results.
+        
+        This blocks until the new workers have started. From within the event
+        loop, use :py:meth:`.reload_async` instead.
+        """
+        old_pool = self._switch_pool(schedule, *self._start_pool(schedule))
+        if old_pool is not None:
+            old_pool.shutdown()
+    
+    async def reload_async(self, schedule):
+        """Replace the schedule used to answer queries (as
+        :py:meth:`.reload`) without blocking the event loop.
+        
+        Queries continue to be answered by the existing workers until the new
+        workers have started. Results from workers using an out-of-date
+        schedule are not cached.
+        """
+        loop = asyncio.get_event_loop()
+        async with self._reload_lock:
+            pool, generation = await loop.run_in_executor(
+                None, self._start_pool, schedule)
+            old_pool = self._switch_pool(schedule, pool, generation)
+            await loop.run_in_executor(None, old_pool.shutdown)
+    
+    def _start_pool(self, schedule):
+        """Internal use. Start a new worker pool for a schedule.
+        
+        Returns
+        -------
+        (pool, generation)
+            The pool and the schedule generation its workers started with.
+        """
+        global _worker_schedule
+        
+        _worker_schedule = schedule
+        generation = schedule.generation
+        if self.workers == 0:
+            # NB: Only a single thread may use the schedule at once since the
+            # route planner modifies it as it goes.
+            pool = ThreadPoolExecutor(max_workers=1)
+        else:
+            pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("fork"))
+        
+        # Start the workers now (while the schedule is freshly loaded) rather
+        # than on the first request.
+        pool.submit(_worker_ready).result()
+        
+        return (pool, generation)
+    
+    def _switch_pool(self, schedule, pool, generation):
+        """Internal use. Start answering queries using a new worker pool,
+        invalidating any cached results. Returns the old pool (or None)."""
+        old_pool = self.pool
+        self.pool = pool
+        self.generation = generation
+        self.schedule = schedule
+        if self.cache is not None:
+            self.cache.bind(schedule)
+        return old_pool
+    
+    def close(self):
+        """Shut down the worker pool."""
+        self.pool.shutdown()
+    
+    async def _run_query(self, name, kwargs):
+        """Internal use. Run a query in the worker pool."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.pool, _run_query, name, kwargs)
+    
+    async def _cached_query(self, endpoint, kwargs):
+        """Internal use. Answer a query, consulting the cache first."""
+        minutes = kwargs.pop("minutes", None)
+        
+        # Isochrones are derived from one-to-all results and so share their
+        # cache entries.
+        name = "one_to_all" if endpoint == "isochrone" else endpoint
+        options = {}
+        if name == "route":
+            options["destination"] = kwargs.get("destination")
+        key, kwargs["start_time"] = self.cache.key(
+            name, kwargs["origin"], kwargs["start_time"], **options)
+        
+        cached = self.cache.get(key)
+        if cached is not None:
+            status = 200
+            if name == "one_to_all":
+                response = {
+                    "origin": kwargs["origin"],
+                    "start_time": kwargs["start_time"].strftime(DATETIME_FORMAT),
+                    "durations": cached.to_dict(),
+                }
+            else:
+                response = dict(cached)
+        else:
+            source = (self.schedule, self.generation)
+            status, response = await self._run_query(name, kwargs)
+            
+            # Don't cache results from workers whose schedule is out of date
+            # (e.g. if the delays were reloaded, or a different schedule
+            # loaded, while the query ran)
+            schedule, generation = source
+            if (status == 200 and schedule is self.schedule and
+                    generation == schedule.generation):
+                if name == "one_to_all":
+                    self.cache.put(key, self.cache.one_to_all_result(
+                        response["durations"]), source=source)
+                else:
+                    response_without_stats = {
+                        k: v for k, v in response.items()
+                        if k != "planner_stats"}
+                    self.cache.put(key, response_without_stats,
+                                   len(json.dumps(response_without_stats)),
+                                   source=source)
+        
+        if status == 200 and endpoint == "isochrone":
+            response = isochrones_from_one_to_all(response, minutes)
+        
+        return (status, response)
+    
+    async def query(self, path, query_string):
+        """Answer a query.
+        
+        Returns
+        -------
+        (status, response)
+            The HTTP status code and a JSON-serialisable response.
+        """
+        endpoint = path.strip("/")
+        
+        if endpoint == "stats":
+            return (200, OrderedDict([
+                ("latency", self.latency.summary()),
+                ("cache", self.cache.stats() if self.cache else None),
+            ]))
+        elif endpoint not in QUERIES:
+            return (404, {"error": "Unknown endpoint: {}".format(path)})
+        
+        try:
+            kwargs = _parse_query_params(endpoint, query_string)
+        except QueryError as e:
+            return (e.status, {"error": str(e)})
+        kwargs.setdefault("stats", self.stats)
+        
+        if self.cache is not None:
+            return await self._cached_query(endpoint, kwargs)
+        else:
+            return await self._run_query(endpoint, kwargs)
+    
+    async def handle_connection(self, reader, writer):
+        """Handle a single HTTP request on a connection."""
+        before = monotonic()
+        endpoint = None
+        try:
+            request_line = (await reader.readline()).decode("latin-1")
+            
+            # Skip the headers
+            while (await reader.readline()).strip():
+                pass
+            
+            try:
+                method, target, _version = request_line.split()
+            except ValueError:
+                status, response = (400, {"error": "Malformed request."})
+            else:
+                url = urlsplit(target)
+                endpoint = url.path.strip("/")
+                if method != "GET":
+                    status, response = (405, {"error": "Only GET supported."})
+                else:
+                    try:
+                        status, response = await self.query(url.path,
+                                                            url.query)
+                    except Exception:
+                        logger.exception("Query failed: %s", target)
+                        status, response = (500, {"error": "Query failed."})
+            
+            body = json.dumps(response).encode("utf-8")
+            writer.write("HTTP/1.1 {} {}\r\n"
+                         "Content-Type: application/json\r\n"
+                         "Content-Length: {}\r\n"
+                         "Connection: close\r\n"
+                         "\r\n".format(status,
+                                       HTTP_REASONS.get(status, ""),
+                                       len(body)).encode("latin-1"))
+            writer.write(body)
+            await writer.drain()
+        finally:
+            writer.close()
+            if endpoint in QUERIES:
+                self.latency.record(endpoint, monotonic() - before)
+    
+    async def start(self, host="localhost", port=8000, unix_path=None):
+        """Start listening for connections, either on the specified TCP
+        host/port or, if unix_path is given, a Unix domain socket.
+        
+        Returns
+        -------
+        :py:class:`asyncio.AbstractServer`
+        """
+        if unix_path is not None:
+            return await asyncio.start_unix_server(self.handle_connection,
+                                                   unix_path)
+        else:
+            return await asyncio.start_server(self.handle_connection,
+                                              host, port)
@@ -0,0 +1,267 @@
+"""Level-of-detail simplification of line geometry.
+
+The coastline and railway line shapefiles contain far more detail than can be
+seen in all but the most zoomed-in maps. Lines are simplified using the
+Douglas-Peucker algorithm with a tolerance (in map units) chosen such that
+the removed detail is smaller than the output device can show.
+
+Since simplifying a large shapefile is itself fairly slow, tolerances are
+rounded down to a power-of-two 'level' and simplified geometry may be cached
+on disk (see :py:class:`.SimplifiedShapes`) so that maps drawn at similar
+scales share the same simplified geometry.
+"""
+
+import logging
+
+from math import floor, log
+
+import numpy as np
+
+from railmap.cache import load_cached, load_cached_arrays, hash_files
+from railmap.railnetwork import LineGeometry, read_shp
+from railmap.spatial import LineIndex
+
+logger = logging.getLogger(__name__)
+
+
+_MIN_VECTORISED_SPAN = 64
+"""Spans of fewer points than this are searched without NumPy, which has too
+much per-call overhead for short spans to benefit."""
+
+
+def _simplify_mask(coords, tolerance):
+    """Internal use. Apply the Douglas-Peucker algorithm to a (num_points, 2)
+    array, returning a boolean array which is True for points to keep."""
+    num_points = len(coords)
+    if num_points < 3 or tolerance <= 0:
+        return np.ones(num_points, dtype=bool)
+    
+    tolerance_2 = tolerance * tolerance
+    keep = np.zeros(num_points, dtype=bool)
+    keep[0] = keep[-1] = True
+    points = coords.tolist()
+    
+    # NB: An explicit stack is used since recursion would exceed Python's
+    # recursion limit for long lines which barely simplify.
+    spans = [(0, num_points - 1)]
+    while spans:
+        first, last = spans.pop()
+        if last - first < 2:
+            continue
+        
+        # Find the point furthest from the segment between first and last
+        # (NB: The segment may be a single point, e.g. for closed rings)
+        if last - first >= _MIN_VECTORISED_SPAN:
+            start = coords[first]
+            direction = coords[last] - start
+            offsets = coords[first + 1:last] - start
+            length_2 = direction.dot(direction)
+            if length_2:
+                t = np.clip(offsets.dot(direction) / length_2, 0.0, 1.0)
+                offsets = offsets - t[:, None] * direction
+            distances_2 = np.einsum("ij,ij->i", offsets, offsets)
+            furthest = int(np.argmax(distances_2))
+            furthest_2 = distances_2[furthest]
+            furthest += first + 1
+        else:
+            x1, y1 = points[first]
+            x2, y2 = points[last]
+            dx = x2 - x1
+            dy = y2 - y1
+            length_2 = dx*dx + dy*dy
+            furthest = None
+            furthest_2 = -1.0
+            for i in range(first + 1, last):
+                x, y = points[i]
+                if length_2:
+                    t = ((x - x1)*dx + (y - y1)*dy) / length_2
+                    t = 0.0 if t < 0.0 else 1.0 if t > 1.0 else t
+                    ex = x1 + t*dx - x
+                    ey = y1 + t*dy - y
+                else:
+                    ex = x1 - x
+                    ey = y1 - y
+                distance_2 = ex*ex + ey*ey
+                if distance_2 > furthest_2:
+                    furthest = i
+                    furthest_2 = distance_2
+        
+        if furthest_2 > tolerance_2:
+            keep[furthest] = True
+            spans.append((first, furthest))
+            spans.append((furthest, last))
+    
+    return keep
+
+
+def simplify_line(points, tolerance):
+    """Simplify a line using the Douglas-Peucker algorithm.
+    
+    Parameters
+    ----------
+    points : [(x, y), ...]
+    tolerance : float
+        The maximum distance any removed point may be from the simplified
+        line. If zero (or less), the line is returned unchanged.
+    
+    Returns
+    -------
+    [(x, y), ...]
+        The subset of the input points retained. The first and last points
+        are always retained.
+    """
+    keep = _simplify_mask(np.asarray(points, dtype=np.float64).reshape(-1, 2),
+                          tolerance)
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def simplify_geometry(geometry, tolerance):
+    """Simplify every line in a
+    :py:class:`railmap.railnetwork.LineGeometry`. See
+    :py:func:`.simplify_line`."""
+    coords = geometry.coords
+    offsets = geometry.offsets.tolist()
+    keep = np.concatenate(
+        [_simplify_mask(coords[start:end], tolerance)
+         for start, end in zip(offsets, offsets[1:])] or
+        [np.zeros(0, dtype=bool)])
+    
+    new_offsets = np.zeros(len(geometry) + 1, dtype=np.int64)
+    if len(geometry):
+        np.cumsum(np.add.reduceat(keep, geometry.offsets[:-1]),
+                  out=new_offsets[1:])
+    return LineGeometry(coords[keep], new_offsets)
+
+
+def tolerance_level(tolerance):
+    """Round a tolerance down to the nearest power of two.
+    
+    Returns
+    -------
+    int or None
+        The level, n, of the tolerance 2**n or None if the tolerance is zero
+        or negative (i.e. no simplification).
+    """
+    if tolerance <= 0:
+        return None
+    return int(floor(log(tolerance, 2)))
+
+
+class SimplifiedShapes(object):
+    """The lines in a shapefile, simplified on demand to various tolerances.
+    
+    If a cache directory is given, the full-detail and simplified lines
+    (along with their bounds and spatial indices) are cached on disk, keyed
+    by the contents of the shapefile. Cached lines are memory-mapped rather
+    than read in full and, when everything required is cached, the shapefile
+    is never parsed.
+    """
+    
+    def __init__(self, filename, cache_dir=None):
+        """
+        Parameters
+        ----------
+        filename : str
+            The shapefile (*.shp) to read.
+        cache_dir : str or None
+            The directory to cache simplified geometry in. If None, nothing
+            is cached.
+        """
+        self.filename = filename
+        self.cache_dir = cache_dir
+        
+        self._key = hash_files([filename]) if cache_dir else None
+        self._geometry = None
+        self._bounds = None
+        
+        # {level: LineGeometry, ...}
+        self._simplified = {}
+        
+        # {level: LineIndex, ...}
+        self._indices = {}
+    
+    @property
+    def geometry(self):
+        """The full-detail lines (a
+        :py:class:`railmap.railnetwork.LineGeometry`)."""
+        if self._geometry is None:
+            self._geometry = self._cached_geometry(
+                "full", lambda: read_shp(self.filename))
+        return self._geometry
+    
+    def _cached(self, name, load):
+        """Internal use. Get a value from the on-disk cache (if enabled)."""
+        if self.cache_dir is None:
+            return load()
+        return load_cached(self.cache_dir,
+                           "geometry-{}-{}.pickle".format(self._key, name),
+                           load, "geometry")
+    
+    def _cached_geometry(self, name, load):
+        """Internal use. Get a LineGeometry from the on-disk cache (if
+        enabled), memory-mapping the cached arrays."""
+        if self.cache_dir is None:
+            return load()
+        
+        def load_arrays():
+            geometry = load()
+            return {"coords": geometry.coords, "offsets": geometry.offsets}
+        
+        return LineGeometry(**load_cached_arrays(
+            self.cache_dir, "geometry-{}-{}".format(self._key, name),
+            load_arrays, "geometry"))
+    
+    @property
+    def bounds(self):
+        """The bounds of the full-detail lines as a (min_x, min_y, max_x,
+        max_y) tuple (or None if there are no lines)."""
+        if self._bounds is None:
+            self._bounds = self._cached("bounds",
+                                        lambda: self.geometry.bounds)
+        return self._bounds
+    
+    def at_tolerance(self, tolerance):
+        """Get the lines simplified to (at least) the given tolerance as a
+        :py:class:`railmap.railnetwork.LineGeometry`.
+        
+        The tolerance is rounded down to a power of two (see
+        :py:func:`.tolerance_level`) so that similar tolerances share the same
+        simplified geometry.
+        """
+        level = tolerance_level(tolerance)
+        if level is None:
+            return self.geometry
+        
+        if level not in self._simplified:
+            def simplify():
+                geometry = self.geometry
+                simplified = simplify_geometry(geometry, 2.0 ** level)
+                logger.info(
+                    "Simplified %s to %d of %d points (tolerance %s)",
+                    self.filename, simplified.num_points,
+                    geometry.num_points, 2.0 ** level)
+                return simplified
+            self._simplified[level] = self._cached_geometry(
+                "level{}".format(level), simplify)
+        return self._simplified[level]
+    
+    def index(self, tolerance):
+        """Get a :py:class:`railmap.spatial.LineIndex` of the lines
+        simplified to (at least) the given tolerance (see
+        :py:meth:`.at_tolerance`).
+        """
+        level = tolerance_level(tolerance)
+        if level not in self._indices:
+            def build():
+                # NB: Cells are sized to make close-up views cheap to query
+                bounds = self.bounds
+                if bounds is None:
+                    cell_size = 1.0
+                else:
+                    min_x, min_y, max_x, max_y = bounds
+                    cell_size = max(max_x - min_x, max_y - min_y) / 64.0
+                return LineIndex(self.at_tolerance(tolerance),
+                                 cell_size or 1.0)
+            self._indices[level] = self._cached(
+                "index{}".format("" if level is None else level), build)
+        return self._indices[level]
@@ -0,0 +1,172 @@
+"""Spatial indices used when laying out and drawing maps.
+
+Label placement repeatedly asks whether a candidate rectangle overlaps any
+previously placed rectangle. Rather than comparing against every placed
+rectangle, a :py:class:`.GridIndex` buckets rectangles into a uniform grid of
+cells so that only rectangles in the cells a query covers need be compared.
+
+Similarly, when drawing part of a map (e.g. a single tile) a
+:py:class:`.LineIndex` finds the pieces of a set of lines which fall within
+the area being drawn.
+"""
+
+from math import floor
+from collections import defaultdict
+
+
+class GridIndex(object):
+    """A uniform-grid index of axis-aligned rectangles supporting insertion
+    and overlap queries.
+    
+    Rectangles are given as (x1, y1, x2, y2) tuples with the corners in any
+    order. Rectangles which merely touch are not considered to overlap. Each
+    rectangle may have an associated value which is returned by
+    :py:meth:`.query`.
+    """
+    
+    def __init__(self, cell_size):
+        """
+        Parameters
+        ----------
+        cell_size : float
+            The width and height of each grid cell. For best performance this
+            should be a small multiple of the typical rectangle size.
+        """
+        self.cell_size = float(cell_size)
+        
+        # {(cell_x, cell_y): [(x1, y1, x2, y2, value), ...], ...} with
+        # rectangles normalised such that x1 <= x2 and y1 <= y2.
+        self.cells = defaultdict(list)
+        self.count = 0
+    
+    def __len__(self):
+        return self.count
+    
+    def _cell_range(self, x1, y1, x2, y2):
+        """Internal use. Get the ranges of cell coordinates covered by a
+        (normalised) rectangle."""
+        cell_size = self.cell_size
+        return (range(int(floor(x1 / cell_size)),
+                      int(floor(x2 / cell_size)) + 1),
+                range(int(floor(y1 / cell_size)),
+                      int(floor(y2 / cell_size)) + 1))
+    
+    def add(self, x1, y1, x2, y2, value=None):
+        """Add a rectangle (and associated value) to the index."""
+        rect = (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2), value)
+        xs, ys = self._cell_range(*rect[:4])
+        cells = self.cells
+        for cell_x in xs:
+            for cell_y in ys:
+                cells[(cell_x, cell_y)].append(rect)
+        self.count += 1
+    
+    def overlaps(self, x1, y1, x2, y2):
+        """Test whether a rectangle overlaps any rectangle in the index."""
+        ax1, ay1, ax2, ay2 = (min(x1, x2), min(y1, y2),
+                              max(x1, x2), max(y1, y2))
+        xs, ys = self._cell_range(ax1, ay1, ax2, ay2)
+        cells = self.cells
+        for cell_x in xs:
+            for cell_y in ys:
+                for bx1, by1, bx2, by2, _ in cells.get((cell_x, cell_y), ()):
+                    if ax1 < bx2 and ax2 > bx1 and ay1 < by2 and ay2 > by1:
+                        return True
+        return False
+    
+    def query(self, x1, y1, x2, y2):
+        """Get the values of all rectangles which overlap a rectangle.
+        
+        Returns
+        -------
+        set
+        """
+        ax1, ay1, ax2, ay2 = (min(x1, x2), min(y1, y2),
+                              max(x1, x2), max(y1, y2))
+        xs, ys = self._cell_range(ax1, ay1, ax2, ay2)
+        cells = self.cells
+        values = set()
+        for cell_x in xs:
+            for cell_y in ys:
+                for bx1, by1, bx2, by2, value in cells.get((cell_x, cell_y),
+                                                           ()):
+                    if ax1 < bx2 and ax2 > bx1 and ay1 < by2 and ay2 > by1:
+                        values.add(value)
+        return values
+
+
+class ObstructionTester(object):
+    """Test if a given rectangle is obstructed by a set of existing rectangles.
+    
+    This object is used to avoid drawing (textual) labels on-top of previously
+    drawn labels. Each time a label is drawn, it should be add()-ed to this
+    object. Subsequent labels should be drawn iff the rectangle is not 'in'
+    this object.
+    """
+    
+    def __init__(self, cell_size=None):
+        """
+        Parameters
+        ----------
+        cell_size : float or None
+            The cell size of the underlying :py:class:`.GridIndex`. If None,
+            twice the larger dimension of the first rectangle added is used.
+        """
+        self.cell_size = cell_size
+        self.index = GridIndex(cell_size) if cell_size else None
+    
+    def __len__(self):
+        return len(self.index) if self.index is not None else 0
+    
+    def add(self, x1,y1, x2,y2):
+        """Add a rectangle to the structure."""
+        if self.index is None:
+            size = max(abs(x2 - x1), abs(y2 - y1))
+            self.index = GridIndex(2.0 * size or 1.0)
+        self.index.add(x1,y1, x2,y2)
+    
+    def __contains__(self, rect):
+        """Check if a given rectangle as a tuple (x1,y1, x2,y2) is obstructed
+        by any rectangle previously added. Returns True if so, False otherwise.
+        """
+        return self.index is not None and self.index.overlaps(*rect)
+
+
+class LineIndex(object):
+    """A spatial index of the segments of a set of lines.
+    
+    Lines are split into chunks of a few segments each and the bounding box
+    of each chunk indexed so that the parts of the lines within a given area
+    can be found without visiting every segment. When the chunks are stroked
+    with round caps and joins the result is indistinguishable from stroking
+    the original lines.
+    """
+    
+    def __init__(self, lines, cell_size, chunk_size=32):
+        """
+        Parameters
+        ----------
+        lines : :py:class:`railmap.railnetwork.LineGeometry`
+        cell_size : float
+            The cell size of the underlying :py:class:`.GridIndex`. Ideally
+            similar to the size of the areas which will be queried.
+        chunk_size : int
+            The maximum number of segments in each chunk.
+        """
+        self.chunks = lines.split(chunk_size)
+        self.index = GridIndex(cell_size)
+        for num, bounds in enumerate(self.chunks.line_bounds().tolist()):
+            self.index.add(*bounds, value=num)
+    
+    def __len__(self):
+        return len(self.chunks)
+    
+    def query(self, x1, y1, x2, y2):
+        """Get the chunks of line which overlap a rectangle (in the order
+        they appear in the original lines).
+        
+        Returns
+        -------
+        :py:class:`railmap.railnetwork.LineGeometry`
+        """
+        return self.chunks.subset(sorted(self.index.query(x1, y1, x2, y2)))
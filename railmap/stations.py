@@ -5,6 +5,10 @@ import dbf
 
 from collections import namedtuple
 
+import numpy as np
+
+from railmap.cache import load_cached_arrays, hash_files
+
 
 StationRecord = namedtuple("StationRecord", "name,station_code,eastings,northings")
 
@@ -30,3 +34,56 @@ def dbf_to_dict(filename):
         t.close()
     
     return stations
+
+
+def _stations_to_arrays(stations):
+    """Internal use. Convert the output of :py:func:`.dbf_to_dict` into a
+    dict of arrays. Missing locations are recorded in separate boolean arrays
+    so that the location arrays retain their original (integer or float)
+    type."""
+    stations = list(stations.values())
+    arrays = {
+        "name": np.array([s.name for s in stations], dtype=str),
+        "station_code": np.array([s.station_code for s in stations],
+                                 dtype=str),
+    }
+    for field in ("eastings", "northings"):
+        values = [getattr(s, field) for s in stations]
+        arrays[field] = np.array([0 if v is None else v for v in values])
+        arrays[field + "_missing"] = np.array([v is None for v in values],
+                                              dtype=bool)
+    return arrays
+
+
+def _arrays_to_stations(arrays):
+    """Internal use. The inverse of :py:func:`._stations_to_arrays`."""
+    def locations(field):
+        return [None if missing else value
+                for value, missing in zip(arrays[field].tolist(),
+                                          arrays[field + "_missing"].tolist())]
+    
+    return {
+        station_code: StationRecord(name, station_code, eastings, northings)
+        for name, station_code, eastings, northings in zip(
+            arrays["name"].tolist(),
+            arrays["station_code"].tolist(),
+            locations("eastings"),
+            locations("northings"))
+    }
+
+
+def load_stations(filename, cache_dir=None):
+    """Read a DBF file of station information as :py:func:`.dbf_to_dict`
+    does.
+    
+    If a cache directory is given, the station table is kept there in a
+    compact binary form (keyed by the contents of the DBF file) which is
+    memory-mapped on later runs rather than re-reading the DBF file.
+    """
+    if cache_dir is None:
+        return dbf_to_dict(filename)
+    
+    return _arrays_to_stations(load_cached_arrays(
+        cache_dir, "stations-{}".format(hash_files([filename])),
+        lambda: _stations_to_arrays(dbf_to_dict(filename)),
+        "station table"))
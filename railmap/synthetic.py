@@ -0,0 +1,352 @@
+"""Generators of synthetic (but plausibly shaped) timetables.
+
+These are used to benchmark the route planner without needing a (large, and
+changing) real timetable. All generators are deterministic for a given seed.
+
+Three network shapes are provided:
+
+* :py:func:`.grid_network`: A square grid of stations with lines along every
+  row and column.
+* :py:func:`.hub_and_spoke_network`: Lines radiating out from a single central
+  hub.
+* :py:func:`.uk_like_network`: Stations scattered at random with a handful of
+  fast, infrequent inter-city lines between major stations and many slower,
+  frequent, local lines.
+"""
+
+import math
+import random
+import datetime
+
+from railmap.route_planner import \
+    Schedule, Validity, TransferSegment
+from railmap.timetable import PICK_UP, SET_DOWN
+
+
+EVERY_DAY = 0b1111111
+"""A Validity days_run value for services running every day of the week."""
+
+DEFAULT_VALIDITY = Validity(datetime.date(2016, 1, 1),
+                            datetime.date(2016, 12, 31),
+                            EVERY_DAY)
+"""The validity used for generated services unless otherwise specified."""
+
+
+def _station_code(n):
+    """Internal use. Generate a unique three-alpha-code-like code."""
+    return "".join(chr(ord("A") + ((n // (26 ** i)) % 26))
+                   for i in reversed(range(3)))
+
+
+def add_station(schedule, n, change_time=5):
+    """Add a single-TIPLOC station to a schedule.
+    
+    Parameters
+    ----------
+    schedule : :py:class:`railmap.route_planner.Schedule`
+    n : int
+        A unique station number (less than 26**3).
+    change_time : int
+        The station's change time (minutes).
+    
+    Returns
+    -------
+    :py:class:`railmap.route_planner.TIPLOC`
+    """
+    tiploc = schedule.get_tiploc("S{:06d}".format(n))
+    tiploc.three_alpha_code = _station_code(n)
+    tiploc.change_time = change_time
+    return tiploc
+
+
+def add_line(schedule, tiplocs, run_times, first, last, headway,
+             dwell=1, validity=DEFAULT_VALIDITY, both_directions=True,
+             train_uid_prefix="L"):
+    """Add a regular-interval service along a line of stations.
+    
+    Parameters
+    ----------
+    schedule : :py:class:`railmap.route_planner.Schedule`
+    tiplocs : [:py:class:`railmap.route_planner.TIPLOC`, ...]
+        The stations called at, in order.
+    run_times : [int, ...]
+        The running time (minutes) between each consecutive pair of
+        stations.
+    first, last : int
+        The departure times (minutes past midnight) of the first and last
+        trains from the first station.
+    headway : int
+        The interval (minutes) between trains.
+    dwell : int
+        Time (minutes) trains wait at intermediate stations.
+    validity : :py:class:`railmap.route_planner.Validity`
+    both_directions : bool
+        If True, an equivalent service is added in the reverse direction.
+    train_uid_prefix : str
+    
+    Returns
+    -------
+    int
+        The number of trips added.
+    """
+    timetable = schedule.timetable
+    directions = [(tiplocs, run_times)]
+    if both_directions:
+        directions.append((tiplocs[::-1], run_times[::-1]))
+    
+    num_trips = 0
+    for line_tiplocs, line_run_times in directions:
+        for departure in range(first, last + 1, headway):
+            stops = []
+            now = departure
+            for i, tiploc in enumerate(line_tiplocs):
+                arrival = now
+                if i > 0:
+                    now += dwell
+                flags = ((PICK_UP if i < len(line_tiplocs) - 1 else 0) |
+                         (SET_DOWN if i > 0 else 0))
+                stops.append((
+                    tiploc.index,
+                    # NB: Times wrap around midnight (times of exactly
+                    # midnight are nudged since these mean 'no time').
+                    ((arrival % (24 * 60)) * 60 or 30) if i > 0 else -1,
+                    ((now % (24 * 60)) * 60 or 30)
+                    if i < len(line_tiplocs) - 1 else -1,
+                    flags))
+                if i < len(line_run_times):
+                    now += line_run_times[i]
+            timetable.add_trip(
+                "{}{:05d}".format(train_uid_prefix, timetable.num_trips),
+                validity, stops)
+            num_trips += 1
+    return num_trips
+
+
+def add_transfer(from_tiploc, to_tiploc, duration):
+    """Add a (one-way) non-rail transfer between two TIPLOCs taking the
+    specified number of minutes."""
+    dst_segment = TransferSegment(tiploc=to_tiploc, set_down=True)
+    src_segment = TransferSegment(tiploc=from_tiploc,
+                                  destinations=[(dst_segment, None)],
+                                  duration=duration,
+                                  take_up=True)
+    to_tiploc.segments.append(dst_segment)
+    from_tiploc.segments.append(src_segment)
+
+
+def grid_network(size, headway=30, run_time=6, seed=0):
+    """A square grid of stations with a line running along every row and
+    column.
+    
+    Parameters
+    ----------
+    size : int
+        The number of stations along each side of the grid.
+    headway : int
+        The interval between trains (minutes).
+    run_time : int
+        The typical running time between adjacent stations (minutes).
+    seed : int
+        Seed for the (slight) randomisation of running times.
+    
+    Returns
+    -------
+    :py:class:`railmap.route_planner.Schedule`
+    """
+    rng = random.Random(seed)
+    schedule = Schedule()
+    grid = [[add_station(schedule, y * size + x, rng.randint(2, 8))
+             for x in range(size)]
+            for y in range(size)]
+    
+    lines = grid + [list(column) for column in zip(*grid)]
+    for line in lines:
+        run_times = [max(1, run_time + rng.randint(-2, 2))
+                     for _ in range(len(line) - 1)]
+        add_line(schedule, line, run_times,
+                 first=5 * 60 + rng.randrange(headway),
+                 last=23 * 60,
+                 headway=headway,
+                 train_uid_prefix="G")
+    
+    schedule.changed()
+    return schedule
+
+
+def hub_and_spoke_network(spokes, stations_per_spoke, headway=20,
+                          run_time=5, seed=0):
+    """A network of lines radiating from a single hub station.
+    
+    Parameters
+    ----------
+    spokes : int
+        The number of lines radiating from the hub.
+    stations_per_spoke : int
+        The number of stations on each line (excluding the hub).
+    headway : int
+        The interval between trains (minutes).
+    run_time : int
+        The typical running time between adjacent stations (minutes).
+    seed : int
+    
+    Returns
+    -------
+    :py:class:`railmap.route_planner.Schedule`
+    """
+    rng = random.Random(seed)
+    schedule = Schedule()
+    hub = add_station(schedule, 0, change_time=10)
+    
+    n = 1
+    for _ in range(spokes):
+        line = [hub]
+        for _ in range(stations_per_spoke):
+            line.append(add_station(schedule, n, rng.randint(2, 5)))
+            n += 1
+        run_times = [max(1, run_time + rng.randint(-2, 3))
+                     for _ in range(len(line) - 1)]
+        add_line(schedule, line, run_times,
+                 first=5 * 60 + rng.randrange(headway),
+                 last=23 * 60 + 30,
+                 headway=headway,
+                 train_uid_prefix="H")
+    
+    schedule.changed()
+    return schedule
+
+
+def uk_like_network(num_stations, num_intercity_lines=None,
+                    num_local_lines=None, seed=0):
+    """A network loosely resembling the shape of the UK's.
+    
+    Stations are scattered at random over a tall, thin area. A few stations
+    are designated 'major' and are joined by fast, infrequent inter-city lines
+    which only call at major stations. All stations are served by slower,
+    frequent, local lines which meander between nearby stations. A few
+    walking transfers link nearby stations.
+    
+    Parameters
+    ----------
+    num_stations : int
+    num_intercity_lines : int or None
+        Defaults to num_stations // 50 (at least 2).
+    num_local_lines : int or None
+        Defaults to num_stations // 8 (at least 2).
+    seed : int
+    
+    Returns
+    -------
+    :py:class:`railmap.route_planner.Schedule`
+    """
+    rng = random.Random(seed)
+    if num_intercity_lines is None:
+        num_intercity_lines = max(2, num_stations // 50)
+    if num_local_lines is None:
+        num_local_lines = max(2, num_stations // 8)
+    
+    schedule = Schedule()
+    
+    # Station locations (km) in a 300x900 area.
+    stations = [add_station(schedule, n, rng.randint(2, 10))
+                for n in range(num_stations)]
+    locations = [(rng.uniform(0, 300), rng.uniform(0, 900))
+                 for _ in stations]
+    major = stations[:max(2, num_stations // 20)]
+    
+    def distance(a, b):
+        (ax, ay), (bx, by) = locations[a.index], locations[b.index]
+        return math.hypot(ax - bx, ay - by)
+    
+    nearest_cache = {}
+    
+    def nearest(tiploc, candidates, k):
+        key = (tiploc.index, id(candidates), k)
+        if key not in nearest_cache:
+            nearest_cache[key] = sorted(
+                (c for c in candidates if c is not tiploc),
+                key=lambda c: distance(tiploc, c))[:k]
+        return nearest_cache[key]
+    
+    def run_times(line, speed_km_per_min):
+        return [max(1, int(distance(a, b) / speed_km_per_min))
+                for a, b in zip(line, line[1:])]
+    
+    # Inter-city lines: overlapping sections of a north-south 'spine' through
+    # the major stations.
+    spine = sorted(major, key=lambda m: locations[m.index][1])
+    for n in range(num_intercity_lines):
+        if n * 4 < len(spine) - 1:
+            # Ensure the whole spine is covered
+            start = n * 4
+        else:
+            start = rng.randrange(len(spine) - 1)
+        line = spine[start:start + rng.randint(5, 9)]
+        add_line(schedule, line, run_times(line, 2.0),
+                 first=6 * 60 + rng.randrange(60),
+                 last=21 * 60,
+                 headway=rng.choice([30, 60, 120]),
+                 dwell=2,
+                 train_uid_prefix="I")
+    
+    # Local lines: a meandering walk between nearby stations towards the
+    # nearest major station. Any stations left unserved afterwards get a
+    # short line to their nearest served neighbour.
+    served = set()
+    
+    def add_local_line(line):
+        served.update(line)
+        add_line(schedule, line, run_times(line, 1.0),
+                 first=6 * 60 + rng.randrange(30),
+                 last=23 * 60,
+                 headway=rng.choice([15, 30, 30, 60, 60, 120]),
+                 train_uid_prefix="O")
+    
+    for _ in range(num_local_lines):
+        line = [rng.choice(stations)]
+        target = nearest(line[0], major, 1)[0]
+        while line[-1] is not target and len(line) < 30:
+            options = [s for s in nearest(line[-1], stations, 5)
+                       if s not in line]
+            if not options:
+                break
+            line.append(min(rng.sample(options, min(3, len(options))),
+                            key=lambda s: distance(s, target)))
+        if line[-1] is not target:
+            line.append(target)
+        add_local_line(line)
+    
+    for tiploc in stations:
+        if tiploc not in served:
+            add_local_line([tiploc] + nearest(tiploc, list(served), 1))
+    
+    # Walking transfers between some nearby stations
+    for tiploc in rng.sample(stations, max(1, num_stations // 20)):
+        for other in nearest(tiploc, stations, 1):
+            minutes = max(2, int(distance(tiploc, other) * 12))
+            if minutes <= 30:
+                add_transfer(tiploc, other, minutes)
+                add_transfer(other, tiploc, minutes)
+    
+    schedule.changed()
+    return schedule
+
+
+NETWORKS = {
+    "grid": {
+        "small": lambda seed: grid_network(8, seed=seed),
+        "medium": lambda seed: grid_network(16, seed=seed),
+        "large": lambda seed: grid_network(32, seed=seed),
+    },
+    "hub_and_spoke": {
+        "small": lambda seed: hub_and_spoke_network(8, 8, seed=seed),
+        "medium": lambda seed: hub_and_spoke_network(16, 20, seed=seed),
+        "large": lambda seed: hub_and_spoke_network(32, 40, seed=seed),
+    },
+    "uk_like": {
+        "small": lambda seed: uk_like_network(200, seed=seed),
+        "medium": lambda seed: uk_like_network(800, seed=seed),
+        "large": lambda seed: uk_like_network(2500, seed=seed),
+    },
+}
+"""Network generators for each network shape at several scales:
+{shape: {scale: fn(seed) -> Schedule, ...}, ...}."""
@@ -0,0 +1,261 @@
+"""A compact, array-based store of timetabled train services.
+
+Rather than representing every call of every train as an object, each run of
+a train (a 'trip') is stored as a row across a set of flat arrays. The stops
+of a trip occupy a contiguous slice of the per-stop arrays which hold the
+(integer) TIPLOC index, arrival and departure times (seconds past midnight)
+and whether passengers may board or alight. Joins and divisions of trains are
+recorded as links from a stop of one trip to a stop of another.
+
+Many of the stops recorded in the timetable are timing points which a train
+passes without stopping. Since passengers can neither board nor alight at
+these 'pass-through' stops, the index built for route planning links each
+stop directly to the next stop of its trip at which passengers may board or
+alight (see :py:meth:`.Timetable.build_index`). The pass-through stops (and
+their timings) remain in the timetable for display purposes.
+"""
+
+import datetime
+
+from array import array
+
+
+NO_TIME = -1
+"""Arrival/departure time used where no (usable) time is known."""
+
+PICK_UP = 1
+"""Stop flag: passengers may board the train at this stop."""
+
+SET_DOWN = 2
+"""Stop flag: passengers may alight from the train at this stop."""
+
+
+def time_to_seconds(time):
+    """Convert a :py:class:`datetime.time` into seconds past midnight.
+    
+    Returns :py:data:`.NO_TIME` if the time is None or midnight (which the CIF
+    data uses where no time is given).
+    """
+    if time is None or time == datetime.time(0, 0, 0):
+        return NO_TIME
+    else:
+        return (time.hour * 60 * 60) + (time.minute * 60) + time.second
+
+
+def seconds_to_time(seconds):
+    """Convert seconds past midnight into a :py:class:`datetime.time` or None
+    if :py:data:`.NO_TIME`."""
+    if seconds == NO_TIME:
+        return None
+    else:
+        return datetime.time(seconds // (60 * 60),
+                             (seconds // 60) % 60,
+                             seconds % 60)
+
+
+class Timetable(object):
+    """A set of trips stored as flat arrays.
+    
+    Attributes
+    ----------
+    validities : [:py:class:`railmap.route_planner.Validity`, ...]
+        The (de-duplicated) validities referred to by trips and links, indexed
+        by validity ID.
+    train_uids : [str, ...]
+        The train UID of each trip.
+    trip_validity : array
+        The validity ID of each trip.
+    trip_first_stop : array
+        The index of the first stop of each trip. Has one more entry than
+        there are trips such that the stops of trip ``t`` are
+        ``range(trip_first_stop[t], trip_first_stop[t + 1])``.
+    stop_trip : array
+        The trip each stop belongs to.
+    stop_tiploc : array
+        The TIPLOC index of each stop.
+    stop_arrival, stop_departure : array
+        Arrival and departure time of each stop (seconds past midnight) or
+        :py:data:`.NO_TIME`.
+    stop_flags : array
+        :py:data:`.PICK_UP` and :py:data:`.SET_DOWN` flags for each stop.
+    links : {stop: [(stop, validity_id), ...], ...}
+        Join and division links between trips. Passengers may remain on a
+        train from the first stop onto the second (of another trip) on days
+        on which the link's validity is valid.
+    tiploc_first_stop, tiploc_stops : array
+        An index of the stops at each TIPLOC at which passengers may board:
+        the stops at TIPLOC ``i`` are
+        ``tiploc_stops[tiploc_first_stop[i]:tiploc_first_stop[i + 1]]``.
+        Built by :py:meth:`.build_index`.
+    stop_next : array
+        The next stop of the same trip after each stop, or -1 for the last
+        stop of a trip. When :py:attr:`.contract_pass_through` is True,
+        pass-through stops (see :py:meth:`.is_pass_through`) are skipped over.
+        Built by :py:meth:`.build_index`.
+    contract_pass_through : bool
+        Should pass-through stops be skipped in :py:attr:`.stop_next`?
+        Defaults to True.
+    """
+    
+    def __init__(self, contract_pass_through=True):
+        self.validities = []
+        self._validity_ids = {}
+        
+        self.train_uids = []
+        self.trip_validity = array("i")
+        self.trip_first_stop = array("i", [0])
+        
+        self.stop_trip = array("i")
+        self.stop_tiploc = array("i")
+        self.stop_arrival = array("i")
+        self.stop_departure = array("i")
+        self.stop_flags = array("B")
+        
+        self.links = {}
+        self._link_targets = None
+        
+        self.contract_pass_through = contract_pass_through
+        self.tiploc_first_stop = array("i", [0])
+        self.tiploc_stops = array("i")
+        self.stop_next = array("i")
+        self._index_valid = True
+    
+    def __repr__(self):
+        return "<{} {} trips, {} stops>".format(
+            self.__class__.__name__,
+            self.num_trips,
+            self.num_stops,
+        )
+    
+    @property
+    def num_trips(self):
+        return len(self.trip_validity)
+    
+    @property
+    def num_stops(self):
+        return len(self.stop_tiploc)
+    
+    def validity_id(self, validity):
+        """Get the ID of a validity, adding it to the timetable if not already
+        present."""
+        key = (validity.runs_from, validity.runs_to, validity.days_run)
+        validity_id = self._validity_ids.get(key)
+        if validity_id is None:
+            validity_id = self._validity_ids[key] = len(self.validities)
+            self.validities.append(validity)
+        return validity_id
+    
+    def add_trip(self, train_uid, validity, stops):
+        """Add a trip to the timetable.
+        
+        Parameters
+        ----------
+        train_uid : str
+        validity : :py:class:`railmap.route_planner.Validity`
+            The days on which the trip runs.
+        stops : [(tiploc_index, arrival, departure, flags), ...]
+            The stops made by the trip, in order. Times are in seconds past
+            midnight (see :py:func:`.time_to_seconds`).
+        
+        Returns
+        -------
+        int
+            The trip ID.
+        """
+        trip = self.num_trips
+        
+        self.train_uids.append(train_uid)
+        self.trip_validity.append(self.validity_id(validity))
+        
+        for tiploc_index, arrival, departure, flags in stops:
+            self.stop_trip.append(trip)
+            self.stop_tiploc.append(tiploc_index)
+            self.stop_arrival.append(arrival)
+            self.stop_departure.append(departure)
+            self.stop_flags.append(flags)
+        self.trip_first_stop.append(self.num_stops)
+        
+        self._index_valid = False
+        
+        return trip
+    
+    def add_link(self, from_stop, to_stop, validity):
+        """Add a join/division link from one stop to the stop of another
+        trip."""
+        self.links.setdefault(from_stop, []).append(
+            (to_stop, self.validity_id(validity)))
+        self._link_targets = None
+        self._index_valid = False
+    
+    def trip_stops(self, trip):
+        """Get the range of stop indices of a trip."""
+        return range(self.trip_first_stop[trip], self.trip_first_stop[trip + 1])
+    
+    def is_pass_through(self, stop):
+        """Test whether a stop is one at which passengers may neither board
+        nor alight and which is not the end of a join/division link.
+        
+        Such stops need never be considered while route planning.
+        """
+        if self._link_targets is None:
+            self._link_targets = set(to_stop
+                                     for to_stops in self.links.values()
+                                     for to_stop, _validity_id in to_stops)
+        return (self.stop_flags[stop] == 0 and
+                stop not in self.links and
+                stop not in self._link_targets)
+    
+    def build_index(self, num_tiplocs):
+        """(Re)build the index of stops at each TIPLOC and the
+        :py:attr:`.stop_next` array if the timetable has changed since they
+        were last built.
+        
+        Parameters
+        ----------
+        num_tiplocs : int
+            The number of TIPLOCs (which may include TIPLOCs without any
+            stops).
+        """
+        if self._index_valid and len(self.tiploc_first_stop) == num_tiplocs + 1:
+            return
+        
+        stop_flags = self.stop_flags
+        
+        # Counting sort of (boardable) stop indices by TIPLOC
+        counts = array("i", [0]) * (num_tiplocs + 1)
+        for stop, tiploc_index in enumerate(self.stop_tiploc):
+            if stop_flags[stop] & PICK_UP:
+                counts[tiploc_index + 1] += 1
+        for i in range(num_tiplocs):
+            counts[i + 1] += counts[i]
+        
+        self.tiploc_first_stop = array("i", counts)
+        tiploc_stops = array("i", [0]) * counts[num_tiplocs]
+        for stop, tiploc_index in enumerate(self.stop_tiploc):
+            if stop_flags[stop] & PICK_UP:
+                tiploc_stops[counts[tiploc_index]] = stop
+                counts[tiploc_index] += 1
+        self.tiploc_stops = tiploc_stops
+        
+        # Link each stop to the next (non-pass-through) stop of its trip,
+        # working backwards through each trip.
+        stop_next = array("i", [-1]) * self.num_stops
+        for trip in range(self.num_trips):
+            next_stop = -1
+            for stop in reversed(self.trip_stops(trip)):
+                stop_next[stop] = next_stop
+                if not (self.contract_pass_through and
+                        self.is_pass_through(stop)):
+                    next_stop = stop
+        self.stop_next = stop_next
+        
+        self._index_valid = True
+    
+    @property
+    def nbytes(self):
+        """The approximate memory used by the per-trip and per-stop arrays."""
+        return sum(a.itemsize * len(a) for a in (
+            self.trip_validity, self.trip_first_stop,
+            self.stop_trip, self.stop_tiploc,
+            self.stop_arrival, self.stop_departure, self.stop_flags,
+            self.tiploc_first_stop, self.tiploc_stops, self.stop_next))
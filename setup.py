@@ -4,7 +4,7 @@ import sys
 with open("railmap/version.py", "r") as f:
     exec(f.read())
 
-requirements = ["enum_compat", "pyshp", "dbf", "cairocffi"]
+requirements = ["enum_compat", "numpy", "dbf", "cairocffi"]
 
 setup(
     name="railmap",
@@ -26,6 +26,10 @@ setup(
             "railmap_station_times = railmap.scripts.station_times:main",
             "railmap_add_station_info = railmap.scripts.add_station_info:main",
             "railmap_draw = railmap.scripts.draw_railmap:main",
+            "railmap_draw_tiles = railmap.scripts.draw_tiles:main",
+            "railmap_isochrones = railmap.scripts.isochrones:main",
+            "railmap_serve = railmap.scripts.serve:main",
+            "railmap_benchmark = railmap.scripts.benchmark:main",
         ],
     }
 )
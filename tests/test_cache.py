@@ -0,0 +1,72 @@
+import pickle
+import datetime
+
+from railmap.route_planner import Schedule
+from railmap.synthetic import add_station, add_line, add_transfer
+from railmap.cache import load_cached
+
+
+def make_chained_schedule(num_stations=300):
+    # A long chain of stations linked by transfers (in both directions) with a
+    # line along it and one station made up of two TIPLOCs.
+    schedule = Schedule()
+    tiplocs = [add_station(schedule, n, change_time=n % 4)
+               for n in range(num_stations)]
+    for a, b in zip(tiplocs, tiplocs[1:]):
+        add_transfer(a, b, 10)
+        add_transfer(b, a, 12)
+    add_line(schedule, tiplocs[::10], [7] * (len(tiplocs[::10]) - 1),
+             6 * 60, 22 * 60, 30)
+    tiplocs[1].same_station = tiplocs[2].same_station = set(tiplocs[1:3])
+    tiplocs[2].three_alpha_code = tiplocs[1].three_alpha_code
+    schedule.changed()
+    return schedule
+
+
+def test_load_cached_schedule_with_transfers(tmp_path):
+    schedule = make_chained_schedule()
+    
+    # Loaded afresh, then from the cache
+    cached = load_cached(str(tmp_path), "schedule.pickle", lambda: schedule)
+    assert cached is schedule
+    
+    def fail():
+        raise AssertionError("Schedule not loaded from cache")
+    
+    loaded = load_cached(str(tmp_path), "schedule.pickle", fail)
+    assert loaded is not schedule
+    
+    assert list(loaded.tiplocs) == list(schedule.tiplocs)
+    for tiploc, loaded_tiploc in zip(schedule.tiploc_list,
+                                     loaded.tiploc_list):
+        assert loaded.tiplocs[tiploc.code] is loaded_tiploc
+        assert loaded_tiploc.index == tiploc.index
+        assert loaded_tiploc.change_time == tiploc.change_time
+        assert loaded_tiploc.three_alpha_code == tiploc.three_alpha_code
+        assert (sorted(t.code for t in loaded_tiploc.same_station) ==
+                sorted(t.code for t in tiploc.same_station))
+        assert ([repr(s) for s in loaded_tiploc.segments] ==
+                [repr(s) for s in tiploc.segments])
+    
+    # Same-station sets remain shared and segments remain linked
+    t1, t2 = loaded.tiploc_list[1:3]
+    assert t1.same_station is t2.same_station
+    transfer = [s for s in t1.segments if s.destinations][0]
+    dst, _ = transfer.destinations[0]
+    assert dst.tiploc is loaded.tiploc_list[0]
+    assert dst in dst.tiploc.segments
+    assert transfer.duration == 12
+    
+    start_time = datetime.datetime(2016, 8, 15, 8, 0)
+    for end in ["S000299", "S000002", "S000155"]:
+        expected = schedule.plan_route("S000000", end, start_time)
+        actual = loaded.plan_route("S000000", end, start_time)
+        assert actual[0] == expected[0]
+        assert ([repr(s) for s in actual[1]] ==
+                [repr(s) for s in expected[1]])
+
+
+def test_pickle_schedule_with_long_transfer_chain():
+    schedule = make_chained_schedule(2000)
+    loaded = pickle.loads(pickle.dumps(schedule, pickle.HIGHEST_PROTOCOL))
+    assert len(loaded.tiploc_list) == 2000
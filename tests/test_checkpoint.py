@@ -0,0 +1,56 @@
+import json
+import datetime
+
+import pytest
+
+from railmap.checkpoint import Checkpoint, CheckpointMismatchError
+
+
+START = datetime.datetime(2016, 8, 15, 9, 0)
+
+
+def test_resume_after_partial_write(tmp_path):
+    filename = str(tmp_path / "checkpoint.ndjson")
+    
+    checkpoint = Checkpoint(filename, "key")
+    checkpoint.add("AAA", START, [0, 60, -1])
+    checkpoint.add("BBB", START, [60, 0, 120])
+    checkpoint.add("CCC", START, [-1, 120, 0])
+    checkpoint.close()
+    
+    # Simulate the process being killed while writing the last result
+    with open(filename, "rb") as f:
+        data = f.read()
+    with open(filename, "wb") as f:
+        f.write(data[:-10])
+    
+    checkpoint = Checkpoint(filename, "key")
+    assert len(checkpoint) == 2
+    assert ("AAA", START) in checkpoint
+    assert ("BBB", START) in checkpoint
+    assert ("CCC", START) not in checkpoint
+    assert list(checkpoint.get("BBB", START)) == [60, 0, 120]
+    assert checkpoint.get("CCC", START) is None
+    
+    # Complete the remaining work
+    checkpoint.add("CCC", START, [-1, 120, 0])
+    checkpoint.close()
+    
+    checkpoint = Checkpoint(filename, "key")
+    assert len(checkpoint) == 3
+    assert list(checkpoint.get("CCC", START)) == [-1, 120, 0]
+    checkpoint.close()
+    
+    # Every line of the file is complete
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    assert [json.loads(line).get("origin") for line in lines] == [
+        None, "AAA", "BBB", "CCC"]
+
+
+def test_key_mismatch(tmp_path):
+    filename = str(tmp_path / "checkpoint.ndjson")
+    Checkpoint(filename, "key").close()
+    
+    with pytest.raises(CheckpointMismatchError):
+        Checkpoint(filename, "other key")
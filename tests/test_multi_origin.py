@@ -0,0 +1,66 @@
+import random
+import datetime
+
+import pytest
+
+from railmap.route_planner import Schedule
+from railmap.synthetic import NETWORKS, add_station, add_line, add_transfer
+from railmap.multi_origin import MultiOriginScan, UNREACHABLE
+
+
+START_TIMES = [
+    datetime.datetime(2016, 6, 1, 8, 30),
+    datetime.datetime(2016, 6, 1, 17, 45),
+    # Journeys continuing past midnight
+    datetime.datetime(2016, 6, 1, 22, 50),
+]
+
+
+def plan_route_durations(schedule, origin, start_time):
+    """The journey durations found by Schedule.plan_route to each TIPLOC."""
+    schedule.plan_route(origin, None, start_time)
+    return [int((tiploc.visited - start_time).total_seconds())
+            if tiploc.visited is not None else UNREACHABLE
+            for tiploc in schedule.tiploc_list]
+
+
+def assert_engines_agree(schedule, origins, start_time):
+    # NB: Enough days of services are scanned for every journey to be found
+    scan = MultiOriginScan(schedule, days=4, batch_size=3)
+    for origin, durations in scan.one_to_all(origins, start_time):
+        assert (list(durations) ==
+                plan_route_durations(schedule, origin, start_time)), origin
+
+
+@pytest.mark.parametrize("network", sorted(NETWORKS))
+@pytest.mark.parametrize("start_time", START_TIMES)
+def test_synthetic_networks(network, start_time):
+    schedule = NETWORKS[network]["small"](0)
+    rng = random.Random(network)
+    origins = rng.sample(sorted(schedule.tiplocs), 5)
+    assert_engines_agree(schedule, origins, start_time)
+
+
+@pytest.mark.parametrize("start_time", START_TIMES)
+def test_transfers_and_multi_tiploc_stations(start_time):
+    schedule = Schedule()
+    tiplocs = [add_station(schedule, n, change_time=n % 5)
+               for n in range(12)]
+    
+    # Two TIPLOCs of one station
+    tiplocs[3].same_station = tiplocs[4].same_station = set(tiplocs[3:5])
+    tiplocs[4].three_alpha_code = tiplocs[3].three_alpha_code
+    
+    add_line(schedule, tiplocs[0:4], [9, 11, 7], 6 * 60, 23 * 60 + 40, 20)
+    add_line(schedule, tiplocs[4:8], [14, 6, 25], 6 * 60 + 5, 23 * 60, 30)
+    add_line(schedule, [tiplocs[7], tiplocs[9], tiplocs[11]], [40, 35],
+             5 * 60, 23 * 60 + 50, 60, both_directions=False)
+    
+    # Chains of transfers, including one of zero duration
+    add_transfer(tiplocs[2], tiplocs[8], 6)
+    add_transfer(tiplocs[8], tiplocs[10], 12)
+    add_transfer(tiplocs[10], tiplocs[9], 0)
+    add_transfer(tiplocs[6], tiplocs[1], 15)
+    schedule.changed()
+    
+    assert_engines_agree(schedule, [t.code for t in tiplocs], start_time)
@@ -0,0 +1,100 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from railmap.output import open_writer, NpyReader
+from railmap.multi_origin import UNREACHABLE
+
+try:
+    from railmap.scripts.draw_railmap import iter_station_times
+except (ImportError, OSError):
+    # railmap_draw's dependencies (e.g. Cairo) are not available
+    iter_station_times = None
+
+needs_iter_station_times = pytest.mark.skipif(
+    iter_station_times is None, reason="railmap_draw cannot be imported")
+
+
+STATION_CODES = ["AAA", "BBB", "CCC", "DDD"]
+
+RESULTS = [
+    ("AAA", datetime.datetime(2016, 8, 15, 9, 0), [0, 600, UNREACHABLE, 7260]),
+    ("BBB", datetime.datetime(2016, 8, 15, 9, 0), [660, 0, 100000, 3]),
+    ("AAA", datetime.datetime(2016, 8, 15, 17, 30),
+     [0, UNREACHABLE, UNREACHABLE, UNREACHABLE]),
+]
+
+
+def write_results(format, filename, results=RESULTS):
+    writer = open_writer(format, filename, STATION_CODES)
+    for origin, start_time, durations in results:
+        writer.write(origin, start_time, durations)
+    writer.close()
+
+
+def expected_station_times(results=RESULTS):
+    return [
+        (origin, str(start_time), {
+            station: duration
+            for station, duration in zip(STATION_CODES, durations)
+            if duration != UNREACHABLE})
+        for origin, start_time, durations in results]
+
+
+@needs_iter_station_times
+@pytest.mark.parametrize("format", ["csv", "ndjson", "npy"])
+def test_iter_station_times(tmp_path, format):
+    filename = str(tmp_path / "times.{}".format(format))
+    write_results(format, filename)
+    assert list(iter_station_times(filename)) == expected_station_times()
+
+
+def test_npy_numpy_load(tmp_path):
+    filename = str(tmp_path / "times.npy")
+    write_results("npy", filename)
+    
+    matrix = np.load(filename)
+    assert matrix.dtype == np.int32
+    assert matrix.tolist() == [durations for _, _, durations in RESULTS]
+    
+    with open(str(tmp_path / "times.stations.txt")) as f:
+        assert f.read().split() == STATION_CODES
+    with open(str(tmp_path / "times.origins.csv")) as f:
+        assert f.read().splitlines() == [
+            "start_station,start_time",
+            "AAA,2016-08-15 09:00:00",
+            "BBB,2016-08-15 09:00:00",
+            "AAA,2016-08-15 17:30:00",
+        ]
+
+
+def test_npy_reader(tmp_path):
+    filename = str(tmp_path / "times.npy")
+    write_results("npy", filename)
+    
+    reader = NpyReader(filename)
+    assert reader.station_codes == STATION_CODES
+    assert len(reader) == len(RESULTS)
+    assert [(origin, start_time, list(durations))
+            for origin, start_time, durations in reader] == [
+        (origin, str(start_time), durations)
+        for origin, start_time, durations in RESULTS]
+
+
+def test_npy_empty(tmp_path):
+    filename = str(tmp_path / "times.npy")
+    write_results("npy", filename, [])
+    
+    assert np.load(filename).shape == (0, len(STATION_CODES))
+    assert list(NpyReader(filename)) == []
+
+
+def test_npy_reader_rejects_mismatched_sidecar(tmp_path):
+    filename = str(tmp_path / "times.npy")
+    write_results("npy", filename)
+    with open(str(tmp_path / "times.stations.txt"), "a") as f:
+        f.write("EEE\n")
+    
+    with pytest.raises(ValueError):
+        list(NpyReader(filename))
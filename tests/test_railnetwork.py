@@ -0,0 +1,115 @@
+import struct
+
+from railmap.railnetwork import LineGeometry, read_shp
+
+
+def shp_record(number, content):
+    return struct.pack(">ii", number, len(content) // 2) + content
+
+
+def polyline(parts, points, shape_type=3, extra=b""):
+    xs = [x for x, _ in points] or [0.0]
+    ys = [y for _, y in points] or [0.0]
+    return (struct.pack("<i4d", shape_type,
+                        min(xs), min(ys), max(xs), max(ys)) +
+            struct.pack("<ii", len(parts), len(points)) +
+            struct.pack("<{}i".format(len(parts)), *parts) +
+            b"".join(struct.pack("<2d", x, y) for x, y in points) +
+            extra)
+
+
+def make_shp(contents):
+    records = b"".join(shp_record(n, content)
+                       for n, content in enumerate(contents, 1))
+    header = (struct.pack(">i5ii", 9994, 0, 0, 0, 0, 0,
+                          (100 + len(records)) // 2) +
+              struct.pack("<ii8d", 1000, 3, *([0.0] * 8)))
+    return header + records
+
+
+def test_read_shp(tmp_path):
+    filename = str(tmp_path / "lines.shp")
+    with open(filename, "wb") as f:
+        f.write(make_shp([
+            # A multi-part PolyLine
+            polyline([0, 2], [(0, 0), (1, 1), (5, 5), (6, 5), (7, 6)]),
+            # A null shape
+            struct.pack("<i", 0),
+            # An empty part between two others
+            polyline([0, 2, 2], [(10, 0), (11, 0), (12, 0), (13, 0)]),
+            # A PolyLine with no parts
+            polyline([], []),
+            # A PolyLineZ (with Z values following the points)
+            polyline([0], [(20, 1), (21, 2)], shape_type=13,
+                     extra=struct.pack("<4d", 0.0, 1.0, 0.0, 1.0)),
+        ]))
+    
+    assert read_shp(filename).to_lists() == [
+        [(0, 0), (1, 1)],
+        [(5, 5), (6, 5), (7, 6)],
+        [(10, 0), (11, 0)],
+        [(12, 0), (13, 0)],
+        [(20, 1), (21, 2)],
+    ]
+
+
+def test_read_shp_empty(tmp_path):
+    filename = str(tmp_path / "empty.shp")
+    with open(filename, "wb") as f:
+        f.write(make_shp([]))
+    
+    lines = read_shp(filename)
+    assert len(lines) == 0
+    assert lines.bounds is None
+
+
+LINES = [
+    [(0, 0), (1, 0), (2, 0)],
+    [(5, 5), (6, 6)],
+    [(0, 1), (1, 1), (2, 1), (3, 1)],
+    [(9, 9)],
+]
+
+
+def test_subset():
+    lines = LineGeometry.from_lists(LINES)
+    assert lines.subset([2, 0]).to_lists() == [LINES[2], LINES[0]]
+    assert lines.subset([]).to_lists() == []
+
+
+def test_split():
+    lines = LineGeometry.from_lists(LINES)
+    assert lines.split(2).to_lists() == [
+        [(0, 0), (1, 0), (2, 0)],
+        [(5, 5), (6, 6)],
+        [(0, 1), (1, 1), (2, 1)],
+        [(2, 1), (3, 1)],
+        [(9, 9)],
+    ]
+    assert lines.split(1).to_lists() == [
+        [(0, 0), (1, 0)],
+        [(1, 0), (2, 0)],
+        [(5, 5), (6, 6)],
+        [(0, 1), (1, 1)],
+        [(1, 1), (2, 1)],
+        [(2, 1), (3, 1)],
+        [(9, 9)],
+    ]
+
+
+def test_clip():
+    lines = LineGeometry.from_lists([
+        # Leaves and re-enters the rectangle
+        [(-20, 5), (-15, 5), (5, 5), (20, 5), (25, 5), (5, 8)],
+        # Entirely outside (though the 'segments' joining it to its
+        # neighbouring lines cross the rectangle)
+        [(100, 100), (200, 200)],
+        # Entirely inside
+        [(1, 1), (2, 2)],
+    ])
+    assert lines.clip(0, 0, 10, 10).to_lists() == [
+        [(-15, 5), (5, 5), (20, 5)],
+        [(25, 5), (5, 8)],
+        [(1, 1), (2, 2)],
+    ]
+    assert len(lines.clip(-100, -100, -50, -50)) == 0
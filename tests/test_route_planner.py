@@ -0,0 +1,35 @@
+import datetime
+
+from railmap.route_planner import Schedule
+from railmap.synthetic import add_station, add_line, add_transfer
+
+
+def test_plan_route_walk_to_destination_after_reaching_its_station():
+    # Trains from O reach A2 at 09:00 and B at 10:00. A1 and A2 are TIPLOCs of
+    # the same station but only A1 may be reached from B (on foot).
+    schedule = Schedule()
+    o = add_station(schedule, 0, change_time=2)
+    a1 = add_station(schedule, 1, change_time=2)
+    a2 = add_station(schedule, 2, change_time=2)
+    b = add_station(schedule, 3, change_time=2)
+    a1.same_station = a2.same_station = set([a1, a2])
+    a2.three_alpha_code = a1.three_alpha_code
+    add_line(schedule, [o, a2], [30], 8 * 60 + 30, 8 * 60 + 30, 60,
+             both_directions=False)
+    add_line(schedule, [o, b], [30], 9 * 60 + 30, 9 * 60 + 30, 60,
+             both_directions=False)
+    add_transfer(b, a1, 5)
+    schedule.changed()
+    
+    end_time, segments = schedule.plan_route(
+        o.code, a1.code, datetime.datetime(2016, 8, 15, 8, 0))
+    
+    # Arriving at A2 does not count as arriving at A1; the walk from B
+    # (allowing B's change time) does.
+    assert end_time == datetime.datetime(2016, 8, 15, 10, 7)
+    assert segments[-1].tiploc is a1
+    
+    # Reaching every TIPLOC, A1 is first reached via A2
+    assert schedule.plan_route(
+        o.code, None, datetime.datetime(2016, 8, 15, 8, 0)) is None
+    assert a1.visited == datetime.datetime(2016, 8, 15, 9, 0)